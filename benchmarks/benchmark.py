@@ -0,0 +1,274 @@
+""" Measure the throughput of the editing pipeline on a synthetic corpus
+and print the results as JSON, so that they can be compared between commits.
+
+Every benchmark runs in a separate process, so that its peak memory usage
+(the maximal resident set size, in KiB) is measured separately.
+"""
+import os
+import re
+import sys
+import json
+import time
+import platform
+import subprocess
+from os import path
+from argparse import ArgumentParser
+from collections.abc import Callable
+from tempfile import TemporaryDirectory
+from typing import Any
+from synthetic_corpus import (CorpusParameters, generate_corpus, read_parameters, write_large_document,
+                              add_parameter_arguments, parameters_from_arguments)
+
+SOURCE_DIRECTORY = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'src')
+sys.path.insert(0, SOURCE_DIRECTORY)
+from morph import DEFAULT_PARSE_CACHE_SIZE
+
+try:
+  import resource
+except ImportError:
+  # Not available on Windows: the memory usage is not reported there.
+  resource = None  # type: ignore[assignment]
+
+mrp_attribute = re.compile(r' mrp[0-9]+="([^"]*)"')
+
+def peak_rss(include_children: bool = False) -> int | None:
+  """ The maximal resident set size of this process
+  or of the largest of its finished child processes in KiB.
+  """
+  if resource is None:
+    return None
+  usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  if include_children:
+    usage = max(usage, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+  if sys.platform == 'darwin':
+    usage //= 1024
+  return usage
+
+def corpus_files(directory: str) -> list[str]:
+  filenames = list[str]()
+  for dirpath, _, files in os.walk(path.join(directory, 'input')):
+    filenames.extend(path.join(dirpath, filename) for filename in files if filename.endswith('.xml'))
+  return sorted(filenames)
+
+def read_text(filename: str) -> str:
+  with open(filename, 'r', encoding='utf-8') as fin:
+    return fin.read()
+
+def read_changes(directory: str) -> dict[str, list[str]]:
+  with open(path.join(directory, 'Changes.json'), 'r', encoding='utf-8') as fin:
+    changes: dict[str, list[str]] = json.load(fin)['changes']
+  return changes
+
+def best_time(function: Callable[[], Any], repeat: int) -> float:
+  """ The shortest of the running times of a function, in seconds. """
+  times = list[float]()
+  for _ in range(repeat):
+    start = time.perf_counter()
+    function()
+    times.append(time.perf_counter() - start)
+  return min(times)
+
+def benchmark_morph_parse(directory: str, repeat: int, args: Any) -> dict[str, Any]:
+  """ Parse all the morph. analyses of the corpus without the cache. """
+  from morph import Morph
+  analyses = [value for filename in corpus_files(directory)
+              for value in mrp_attribute.findall(read_text(filename))]
+  seconds = best_time(lambda: [Morph.parse(analysis) for analysis in analyses], repeat)
+  return {'analyses': len(analyses), 'seconds': seconds, 'analyses_per_second': len(analyses) / seconds}
+
+def benchmark_soup_modifier(directory: str, repeat: int, args: Any) -> dict[str, Any]:
+  """ Apply the changes to the parsed documents. Parsing is not measured. """
+  from bs4 import BeautifulSoup
+  from soup_modifier import SoupModifier
+  from change_sets import ChangeSet
+  from morph import set_parse_cache_size
+  modifier = SoupModifier([ChangeSet('Changes.json', read_changes(directory), [])])
+  texts = [(filename, read_text(filename)) for filename in corpus_files(directory)]
+  times = list[float]()
+  words = 0
+  for _ in range(repeat):
+    set_parse_cache_size(args.parse_cache_size)
+    soups = [(filename, BeautifulSoup(text, 'xml')) for filename, text in texts]
+    words = sum(len(soup('w')) for _, soup in soups)
+    start = time.perf_counter()
+    for filename, soup in soups:
+      modifier(soup, filename)
+    times.append(time.perf_counter() - start)
+  seconds = min(times)
+  return {'files': len(texts), 'words': words, 'seconds': seconds,
+          'files_per_second': len(texts) / seconds, 'words_per_second': words / seconds}
+
+def benchmark_merge_identical_options(directory: str, repeat: int, args: Any) -> dict[str, Any]:
+  """ Merge the identical options of all the analyses with options in the corpus. """
+  from morph import Morph, MultiMorph
+  from option_merger import merge_identical_options
+  from selections import Selections
+  morphs = list[MultiMorph]()
+  for filename in corpus_files(directory):
+    for value in mrp_attribute.findall(read_text(filename)):
+      morph = Morph.parse(value)
+      if isinstance(morph, MultiMorph):
+        morphs.append(morph)
+  selections = ['1a', '1b']
+  seconds = best_time(lambda: [merge_identical_options('1', morph, Selections(selections)) for morph in morphs], repeat)
+  return {'analyses': len(morphs), 'seconds': seconds, 'analyses_per_second': len(morphs) / seconds}
+
+def run_edit_corpus(working_directory: str, config: dict[str, Any], jobs: int = 1) -> float:
+  """ Run edit_corpus.py with the given configuration in the working directory
+  and return its running time in seconds.
+  """
+  with open(path.join(working_directory, 'config.json'), 'w', encoding='utf-8') as fout:
+    json.dump(config, fout)
+  command = [sys.executable, path.join(SOURCE_DIRECTORY, 'edit_corpus.py'), '--full', '--jobs', str(jobs)]
+  start = time.perf_counter()
+  subprocess.run(command, cwd=working_directory, check=True,
+                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+  return time.perf_counter() - start
+
+def benchmark_edit_corpus(directory: str, repeat: int, args: Any) -> dict[str, Any]:
+  """ Run edit_corpus.py on the whole corpus, as a user would. """
+  files = corpus_files(directory)
+  words = sum(read_text(filename).count('<w ') for filename in files)
+  times = list[float]()
+  for _ in range(repeat):
+    with TemporaryDirectory() as working_directory:
+      config = {'changesFile': path.join(directory, 'Changes.json'),
+                'inputDirectory': path.join(directory, 'input'),
+                'outputDirectory': path.join(working_directory, 'output')}
+      config.update(json.loads(args.config))
+      times.append(run_edit_corpus(working_directory, config, args.jobs))
+  seconds = min(times)
+  return {'files': len(files), 'words': words, 'jobs': args.jobs, 'seconds': seconds,
+          'files_per_second': len(files) / seconds, 'words_per_second': words / seconds}
+
+def files_equal(first: str, second: str) -> bool:
+  with open(first, 'rb') as first_file, open(second, 'rb') as second_file:
+    while len(block := first_file.read(1 << 20)) > 0:
+      if block != second_file.read(1 << 20):
+        return False
+    return len(second_file.read(1)) == 0
+
+def benchmark_streaming(directory: str, repeat: int, args: Any) -> dict[str, Any]:
+  """ Run edit_corpus.py with the stream buffer on a single large document of two sizes
+  (a quarter of --large-file-mb and the full size) and check that the peak memory usage
+  does not grow with the size of the document. The output of a small document
+  is checked to be the same as without the stream buffer.
+  """
+  parameters = read_parameters(directory)
+  config = {'changesFile': path.join(directory, 'Changes.json')}
+  config.update(json.loads(args.config))
+  with TemporaryDirectory() as working_directory:
+    input_directory = path.join(working_directory, 'input')
+    os.makedirs(input_directory)
+    document = path.join(input_directory, 'SYN.0.xml')
+    output_document = path.join(working_directory, 'output', 'SYN.0.xml')
+    peaks = list[int | None]()
+    sizes = [args.large_file_mb << 18, args.large_file_mb << 20]
+    seconds = 0.0
+    for size in sizes:
+      write_large_document(document, parameters, size)
+      with TemporaryDirectory() as output_directory:
+        streamed_config = dict(config, inputDirectory=input_directory, outputDirectory=output_directory,
+                               streamBuffer=args.stream_buffer)
+        seconds = run_edit_corpus(working_directory, streamed_config)
+      # The peak of all finished child processes, which only grows if this run has used more memory.
+      peaks.append(peak_rss(include_children=True))
+    size = path.getsize(document)
+    # The normal mode needs far more memory, so the output is compared on a small document.
+    write_large_document(document, parameters, 1 << 21)
+    outputs = [path.join(working_directory, name) for name in ('output', 'streamed')]
+    run_edit_corpus(working_directory, dict(config, inputDirectory=input_directory, outputDirectory=outputs[0]))
+    run_edit_corpus(working_directory, dict(config, inputDirectory=input_directory, outputDirectory=outputs[1],
+                                            streamBuffer=1 << 16))
+    identical = files_equal(path.join(outputs[0], 'SYN.0.xml'), path.join(outputs[1], 'SYN.0.xml'))
+  small_peak, large_peak = peaks
+  flat = None
+  if small_peak is not None and large_peak is not None:
+    # The growth of the memory usage should be far less than the growth of the document.
+    flat = (large_peak - small_peak) * 1024 < (sizes[1] - sizes[0]) // 10
+  assert identical, 'The streamed output differs from the normal output.'
+  assert flat is not False, 'The memory usage grows with the size of the document.'
+  return {'bytes': size, 'stream_buffer': args.stream_buffer, 'seconds': seconds,
+          'mib_per_second': size / (1 << 20) / seconds, 'identical': identical, 'flat_memory': flat,
+          'peak_rss_kib_quarter_size': small_peak, 'peak_rss_kib_full_size': large_peak}
+
+BENCHMARKS: dict[str, Callable[[str, int, Any], dict[str, Any]]] = {
+  'morph_parse': benchmark_morph_parse,
+  'soup_modifier': benchmark_soup_modifier,
+  'merge_identical_options': benchmark_merge_identical_options,
+  'edit_corpus': benchmark_edit_corpus,
+  'streaming': benchmark_streaming,
+}
+
+def run_in_subprocess(name: str, directory: str, args: Any) -> dict[str, Any]:
+  """ Run a single benchmark in a new process and return its results. """
+  command = [sys.executable, path.abspath(__file__), '--single', name, '--corpus', directory,
+             '--repeat', str(args.repeat), '--jobs', str(args.jobs), '--config', args.config,
+             '--parse-cache-size', str(args.parse_cache_size), '--large-file-mb', str(args.large_file_mb),
+             '--stream-buffer', str(args.stream_buffer)]
+  completed = subprocess.run(command, check=True, capture_output=True, text=True)
+  results: dict[str, Any] = json.loads(completed.stdout)
+  return results
+
+def current_commit() -> str | None:
+  try:
+    completed = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SOURCE_DIRECTORY,
+                               capture_output=True, text=True, check=True)
+  except (OSError, subprocess.CalledProcessError):
+    return None
+  return completed.stdout.strip()
+
+def run_benchmarks(directory: str, parameters: CorpusParameters, args: Any) -> dict[str, Any]:
+  results = dict[str, Any]()
+  for name in args.benchmarks:
+    print('Running {0}'.format(name), file=sys.stderr)
+    results[name] = run_in_subprocess(name, directory, args)
+  return {
+    'commit': current_commit(),
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'parameters': parameters._asdict(),
+    'config': json.loads(args.config),
+    'benchmarks': results,
+  }
+
+def main() -> None:
+  parser = ArgumentParser(description=__doc__)
+  parser.add_argument('--corpus', help='directory of the corpus, generated unless it already '
+                      'contains one (a temporary directory by default)')
+  parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+  parser.add_argument('--repeat', type=int, default=3, help='number of runs, the fastest one is reported')
+  parser.add_argument('--jobs', type=int, default=1, help='number of processes of edit_corpus.py')
+  parser.add_argument('--config', default='{}', help='additional settings of config.json as JSON')
+  parser.add_argument('--parse-cache-size', type=int, default=DEFAULT_PARSE_CACHE_SIZE)
+  parser.add_argument('--large-file-mb', type=int, default=300,
+                      help='size of the large document of the streaming benchmark in MiB')
+  parser.add_argument('--stream-buffer', type=int, default=1 << 20,
+                      help='size of the stream buffer in the streaming benchmark in bytes')
+  parser.add_argument('--output', help='file to write the results into instead of the standard output')
+  parser.add_argument('--single', choices=list(BENCHMARKS), help='run a single benchmark in this process')
+  add_parameter_arguments(parser)
+  args = parser.parse_args()
+  if args.single is not None:
+    results = BENCHMARKS[args.single](args.corpus, args.repeat, args)
+    results['peak_rss_kib'] = peak_rss(include_children=args.single in ('edit_corpus', 'streaming'))
+    print(json.dumps(results))
+    return
+  parameters = parameters_from_arguments(args)
+  with TemporaryDirectory() as temporary_directory:
+    directory = args.corpus or temporary_directory
+    if path.exists(path.join(directory, 'Changes.json')):
+      parameters = read_parameters(directory)
+    else:
+      print('Generating the corpus in {0}'.format(directory), file=sys.stderr)
+      generate_corpus(directory, parameters)
+    report = run_benchmarks(directory, parameters, args)
+  content = json.dumps(report, indent=1)
+  if args.output is None:
+    print(content)
+  else:
+    with open(args.output, 'w', encoding='utf-8') as fout:
+      fout.write(content + '\n')
+
+if __name__ == '__main__':
+  main()
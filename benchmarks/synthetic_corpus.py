@@ -0,0 +1,165 @@
+""" Generate reproducible synthetic corpora in the TIVE XML format
+together with the files of changes to be applied to them.
+"""
+import os
+import json
+from os import path
+from random import Random
+from argparse import ArgumentParser
+from typing import Any, NamedTuple
+
+TAGS = ['.ABS', '.ERG', '.ESS', '.GEN', '.DAT', '.COM', '.ABL', '.INSTR',
+        'NEG-MOD.PAT', 'CAUS-FUT-3A.SG', 'PST-3A.SG', 'INTR-IMP']
+POS = ['noun', 'verb', 'adj', 'pron']
+LETTERS = 'abcdefgh'
+WORDS_PER_LINE = 8
+PARAMETERS_FILE = 'parameters.json'
+
+class CorpusParameters(NamedTuple):
+  """ The shape of a synthetic corpus.
+
+  :param files: The number of XML files.
+  :param words_per_file: The number of words in each file.
+  :param hurrian_ratio: The share of lines marked as Hurrian.
+  :param max_analyses: The maximal number of morph. analyses (mrpN) of a word.
+  :param max_options: The maximal number of morph. tag options of an analysis.
+  :param multi_ratio: The share of analyses with morph. tag options.
+  :param vocabulary: The number of distinct analyses occurring in the corpus.
+  :param changes: The number of analyses to be replaced.
+  :param seed: The seed of the random generator.
+  """
+  files: int = 100
+  words_per_file: int = 500
+  hurrian_ratio: float = 0.8
+  max_analyses: int = 3
+  max_options: int = 3
+  multi_ratio: float = 0.5
+  vocabulary: int = 5000
+  changes: int = 200
+  seed: int = 1
+
+def make_morph_info(random: Random, parameters: CorpusParameters) -> str:
+  if random.random() < parameters.multi_ratio:
+    option_count = random.randint(1, parameters.max_options)
+    return ' '.join('{{ {0} → {1}}}'.format(LETTERS[i], random.choice(TAGS))
+                    for i in range(option_count))
+  else:
+    return random.choice(TAGS)
+
+def make_vocabulary(random: Random, parameters: CorpusParameters) -> list[str]:
+  """ Generate the distinct morph. analyses used in the corpus. """
+  vocabulary = list[str]()
+  for i in range(parameters.vocabulary):
+    segmentation = 'stem{0}-{1}'.format(i // 4, LETTERS[i % 4])
+    translation = 'meaning{0}'.format(i // 4)
+    morph_info = make_morph_info(random, parameters)
+    vocabulary.append('{0} @ {1} @ {2} @ {3} @ '.format(
+      segmentation, translation, morph_info, random.choice(POS)))
+  return vocabulary
+
+def make_word(random: Random, parameters: CorpusParameters, vocabulary: list[str]) -> str:
+  analysis_count = random.randint(1, parameters.max_analyses)
+  attributes = ['trans="word"']
+  selections = list[str]()
+  for index in range(1, analysis_count + 1):
+    analysis = random.choice(vocabulary)
+    attributes.append('mrp{0}="{1}"'.format(index, analysis))
+    if random.random() < 0.3:
+      selections.append(str(index) + ('a' if '{' in analysis else ''))
+  if len(selections) > 0:
+    attributes.insert(1, 'mrp0sel=" {0}"'.format(' '.join(selections)))
+  return '<w {0}>wo-rd</w>'.format(' '.join(attributes))
+
+def document_start(number: int) -> str:
+  return '\n'.join(['<?xml version="1.0" encoding="UTF-8"?>',
+                    '<AOxml>',
+                    '<AOHeader><docID>SYN.{0}</docID></AOHeader>'.format(number),
+                    '<body><div1 type="AO_TxtPubl">',
+                    '<text xml:lang="XXXlang">']) + '\n'
+
+DOCUMENT_END = '</text></div1></body></AOxml>\n'
+
+def make_line(random: Random, parameters: CorpusParameters, vocabulary: list[str],
+              number: int, line_number: int, word_count: int) -> list[str]:
+  """ Generate a line break (lb) tag followed by the words of the line. """
+  language = 'Hur' if random.random() < parameters.hurrian_ratio else 'Hit'
+  words = ['<lb txtid="SYN.{0}" lnr="Vs. {1}" lg="{2}"/>'.format(number, line_number, language)]
+  for _ in range(word_count):
+    words.append(make_word(random, parameters, vocabulary))
+  return words
+
+def make_document(random: Random, parameters: CorpusParameters, vocabulary: list[str], number: int) -> str:
+  words = list[str]()
+  for start in range(0, parameters.words_per_file, WORDS_PER_LINE):
+    words.extend(make_line(random, parameters, vocabulary, number, start // WORDS_PER_LINE + 1,
+                           min(WORDS_PER_LINE, parameters.words_per_file - start)))
+  return document_start(number) + '\n'.join(words) + '\n' + DOCUMENT_END
+
+def write_large_document(filename: str, parameters: CorpusParameters, size: int) -> None:
+  """ Write a single document of at least the given size in bytes, whose words come from
+  the vocabulary of the corpus generated with the same parameters. The document is written
+  line by line, so it is never held in memory.
+  """
+  random = Random(parameters.seed)
+  vocabulary = make_vocabulary(random, parameters)
+  with open(filename, 'w', encoding='utf-8') as fout:
+    written = fout.write(document_start(0))
+    line_number = 0
+    while written < size:
+      line_number += 1
+      line = '\n'.join(make_line(random, parameters, vocabulary, 0, line_number, WORDS_PER_LINE)) + '\n'
+      written += fout.write(line)
+    fout.write(DOCUMENT_END)
+
+def make_changes(random: Random, parameters: CorpusParameters, vocabulary: list[str]) -> dict[str, list[str]]:
+  """ Choose the analyses to be replaced and their replacements.
+  Every third analysis is split into two.
+  """
+  changes = dict[str, list[str]]()
+  for i, analysis in enumerate(random.sample(vocabulary, min(parameters.changes, len(vocabulary)))):
+    segmentation, translation, _, pos, _ = analysis.split(' @ ')
+    replacements = list[str]()
+    for _ in range(2 if i % 3 == 0 else 1):
+      morph_info = make_morph_info(random, parameters)
+      replacements.append('{0} @ {1} @ {2} @ {3} @ '.format(segmentation, translation, morph_info, pos))
+    changes[analysis] = replacements
+  return changes
+
+def generate_corpus(directory: str, parameters: CorpusParameters) -> None:
+  """ Write a corpus into the folder "input" of the given directory,
+  the changes into the file "Changes.json" next to it and the parameters
+  into the file "parameters.json". The same parameters always produce the same corpus.
+  """
+  random = Random(parameters.seed)
+  vocabulary = make_vocabulary(random, parameters)
+  for number in range(parameters.files):
+    folder = path.join(directory, 'input', 'folder{0}'.format(number // 50))
+    os.makedirs(folder, exist_ok=True)
+    filename = path.join(folder, 'SYN.{0}.xml'.format(number))
+    with open(filename, 'w', encoding='utf-8') as fout:
+      fout.write(make_document(random, parameters, vocabulary, number))
+  changes = make_changes(random, parameters, vocabulary)
+  with open(path.join(directory, 'Changes.json'), 'w', encoding='utf-8') as fout:
+    json.dump({'changes': changes}, fout, ensure_ascii=False, indent=1)
+  with open(path.join(directory, PARAMETERS_FILE), 'w', encoding='utf-8') as fout:
+    json.dump(parameters._asdict(), fout, indent=1)
+
+def read_parameters(directory: str) -> CorpusParameters:
+  """ Read the parameters of a corpus generated earlier. """
+  with open(path.join(directory, PARAMETERS_FILE), 'r', encoding='utf-8') as fin:
+    return CorpusParameters(**json.load(fin))
+
+def add_parameter_arguments(parser: ArgumentParser) -> None:
+  """ Add an option for every corpus parameter. """
+  for name, default in CorpusParameters._field_defaults.items():
+    parser.add_argument('--' + name.replace('_', '-'), type=type(default), default=default)
+
+def parameters_from_arguments(args: Any) -> CorpusParameters:
+  return CorpusParameters(**{name: getattr(args, name) for name in CorpusParameters._fields})
+
+if __name__ == '__main__':
+  parser = ArgumentParser(description=__doc__)
+  parser.add_argument('directory')
+  add_parameter_arguments(parser)
+  args = parser.parse_args()
+  generate_corpus(args.directory, parameters_from_arguments(args))
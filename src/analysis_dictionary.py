@@ -0,0 +1,91 @@
+import json
+from collections import Counter
+from morph import lookup_key_of, parse_morph
+
+class AnalysisDictionary:
+  """ The morphological analyses of the Hurrian words of the corpus, each by its lookup key,
+  with the word forms (the attribute "trans" of the words) it is attested with and their counts.
+  The dictionaries of separate files or runs are merged by adding their counts.
+  """
+
+  def __init__(self) -> None:
+    self.forms = dict[str, Counter[str]]()
+
+  def __len__(self) -> int:
+    return len(self.forms)
+
+  def add(self, analysis: str, form: str) -> None:
+    """ Count an analysis given as a string for a word form.
+    Analyses which cannot be parsed are left out.
+    """
+    key = lookup_key_of(analysis)
+    if key is None:
+      try:
+        morph = parse_morph(analysis)
+      except ValueError:
+        return
+      if morph is None:
+        return
+      key = morph.lookup_key
+    forms = self.forms.get(key)
+    if forms is None:
+      forms = self.forms[key] = Counter[str]()
+    forms[form] += 1
+
+  def update(self, other: 'AnalysisDictionary') -> None:
+    """ Add the counts of another dictionary to this one. """
+    for key, forms in other.forms.items():
+      if key in self.forms:
+        self.forms[key].update(forms)
+      else:
+        self.forms[key] = Counter(forms)
+
+  def save(self, filename: str) -> None:
+    """ Write the dictionary as JSON sorted by the analyses and the word forms
+    and indented by tabs, like "jq -S --tab" does, so that it can be compared with diff.
+    """
+    content = {key: dict(sorted(forms.items())) for key, forms in sorted(self.forms.items())}
+    with open(filename, 'w', encoding='utf-8') as fout:
+      json.dump(content, fout, ensure_ascii=False, indent='\t')
+      fout.write('\n')
+
+  @classmethod
+  def load(cls, filename: str) -> 'AnalysisDictionary':
+    dictionary = cls()
+    with open(filename, 'r', encoding='utf-8') as fin:
+      content: dict[str, dict[str, int]] = json.load(fin)
+    for key, forms in content.items():
+      dictionary.forms[key] = Counter(forms)
+    return dictionary
+
+def merge_dictionaries(filenames: list[str], output_filename: str) -> AnalysisDictionary:
+  """ Merge the dictionaries written by separate runs, e.g. over parts of the corpus, into one. """
+  merged = AnalysisDictionary()
+  for filename in filenames:
+    merged.update(AnalysisDictionary.load(filename))
+  merged.save(output_filename)
+  return merged
+
+if __name__ == '__main__':
+  import tempfile
+  from os import path
+  print('Test started')
+  first = AnalysisDictionary()
+  first.add('nāli @ Rehbock @ { a → .ABS} @ noun @ ', 'na-a-li')
+  first.add('nāli@Rehbock@.ABS@noun@', 'na-a-li')
+  first.add('nāli @ Rehbock', 'na-a-li')
+  second = AnalysisDictionary()
+  second.add('nāli @ Rehbock @ .ABS @ noun @ ', 'na-li')
+  second.add('ewri @ Herr @ .DAT @ noun @ ', 'e-ep-ri')
+  with tempfile.TemporaryDirectory() as directory:
+    filenames = [path.join(directory, 'first.json'), path.join(directory, 'second.json')]
+    first.save(filenames[0])
+    second.save(filenames[1])
+    merged_filename = path.join(directory, 'Dictionary.json')
+    merged = merge_dictionaries(filenames, merged_filename)
+    assert merged.forms == {'nāli @ Rehbock @ .ABS @ noun @ ': {'na-a-li': 2, 'na-li': 1},
+                            'ewri @ Herr @ .DAT @ noun @ ': {'e-ep-ri': 1}}, merged.forms
+    with open(merged_filename, 'r', encoding='utf-8') as fin:
+      assert fin.read() == ('{\n\t"ewri @ Herr @ .DAT @ noun @ ": {\n\t\t"e-ep-ri": 1\n\t},\n'
+                            '\t"nāli @ Rehbock @ .ABS @ noun @ ": {\n\t\t"na-a-li": 2,\n\t\t"na-li": 1\n\t}\n}\n')
+  print('Test passed')
@@ -0,0 +1,241 @@
+import re
+from collections.abc import Iterator
+from typing import BinaryIO, Protocol
+from soup_modifier import SoupModifier, Attributes
+from change_sets import ChangeSet
+
+# Markup in which a line or word tag is not to be looked for, and the start of such tags.
+markup = re.compile(
+  rb'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<\?.*?\?>|<!DOCTYPE(?:[^\[>]|\[.*?\])*>|<(?P<name>lb|w)(?=[\s/>])',
+  re.DOTALL
+)
+attribute = re.compile(rb'(\s+)([^\s=/>]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+tag_end = re.compile(rb'\s*/?>')
+# The start of markup in which tags are not to be looked for, which may be incomplete at the end of a chunk.
+markup_opening = re.compile(rb'<(?:!--|!\[CDATA\[|\?|!DOCTYPE)')
+reference = re.compile(r'&(?:#x([0-9a-fA-F]+)|#([0-9]+)|(amp|lt|gt|quot|apos));')
+line_break = re.compile(r'\r\n|[\t\n\r]')
+
+predefined_entities = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+escapes = {'&': '&amp;', '<': '&lt;', '>': '&gt;', '\t': '&#9;', '\n': '&#10;', '\r': '&#13;'}
+special_characters = re.compile('[&<>\t\n\r]')
+
+class BinarySource(Protocol):
+  """ A binary file which is only read, such as a HashingReader. """
+  def read(self, size: int = -1) -> bytes: ...
+
+def replace_reference(match: re.Match[str]) -> str:
+  hexadecimal, decimal, entity = match.groups()
+  if hexadecimal is not None:
+    return chr(int(hexadecimal, 16))
+  elif decimal is not None:
+    return chr(int(decimal))
+  else:
+    return predefined_entities[entity]
+
+def unescape_attribute_value(raw_value: bytes) -> str:
+  """ Return the value of an attribute as seen by an XML parser:
+  with whitespace normalised and character and entity references replaced.
+  """
+  value = line_break.sub(' ', raw_value.decode('utf-8'))
+  if '&' in value:
+    if '&' in reference.sub('', value):
+      raise ValueError('Unknown entity in the attribute value: {0}'.format(value))
+    value = reference.sub(replace_reference, value)
+  return value
+
+def escape_attribute_value(value: str, quote: str) -> bytes:
+  """ Escape an attribute value to be enclosed in the given quotes. """
+  value = special_characters.sub(lambda match: escapes[match.group()], value)
+  if quote == '"':
+    value = value.replace('"', '&quot;')
+  else:
+    value = value.replace("'", '&apos;')
+  return value.encode('utf-8')
+
+class StartTag:
+  """ A start tag in the source of a document together with the positions
+  of its attributes, so that the changed attributes can be replaced in-place.
+  """
+
+  def __init__(self, data: bytes, start: int, name: str):
+    self.name = name
+    self.attributes = dict[str, str]()
+    # The start and end of each attribute including the preceding whitespace,
+    # the start and end of its value and its quote.
+    self.positions = dict[str, tuple[int, int, int, int, str]]()
+    position = start
+    while (match := attribute.match(data, position)) is not None:
+      key = match.group(2).decode('utf-8')
+      if match.group(3) is not None:
+        value_group, quote = 3, '"'
+      else:
+        value_group, quote = 4, "'"
+      raw_value = match.group(value_group)
+      self.attributes[key] = unescape_attribute_value(raw_value)
+      self.positions[key] = (match.start(), match.end(), match.start(value_group), match.end(value_group), quote)
+      position = match.end()
+    if tag_end.match(data, position) is None:
+      raise ValueError('The {0} tag at byte {1} could not be parsed'.format(name, start))
+    self.insertion_point = position
+
+  def edits(self, attrs: dict[str, str]) -> Iterator[tuple[int, int, bytes]]:
+    """ Compare the original attributes with the modified ones and
+    yield the replacements (start, end and new bytes) to be made in the source.
+    """
+    for key, (start, end, value_start, value_end, quote) in self.positions.items():
+      if key not in attrs:
+        yield start, end, b''
+      elif attrs[key] != self.attributes[key]:
+        yield value_start, value_end, escape_attribute_value(attrs[key], quote)
+    added = [key for key in attrs if key not in self.positions]
+    if len(added) > 0:
+      insertion = b''.join(
+        b' ' + key.encode('utf-8') + b'="' + escape_attribute_value(attrs[key], '"') + b'"'
+        for key in added
+      )
+      yield self.insertion_point, self.insertion_point, insertion
+
+def scan_tags(data: bytes, edits: list[tuple[int, int, bytes]]) -> Iterator[tuple[str, Attributes]]:
+  """ Yield the names and attributes of the line (lb) and word (w) tags in the source.
+  After the attributes of a tag have been modified by the consumer,
+  the corresponding replacements are added to the list of edits.
+  """
+  for match in markup.finditer(data):
+    if match.group('name') is not None:
+      name = match.group('name').decode('ascii')
+      tag = StartTag(data, match.end(), name)
+      attrs = dict(tag.attributes)
+      yield name, attrs
+      edits.extend(tag.edits(attrs))
+
+def splice(data: bytes, edits: list[tuple[int, int, bytes]]) -> bytes:
+  """ Apply the replacements, given in the order of their positions, to the source. """
+  pieces = list[bytes]()
+  position = 0
+  for start, end, replacement in edits:
+    pieces.append(data[position:start])
+    pieces.append(replacement)
+    position = end
+  pieces.append(data[position:])
+  return b''.join(pieces)
+
+def reverse_edits(data: bytes, edits: list[tuple[int, int, bytes]], offset: int = 0) -> Iterator[tuple[int, int, bytes]]:
+  """ Yield the replacements which restore the source from the result of splicing the edits into it,
+  with their positions in the result, to which the offset is added.
+  """
+  for start, end, replacement in edits:
+    yield start + offset, start + offset + len(replacement), data[start:end]
+    offset += len(replacement) - (end - start)
+
+def scan_stream(infile: BinarySource, outfile: BinaryIO, chunk_size: int,
+                reverse: list[tuple[int, int, bytes]] | None = None) -> Iterator[tuple[str, Attributes]]:
+  """ Like scan_tags, but read the source in chunks and write it with the replacements
+  into the output file as soon as the tags in a chunk have been modified.
+  Markup which is incomplete at the end of a chunk is kept for the next one,
+  so the tags found are the same as in the whole source.
+
+  :param reverse: The list to which the replacements restoring the source
+  from the output are added, if given.
+  """
+  data = b''
+  written = 0
+  at_end = False
+  while not at_end:
+    chunk = infile.read(chunk_size)
+    at_end = len(chunk) == 0
+    data += chunk
+    edits = list[tuple[int, int, bytes]]()
+    position = 0
+    end: int | None = None
+    opening = None if at_end else markup_opening.search(data)
+    while True:
+      match = markup.search(data, position)
+      if opening is not None and opening.start() < position:
+        opening = markup_opening.search(data, position)
+      # Markup which has not been matched, although it starts first, is not complete yet.
+      if opening is not None and (match is None or opening.start() < match.start()):
+        end = opening.start()
+        break
+      if match is None:
+        break
+      if match.group('name') is not None:
+        name = match.group('name').decode('ascii')
+        try:
+          tag = StartTag(data, match.end(), name)
+        except ValueError:
+          if at_end:
+            raise
+          end = match.start()
+          break
+        attrs = dict(tag.attributes)
+        yield name, attrs
+        edits.extend(tag.edits(attrs))
+      position = match.end()
+    if end is None:
+      end = len(data)
+      if not at_end:
+        # Keep a tag which may be incomplete, like "<w" at the end of the chunk.
+        last_opening = data.rfind(b'<', position)
+        if last_opening >= 0 and data.find(b'>', last_opening) < 0:
+          end = last_opening
+    if reverse is not None:
+      reverse.extend(reverse_edits(data, edits, written))
+    spliced = splice(data[:end], edits)
+    outfile.write(spliced)
+    written += len(spliced)
+    data = data[end:]
+
+def stream_patches(modifier: SoupModifier, infile: BinarySource, outfile: BinaryIO, rel_name: str,
+                   chunk_size: int, reverse: list[tuple[int, int, bytes]] | None = None) -> bool:
+  """ Apply the changes like edit_with_patches, but read the source in chunks and write
+  the result into the output file, so that neither is held in memory at once.
+
+  :return: Whether the document has been modified. The output file is complete either way.
+  """
+  return modifier.modify_tags(scan_stream(infile, outfile, chunk_size, reverse), rel_name)
+
+def edit_with_patches(modifier: SoupModifier, data: bytes, rel_name: str,
+                      reverse: list[tuple[int, int, bytes]] | None = None) -> tuple[bool, bytes]:
+  """ Apply the changes to the source of a document by replacing only
+  the values of the changed attributes. All the rest of the document,
+  including whitespace and entities, remains byte-identical.
+
+  :param reverse: The list to which the replacements restoring the source
+  from the modified source are added, if given.
+  :return: Whether the document has been modified and the modified source.
+  """
+  edits = list[tuple[int, int, bytes]]()
+  modified = modifier.modify_tags(scan_tags(data, edits), rel_name)
+  if reverse is not None:
+    reverse.extend(reverse_edits(data, edits))
+  if modified:
+    return modified, splice(data, edits)
+  else:
+    return modified, data
+
+if __name__ == '__main__':
+  from io import BytesIO
+  print('Test started')
+  modifier = SoupModifier([ChangeSet('test', {'nāli @ Rehbock @ .ABS @ noun @ ': [
+    'nāli @ Rehbock @ .ERG @ noun @ ', 'nāli @ Rehbock @ .ESS @ noun @ '
+  ]}, [])])
+  source = '''<?xml version='1.0'?>\r
+<!-- <w mrp1="nāli @ Rehbock @ .ABS @ noun @ "/> -->\r
+<text><lb lnr="1 &amp; 2" lg='Hur' /><w mrpNaN="x"  mrp0sel=' 1' mrp1 = 'n&#257;li @ Rehbock @ .ABS @ noun @ ' >na&#257;li</w>\r
+<w mrp1="ewri @ Herr @ .ABS @ noun @ "/></text>'''
+  expected = '''<?xml version='1.0'?>\r
+<!-- <w mrp1="nāli @ Rehbock @ .ABS @ noun @ "/> -->\r
+<text><lb lnr="1 &amp; 2" lg='Hur' /><w  mrp0sel=' 1' mrp1 = 'nāli @ Rehbock @ .ERG @ noun @ ' mrp2="nāli @ Rehbock @ .ESS @ noun @ " >na&#257;li</w>\r
+<w mrp1="ewri @ Herr @ .ABS @ noun @ "/></text>'''
+  modified, result = edit_with_patches(modifier, source.encode('utf-8'), 'test')
+  print(result.decode('utf-8'))
+  assert modified
+  assert result.decode('utf-8') == expected
+  for chunk_size in range(1, 40):
+    output = BytesIO()
+    reverse = list[tuple[int, int, bytes]]()
+    assert stream_patches(modifier, BytesIO(source.encode('utf-8')), output, 'test', chunk_size, reverse)
+    assert output.getvalue() == result
+    assert splice(result, reverse) == source.encode('utf-8')
+  print('Test passed')
@@ -0,0 +1,288 @@
+import os
+import json
+import pickle
+import shutil
+import tempfile
+from collections.abc import Iterable, Iterator
+from typing import Any, IO, NamedTuple
+
+# The number of entries kept in memory before they are written.
+BATCH_SIZE = 4096
+
+class Replacement(NamedTuple):
+  """ The replacement of the morph. analysis of a word by one or more analyses.
+
+  :param file: The name of the document.
+  :param lnr: The number of the line of the word.
+  :param attribute: The attribute of the replaced analysis.
+  :param old: The replaced analysis, as it was written in the document.
+  :param new: The replacing analyses with their attributes: the first one
+  under the attribute of the replaced analysis, the others under added attributes.
+  :param old_selection: The value of mrp0sel before the replacement, None if there was none.
+  :param new_selection: The value of mrp0sel after the replacement, None if there is none.
+  :param change_set: The index of the change set which made the replacement.
+  """
+  file: str
+  lnr: str
+  attribute: str
+  old: str
+  new: list[tuple[str, str]]
+  old_selection: str | None
+  new_selection: str | None
+  change_set: int
+
+class JournalWarning(NamedTuple):
+  """ A problem of a document which does not prevent it from being edited. """
+  file: str
+  message: str
+
+JournalEntry = Replacement | JournalWarning
+
+def entry_to_json(entry: JournalEntry) -> dict[str, Any]:
+  """ Convert an entry into an object of the structured journal.
+  The change set is given by its index in the list "changeSets" of the last header,
+  and the selections only if they have changed.
+  """
+  if isinstance(entry, JournalWarning):
+    return {'file': entry.file, 'warning': entry.message}
+  record = {'file': entry.file, 'lnr': entry.lnr, 'attribute': entry.attribute, 'old': entry.old,
+            'new': [{'attribute': attribute, 'analysis': analysis} for attribute, analysis in entry.new],
+            'changeSet': entry.change_set}
+  if entry.old_selection != entry.new_selection:
+    record['mrp0sel'] = {'old': entry.old_selection, 'new': entry.new_selection}
+  return record
+
+def entry_from_json(record: dict[str, Any]) -> JournalEntry:
+  if 'warning' in record:
+    return JournalWarning(record['file'], record['warning'])
+  selection = record.get('mrp0sel', {'old': None, 'new': None})
+  return Replacement(record['file'], record['lnr'], record['attribute'], record['old'],
+                     [(new['attribute'], new['analysis']) for new in record['new']],
+                     selection['old'], selection['new'], record['changeSet'])
+
+class JournalWriter:
+  """ Write the journal entries of the edited documents into the modification log,
+  in the layout of Log.txt, and into the structured journal, a JSON Lines file
+  with a header listing the change sets followed by one object per entry.
+  The entries are kept in memory and written in batches.
+  With several change sets, the replacements made by each of them are written
+  into a separate part file, which is appended to the modification log,
+  headed by the name of the change set, when the writer is closed.
+  """
+
+  def __init__(self) -> None:
+    self.log_filename: str | None = None
+    self.names = list[str]()
+    # The modification log followed by the part files of the change sets.
+    self.outputs = list[IO[str]]()
+    self.journal: IO[str] | None = None
+    # The lines waiting to be written into each output and into the journal.
+    self.pending = list[list[str]]()
+    self.pending_json = list[str]()
+    self.buffered = 0
+    # The sections in which the file of the last document has been written.
+    self.headed = set[int]()
+
+  def section_filename(self, number: int) -> str:
+    return '{0}.{1}.part'.format(self.log_filename, number)
+
+  def open(self, log_filename: str | None, journal_filename: str | None, names: list[str],
+           append: bool = False) -> None:
+    """ :param names: The names of the change sets.
+    :param append: Whether to append to the files instead of replacing them.
+    """
+    mode = 'a' if append else 'w'
+    self.log_filename = log_filename
+    self.names = names
+    if log_filename is not None:
+      self.outputs.append(open(log_filename, mode, encoding='utf-8'))
+      if len(names) > 1:
+        for number in range(1, len(names) + 1):
+          self.outputs.append(open(self.section_filename(number), 'w', encoding='utf-8'))
+    self.pending = [list[str]() for _ in self.outputs]
+    if journal_filename is not None:
+      self.journal = open(journal_filename, mode, encoding='utf-8')
+      self.pending_json.append(json.dumps({'changeSets': names}, ensure_ascii=False) + '\n')
+
+  def write(self, entries: Iterable[JournalEntry], continued: bool = False) -> None:
+    """ Add the entries of a document, in the order in which they have been made.
+
+    :param continued: Whether the entries continue those of the previous call,
+    so that the name of the document is not written again.
+    """
+    if not continued:
+      self.headed.clear()
+    for entry in entries:
+      if len(self.outputs) > 0:
+        if isinstance(entry, JournalWarning):
+          self.pending[0].append(entry.message + '\n')
+        else:
+          section = entry.change_set + 1 if len(self.outputs) > 1 else 0
+          lines = self.pending[section]
+          if section not in self.headed:
+            lines.append(entry.file + '\n')
+            self.headed.add(section)
+          lines.append('\t{0}\n\t\t{1} =>\n'.format(entry.lnr, entry.old))
+          lines.extend('\t\t{0}\n'.format(analysis) for _, analysis in entry.new)
+      if self.journal is not None:
+        self.pending_json.append(json.dumps(entry_to_json(entry), ensure_ascii=False) + '\n')
+      self.buffered += 1
+      if self.buffered >= BATCH_SIZE:
+        self.flush()
+
+  def write_journal(self, journal: 'FileJournal') -> None:
+    """ Add the entries of a document which have not been written yet and remove its temporary file. """
+    try:
+      self.write(journal, journal.written)
+    finally:
+      journal.close()
+
+  def flush(self) -> None:
+    """ Write the entries kept in memory into the files. """
+    for output, lines in zip(self.outputs, self.pending):
+      output.write(''.join(lines))
+      output.flush()
+      lines.clear()
+    if self.journal is not None:
+      self.journal.write(''.join(self.pending_json))
+      self.journal.flush()
+    self.pending_json.clear()
+    self.buffered = 0
+
+  def close(self) -> None:
+    """ Write the remaining entries and append the sections to the modification log. """
+    self.flush()
+    if len(self.outputs) > 1:
+      log = self.outputs[0]
+      for number, name in enumerate(self.names, 1):
+        self.outputs[number].close()
+        log.write('=== {0} ===\n'.format(name))
+        with open(self.section_filename(number), 'r', encoding='utf-8') as fin:
+          shutil.copyfileobj(fin, log)
+        os.remove(self.section_filename(number))
+    for output in self.outputs[:1]:
+      output.close()
+    if self.journal is not None:
+      self.journal.close()
+    self.outputs = []
+    self.pending = []
+    self.journal = None
+
+class FileJournal:
+  """ The journal of a single document, to which the entries are added in the order
+  in which they are made. At most limit entries are kept in memory, so that the journal
+  of a large streamed document does not grow with it. The older entries are written
+  right away by the writer, if given, which requires that no other document is written
+  before this one is complete, otherwise they are pickled into a temporary file,
+  which is read back when the journal is written, e.g. by the main process for a worker.
+  """
+
+  def __init__(self, writer: JournalWriter | None = None, limit: int = BATCH_SIZE) -> None:
+    self.writer = writer
+    self.limit = limit
+    self.entries = list[JournalEntry]()
+    # Whether some entries have already been written by the writer.
+    self.written = False
+    self.spill_filename: str | None = None
+
+  def append(self, entry: JournalEntry) -> None:
+    self.entries.append(entry)
+    if len(self.entries) >= self.limit:
+      self.spill()
+
+  def spill(self) -> None:
+    """ Pass the entries kept in memory to the writer or to the temporary file. """
+    if self.writer is not None:
+      self.writer.write(self.entries, self.written)
+      self.written = True
+    else:
+      if self.spill_filename is None:
+        descriptor, self.spill_filename = tempfile.mkstemp(suffix='.journal')
+        os.close(descriptor)
+      with open(self.spill_filename, 'ab') as fout:
+        pickle.dump(self.entries, fout)
+    self.entries = []
+
+  def __iter__(self) -> Iterator[JournalEntry]:
+    """ Iterate over the entries which have not been written yet. """
+    if self.spill_filename is not None:
+      with open(self.spill_filename, 'rb') as fin:
+        while True:
+          try:
+            batch: list[JournalEntry] = pickle.load(fin)
+          except EOFError:
+            break
+          yield from batch
+    yield from self.entries
+
+  def close(self) -> None:
+    """ Remove the temporary file. """
+    if self.spill_filename is not None:
+      os.remove(self.spill_filename)
+      self.spill_filename = None
+
+# The writer of the journal of the current run, opened by corpus_editor.LogFiles.
+journal_writer = JournalWriter()
+
+def render_journal(journal_filename: str, log_filename: str) -> None:
+  """ Write the modification log in the layout of Log.txt from a structured journal.
+  The consecutive entries of a file are taken as those of a single document.
+  """
+  writer = JournalWriter()
+  document = list[JournalEntry]()
+  opened = False
+  with open(journal_filename, 'r', encoding='utf-8') as fin:
+    for line in fin:
+      record = json.loads(line)
+      if 'changeSets' in record:
+        writer.write(document)
+        document = []
+        writer.close()
+        writer.open(log_filename, None, record['changeSets'], append=opened)
+        opened = True
+        continue
+      entry = entry_from_json(record)
+      if len(document) > 0 and document[-1].file != entry.file:
+        writer.write(document)
+        document = []
+      document.append(entry)
+  writer.write(document)
+  writer.close()
+
+if __name__ == '__main__':
+  import tempfile
+  from os import path
+  print('Test started')
+  with tempfile.TemporaryDirectory() as directory:
+    log_filename = path.join(directory, 'Log.txt')
+    journal_filename = path.join(directory, 'Log.jsonl')
+    rendered_filename = path.join(directory, 'rendered.txt')
+    writer = JournalWriter()
+    writer.open(log_filename, journal_filename, ['a.json', 'b.json'])
+    writer.write([JournalWarning('A/x', 'Line 1 in A/x is not marked for language.'),
+                  Replacement('A/x', '2', 'mrp1', 'old', [('mrp1', 'new'), ('mrp3', 'added')], ' 1', ' 1 3', 1),
+                  Replacement('A/x', '3', 'mrp2', 'old', [('mrp2', 'new')], None, None, 0)])
+    writer.write([Replacement('A/y', '1', 'mrp1', 'old', [('mrp1', 'new')], None, None, 1)])
+    # A document written in parts, directly and through a temporary file.
+    for name, direct in [('A/z', True), ('A/zz', False)]:
+      journal = FileJournal(writer if direct else None, limit=2)
+      for lnr in range(5):
+        journal.append(Replacement(name, str(lnr), 'mrp1', 'old', [('mrp1', 'new')], None, None, lnr % 2))
+      assert journal.written == direct and len(journal.entries) == 1
+      writer.write_journal(journal)
+      assert journal.spill_filename is None
+    writer.close()
+    z_log = [''.join(name + '\n' + ''.join('\t{0}\n\t\told =>\n\t\tnew\n'.format(lnr)
+                                           for lnr in range(first, 5, 2)) for name in ['A/z', 'A/zz'])
+             for first in range(2)]
+    with open(log_filename, 'r', encoding='utf-8') as fin:
+      log = fin.read()
+    assert log == ('Line 1 in A/x is not marked for language.\n'
+                   '=== a.json ===\nA/x\n\t3\n\t\told =>\n\t\tnew\n' + z_log[0] +
+                   '=== b.json ===\nA/x\n\t2\n\t\told =>\n\t\tnew\n\t\tadded\nA/y\n\t1\n\t\told =>\n\t\tnew\n'
+                   + z_log[1]), log
+    assert not path.exists(log_filename + '.1.part')
+    render_journal(journal_filename, rendered_filename)
+    with open(rendered_filename, 'r', encoding='utf-8') as fin:
+      assert fin.read() == log
+  print('Test passed')
@@ -0,0 +1,48 @@
+import os
+import json
+from os import path
+from typing import Any, NamedTuple
+
+class ChangeSet(NamedTuple):
+  """ The content of a changes file.
+
+  :param name: The name of the file, which heads its section of the modification log.
+  :param changes: The replacement dictionary (the field "changes").
+  :param rules: The definitions of the pattern rules (the field "rules").
+  """
+  name: str
+  changes: dict[str, list[str]] | dict[str, str]
+  rules: list[Any]
+
+def changes_filenames(changes_file: Any) -> list[tuple[str, str]]:
+  """ List the changes files given in config.json together with their names,
+  in the order in which they are applied: either a single file, a list of files
+  or a directory, whose JSON files are applied in alphabetical order
+  and named without the directory. Raise ValueError if a file does not exist.
+  """
+  if isinstance(changes_file, str):
+    changes_file = path.expanduser(changes_file)
+    if path.isdir(changes_file):
+      filenames = [(filename, path.join(changes_file, filename)) for filename in sorted(os.listdir(changes_file))
+                   if path.splitext(filename)[1] == '.json']
+      if len(filenames) == 0:
+        raise ValueError('No changes files found in the directory ' + changes_file)
+      return filenames
+    filenames = [(changes_file, changes_file)]
+  elif isinstance(changes_file, list) and len(changes_file) > 0 and all(isinstance(filename, str) for filename in changes_file):
+    filenames = [(filename, path.expanduser(filename)) for filename in changes_file]
+  else:
+    raise ValueError('The changes file must be a file, a list of files or a directory: {0}'.format(changes_file))
+  for _, filename in filenames:
+    if not path.isfile(filename):
+      raise ValueError('Changes file not found: ' + filename)
+  return filenames
+
+def load_change_sets(changes_file: Any) -> list[ChangeSet]:
+  """ Read the changes files given in config.json. """
+  change_sets = list[ChangeSet]()
+  for name, filename in changes_filenames(changes_file):
+    with open(filename, 'r', encoding='utf-8') as fin:
+      changesJson = json.load(fin)
+    change_sets.append(ChangeSet(name, changesJson.get('changes', {}), changesJson.get('rules', [])))
+  return change_sets
@@ -0,0 +1,442 @@
+import os
+from os import path
+from multiprocessing import Pool
+from collections import Counter
+from collections.abc import Callable, Iterable, Iterator
+from logging import FileHandler, Logger
+from typing import Any, NamedTuple, TYPE_CHECKING
+from soup_modifier import CompiledChangeSet, find_conflicts, morph_logger
+from change_journal import FileJournal, journal_writer
+from change_sets import ChangeSet, load_change_sets
+from file_editor import (FileTask, FileResult, FileEditor, EditorSettings, init_worker,
+                         edit_file_in_worker, replay_log_records)
+from file_editor import logger, file_skipping_logger, error_logger
+from manifest import Manifest
+from corpus_index import CorpusIndex
+from pipeline import edit_pipelined
+from output_writer import DirectorySync
+from undo_journal import UNDO_NAME, UndoJournal
+from analysis_dictionary import AnalysisDictionary
+from discovery import DEFAULT_EXCLUDE, TaskStream, discover_tasks, tasks_for_files, count_files
+from morph import set_parse_cache_size
+from profiler import RunProfile, StageTimer
+if TYPE_CHECKING:
+  from tqdm import tqdm
+
+Report = Callable[[str], None]
+
+class LogDestinations(NamedTuple):
+  """ The files the logs of a run are written to. A log given as None is not written.
+
+  :param modified_files: The names of the modified files.
+  :param modifications: The modified lines and the replaced analyses of every file.
+  :param morphological_analysis: The analyses which could not be parsed.
+  :param skipped_files: The files which could not be edited.
+  :param errors: The errors for which the files have been skipped.
+  :param journal: The structured journal of the modifications (see change_journal).
+  """
+  modified_files: str | None = 'Modified files.txt'
+  modifications: str | None = 'Log.txt'
+  morphological_analysis: str | None = 'morphological_analysis.log'
+  skipped_files: str | None = 'skipped_files.txt'
+  errors: str | None = 'error_log.txt'
+  journal: str | None = None
+
+class RunOptions(NamedTuple):
+  """ The options of a run, which are given on the command line of edit_corpus.py.
+
+  :param jobs: The number of worker processes editing files in parallel.
+  :param full: Whether to process the files unchanged since the last run as well.
+  :param io_threads: The number of threads reading and writing files in the background.
+  :param queue_depth: The maximal number of files read in advance and waiting to be written.
+  :param use_index: Whether to edit only the files which contain the analyses
+  to be replaced according to the index.
+  :param progress: Whether to show a progress bar.
+  :param profile: The file the profile of the run is written to, None for no profile.
+  :param profile_top: The number of the slowest files listed in the profile.
+  :param retry_skipped: Whether to process only the files skipped because of errors
+  when they were last processed (see Manifest.skipped), appending to the log files.
+  :param lock_retries: How many times to try again to edit a locked file
+  when the files are edited one after another.
+  :param lock_delay: The time in seconds before the first retry, doubled for every further one.
+  :param dictionary: The file the dictionary of the analyses after the changes is written to
+  (see AnalysisDictionary), None for no dictionary. All files are then processed without the index.
+  """
+  jobs: int = 1
+  full: bool = False
+  io_threads: int = 0
+  queue_depth: int = 8
+  use_index: bool = False
+  progress: bool = False
+  profile: str | None = None
+  profile_top: int = 20
+  retry_skipped: bool = False
+  lock_retries: int = 0
+  lock_delay: float = 1.0
+  dictionary: str | None = None
+
+class RunSummary(NamedTuple):
+  """ The outcome of a run.
+
+  :param discovered: The number of files found.
+  :param unchanged: The number of files skipped as unchanged since the last run.
+  :param counters: The counters summed over all files, including the numbers
+  of modified files ('modified'), of files skipped by the prefilter ('prefiltered'),
+  of files skipped because of errors ('skipped')
+  and the numbers of bytes of the modified files written ('bytes written')
+  and not written because the output files had this content already ('bytes skipped').
+  :param prefilter: Whether the prefilter has been used.
+  """
+  discovered: int
+  unchanged: int
+  counters: Counter[str]
+  prefilter: bool
+
+def ignore(message: str) -> None:
+  pass
+
+class BufferedFileHandler(FileHandler):
+  """ A file handler which leaves the records in the buffer of the file
+  until it is full instead of flushing the file after every record.
+  """
+
+  def flush(self) -> None:
+    pass
+
+  def flush_buffer(self) -> None:
+    super().flush()
+
+class LogFiles:
+  """ The log files of a run. The handlers are attached to the loggers
+  and the journal writer is opened when the context is entered, and they are
+  closed when it is left, so that nothing is opened on import and
+  several runs can be made in one process. The logs are buffered,
+  so they are only complete once the context has been left or flushed.
+  """
+
+  def __init__(self, destinations: LogDestinations = LogDestinations(), sections: list[str] | None = None,
+               append: bool = False):
+    """ :param sections: The names of the change sets, whose modifications are logged
+    in separate sections if there are several of them.
+    :param append: Whether to append to the log files instead of replacing them.
+    """
+    self.destinations = destinations
+    self.sections = sections if sections is not None else []
+    self.append = append
+    self.handlers = list[tuple[Logger, BufferedFileHandler]]()
+
+  def attach(self, log: Logger, filename: str | None) -> None:
+    if filename is not None:
+      handler = BufferedFileHandler(filename, 'a' if self.append else 'w', encoding='utf-8')
+      log.addHandler(handler)
+      self.handlers.append((log, handler))
+
+  def __enter__(self) -> 'LogFiles':
+    self.attach(logger, self.destinations.modified_files)
+    self.attach(file_skipping_logger, self.destinations.skipped_files)
+    self.attach(error_logger, self.destinations.errors)
+    self.attach(morph_logger, self.destinations.morphological_analysis)
+    journal_writer.open(self.destinations.modifications, self.destinations.journal, self.sections, self.append)
+    return self
+
+  def flush(self) -> None:
+    """ Write everything logged so far into the files. """
+    for _, handler in self.handlers:
+      handler.flush_buffer()
+    journal_writer.flush()
+
+  def __exit__(self, *exc_info: object) -> None:
+    for log, handler in self.handlers:
+      log.removeHandler(handler)
+      handler.close()
+    self.handlers.clear()
+    journal_writer.close()
+
+def config_value(config: dict[str, Any], key: str) -> Any:
+  if key not in config:
+    raise ValueError('The field {0} is missing in the configuration.'.format(key))
+  return config[key]
+
+def exclude_patterns(config: dict[str, Any]) -> list[str]:
+  exclude = config.get('exclude', DEFAULT_EXCLUDE)
+  if not isinstance(exclude, list) or not all(isinstance(pattern, str) for pattern in exclude):
+    raise ValueError('The exclude patterns must be a list of strings: {0}'.format(exclude))
+  return exclude
+
+def report_chains(change_sets: list[CompiledChangeSet], report: Report) -> bool:
+  """ Report the chains of changes which are applied at once and the cycles of changes.
+
+  :return: Whether there are cycles.
+  """
+  for change_set in change_sets:
+    if len(change_set.chains) > 0:
+      report('Chained changes in {0} applied at once:'.format(change_set.name))
+      for chain in change_set.chains:
+        report('\t' + ' => '.join(str(morph) for morph in chain))
+    if len(change_set.cycles) > 0:
+      report('Cycles of changes in {0}:'.format(change_set.name))
+      for cycle in change_set.cycles:
+        report('\t' + ' => '.join(str(morph) for morph in cycle))
+  return any(len(change_set.cycles) > 0 for change_set in change_sets)
+
+def make_editor(change_sets: list[ChangeSet], settings: EditorSettings = EditorSettings(),
+                report: Report = ignore) -> FileEditor:
+  """ Compile the change sets into an editor. Raise ValueError if the changes
+  cannot be applied: invalid rules, contradicting change sets or cycles of changes.
+  """
+  set_parse_cache_size(settings.parse_cache_size)
+  editor = FileEditor(change_sets, settings)
+  conflicts = find_conflicts(editor.modifier.change_sets)
+  if len(conflicts) > 0:
+    raise ValueError('\n'.join(['The change sets contradict each other:'] + conflicts))
+  if report_chains(editor.modifier.change_sets, report):
+    raise ValueError('Remove the cycles to apply the changes.')
+  return editor
+
+def edit_document(editor: FileEditor, document: str | bytes, name: str = 'document') -> tuple[bool, str | bytes]:
+  """ Apply the changes to a document in memory. The modifications are logged
+  under the given name, into the log files only if they are open (see LogFiles).
+
+  :return: Whether the document has been modified and its modified text,
+  or its modified bytes in the patch mode.
+  """
+  data = document.encode('utf-8') if isinstance(document, str) else document
+  journal = FileJournal(journal_writer)
+  try:
+    return editor.edit(data, name, StageTimer(), journal)
+  finally:
+    journal_writer.write_journal(journal)
+
+def edit_serially(editor: FileEditor, tasks: Iterable[FileTask], lock_retries: int = 0,
+                  lock_delay: float = 1.0) -> Iterator[FileResult]:
+  for task in tasks:
+    yield editor(task, lock_retries, lock_delay, journal_writer)
+
+def report_progress(tasks: TaskStream, results: Iterable[FileResult], manifest: Manifest, total: int,
+                    profile: RunProfile | None = None, progress: bool = True,
+                    undo: UndoJournal | None = None, dictionary: AnalysisDictionary | None = None,
+                    report: Report = ignore) -> Counter[str]:
+  """ Consume the results in the order of the selected tasks,
+  handling the journal and the log records of each file before those of the next one
+  and recording the processed files in the manifest, in the profile and in the undo journal, if given.
+  The analyses of the files are merged into the dictionary, if given,
+  and their messages for the user passed to report.
+  The directories of the written files are synced in batches.
+  The progress is shown over the discovered files, of which the expected total is given.
+
+  :return: The counters summed over all files, including the numbers
+  of modified files, of files skipped by the prefilter and of files skipped because of errors.
+  """
+  counters = Counter[str]()
+  directories = DirectorySync()
+  progress_bar = None
+  if progress:
+    from tqdm.auto import tqdm
+    progress_bar = tqdm(total=total)
+  for result in results:
+    task, position = tasks.next_selected()
+    journal_writer.write_journal(result.journal)
+    replay_log_records(result.log_records)
+    if result.message is not None:
+      report(result.message)
+    manifest.update(task.key, result.entry, result.error)
+    if undo is not None and result.undo is not None and result.entry is not None:
+      undo.add(task.key, result.entry.digest, result.undo)
+    if dictionary is not None and result.dictionary is not None:
+      dictionary.update(result.dictionary)
+    counters.update(result.counters)
+    if profile is not None:
+      profile.add(task.key, result.timings, result.counters)
+    if result.modified:
+      counters['modified'] += 1
+      directories.add(task.output_subdirectory)
+    if result.prefiltered:
+      counters['prefiltered'] += 1
+    if result.error is not None:
+      counters['skipped'] += 1
+    if progress_bar is not None:
+      progress_bar.set_postfix_str(task.folder, refresh=False)
+      advance(progress_bar, position)
+  directories.sync()
+  if progress_bar is not None:
+    advance(progress_bar, tasks.discovered)
+    progress_bar.close()
+  return counters
+
+def advance(progress_bar: 'tqdm[Any]', position: int) -> None:
+  """ Move the progress bar to the given number of discovered files,
+  raising its total if more files have been discovered than expected.
+  """
+  if progress_bar.total is not None and position > progress_bar.total:
+    progress_bar.total = position
+  progress_bar.update(position - progress_bar.n)
+
+def update_index(index: CorpusIndex, tasks: Iterable[FileTask], report: Report) -> None:
+  """ Index the files which have changed since they were last indexed. """
+  update = index.update((task.key, *task.input_file()) for task in tasks)
+  report('Indexed {0} files, {1} files unchanged, {2} files removed from the index.'.format(*update))
+
+def corpus_paths(config: dict[str, Any]) -> tuple[str, str, list[str]]:
+  """ Return the input directory, the output directory, which is created
+  if it does not exist, and the exclude patterns of the configuration.
+  """
+  input_directory = config_value(config, 'inputDirectory')
+  output_directory = config_value(config, 'outputDirectory')
+  exclude = exclude_patterns(config)
+  if not path.exists(input_directory):
+    raise ValueError('Input directory not found: ' + input_directory)
+  os.makedirs(output_directory, exist_ok=True)
+  return input_directory, output_directory, exclude
+
+def index_corpus(config: dict[str, Any], report: Report = ignore) -> None:
+  """ Build or update the index of the morphological analyses of the corpus. """
+  input_directory, output_directory, exclude = corpus_paths(config)
+  index = CorpusIndex(output_directory)
+  try:
+    update_index(index, discover_tasks(input_directory, output_directory, exclude), report)
+  finally:
+    index.close()
+
+def select_tasks(editor: FileEditor, input_directory: str, output_directory: str, exclude: list[str],
+                 manifest: Manifest, index: CorpusIndex | None, full: bool,
+                 report: Report) -> tuple[TaskStream, int, list[FileTask] | None]:
+  """ Select the files of the corpus to be processed: those containing the analyses
+  to be replaced according to the index, if given, otherwise all discovered files.
+
+  :return: The tasks, their expected total and the tasks selected by the index.
+  """
+  if index is not None:
+    all_tasks = list(discover_tasks(input_directory, output_directory, exclude))
+    update_index(index, all_tasks, report)
+    analyses = set(editor.modifier.change_keys)
+    if editor.modifier.has_rules:
+      analyses.update(key for key in index.analyses() if editor.modifier.rules_change(key))
+    selected = index.files_containing(analyses)
+    report('The index selected {0} of {1} files.'.format(len(selected), len(all_tasks)))
+    indexed_tasks = [task for task in all_tasks if task.key in selected]
+    return TaskStream(indexed_tasks, manifest, full), len(indexed_tasks), indexed_tasks
+  tasks = TaskStream(discover_tasks(input_directory, output_directory, exclude), manifest, full)
+  total = manifest.file_count if manifest.file_count is not None else count_files(input_directory, exclude)
+  return tasks, total, None
+
+def edit_tasks(editor: FileEditor, change_sets: list[ChangeSet], settings: EditorSettings, tasks: TaskStream,
+               manifest: Manifest, total: int, options: RunOptions, profile: RunProfile | None = None,
+               undo: UndoJournal | None = None, dictionary: AnalysisDictionary | None = None,
+               report: Report = ignore) -> Counter[str]:
+  """ Edit the selected files by worker processes, with background reading and writing
+  or serially, depending on the options, and record them in the manifest and in the undo journal, if given.
+  The analyses of the files are merged into the dictionary, if given and collected by the editor.
+  Locked files are only tried again when the files are edited serially.
+  """
+  if options.jobs > 1:
+    with Pool(options.jobs, init_worker, (change_sets, settings)) as pool:
+      chunksize = max(1, total // (options.jobs * 16))
+      results: Iterable[FileResult] = pool.imap(edit_file_in_worker, tasks, chunksize)
+      return report_progress(tasks, results, manifest, total, profile, options.progress, undo, dictionary, report)
+  elif options.io_threads > 0:
+    results = edit_pipelined(editor, tasks, options.io_threads, max(1, options.queue_depth))
+    return report_progress(tasks, results, manifest, total, profile, options.progress, undo, dictionary, report)
+  else:
+    results = edit_serially(editor, tasks, options.lock_retries, options.lock_delay)
+    return report_progress(tasks, results, manifest, total, profile, options.progress, undo, dictionary, report)
+
+def skipped_files(manifest: Manifest, input_directory: str, report: Report) -> list[str]:
+  """ Return the files of the input directory skipped because of errors when they were
+  last processed. Those which no longer exist are removed from the manifest.
+  """
+  files = list[str]()
+  for key in sorted(manifest.skipped):
+    filename = path.join(input_directory, *key.split('/'))
+    if path.exists(filename):
+      files.append(filename)
+    else:
+      del manifest.skipped[key]
+      report('The skipped file {0} no longer exists.'.format(filename))
+  report('Retrying {0} skipped files.'.format(len(files)))
+  return files
+
+def run(config: dict[str, Any], options: RunOptions = RunOptions(), logs: LogDestinations = LogDestinations(),
+        change_sets: list[ChangeSet] | None = None, files: list[str] | None = None,
+        report: Report = ignore) -> RunSummary:
+  """ Apply the changes to the XML files of the corpus. Nothing is read
+  from the current directory: the configuration is given as the content of config.json,
+  whose paths are used as they are. Raise ValueError if the changes cannot be applied.
+
+  :param change_sets: The changes to be applied, read from the changes files
+  of the configuration (the field "changesFile") if not given.
+  :param files: The XML files of the input directory to be processed, all of them if not given.
+  The index is not used for them, so a dictionary (see RunOptions.dictionary) then only
+  covers these files and can be merged with others (see merge_dictionaries). In the retry mode (see RunOptions.retry_skipped),
+  the files skipped because of errors are processed instead, one after another.
+  :param report: The function the messages for the user are passed to.
+  """
+  settings = EditorSettings.from_config(config)
+  if options.dictionary is not None:
+    settings = settings._replace(collect_dictionary=True)
+    options = options._replace(full=True, use_index=False)
+  if change_sets is None:
+    change_sets = load_change_sets(config_value(config, 'changesFile'))
+  input_directory, output_directory, exclude = corpus_paths(config)
+  editor = make_editor(change_sets, settings, report)
+  manifest = Manifest(output_directory, editor.changes_digest)
+  if options.retry_skipped:
+    files = skipped_files(manifest, input_directory, report)
+    options = options._replace(jobs=1, io_threads=0)
+  with LogFiles(logs, [change_set.name for change_set in change_sets], append=options.retry_skipped):
+    index = CorpusIndex(output_directory) if options.use_index and files is None else None
+    indexed_tasks = None
+    if files is not None:
+      selected_tasks = list(tasks_for_files(files, input_directory, output_directory))
+      tasks = TaskStream(selected_tasks, manifest, options.full)
+      total = len(selected_tasks)
+    else:
+      tasks, total, indexed_tasks = select_tasks(editor, input_directory, output_directory, exclude,
+                                                 manifest, index, options.full, report)
+    profile = RunProfile() if options.profile is not None else None
+    undo = UndoJournal(output_directory) if settings.undo_journal else None
+    dictionary = AnalysisDictionary() if options.dictionary is not None else None
+    try:
+      counters = edit_tasks(editor, change_sets, settings, tasks, manifest, total, options, profile, undo, dictionary,
+                            report)
+      if files is None and index is None:
+        manifest.file_count = tasks.discovered
+    finally:
+      manifest.save()
+      if undo is not None:
+        undo.close()
+      if index is not None:
+        assert indexed_tasks is not None
+        index.update(((task.key, *task.input_file()) for task in indexed_tasks), remove_others=False)
+        index.close()
+  if profile is not None and options.profile is not None:
+    profile.save(options.profile, options.profile_top)
+    report('The profile has been written to {0}.'.format(options.profile))
+  if dictionary is not None and options.dictionary is not None:
+    dictionary.save(options.dictionary)
+    report('The dictionary of {0} analyses has been written to {1}.'.format(len(dictionary), options.dictionary))
+  return RunSummary(tasks.discovered, tasks.unchanged, counters, editor.prefilter is not None)
+
+def undo_run(config: dict[str, Any], run: int | None = None, files: list[str] | None = None,
+             report: Report = ignore) -> int:
+  """ Restore the output files as they were before a run, by default the last one,
+  from the undo journal in the output directory (see the field "undoJournal" of the configuration).
+
+  :param files: The XML files of the input directory to be restored, instead of all files of the run.
+  A file is restored as it was before the given run, by default before the last run which modified it.
+  :return: The number of restored files.
+  """
+  input_directory, output_directory, _ = corpus_paths(config)
+  if not path.exists(path.join(output_directory, UNDO_NAME)):
+    raise ValueError('There is no undo journal in the output directory ' + output_directory)
+  keys = None
+  if files is not None:
+    keys = [task.key for task in tasks_for_files(files, input_directory, output_directory)]
+  manifest = Manifest(output_directory, '')
+  undo = UndoJournal(output_directory)
+  try:
+    restored = undo.undo(manifest, run, keys, report)
+  finally:
+    manifest.save()
+    undo.close()
+  report('Restored {0} files.'.format(restored))
+  return restored
@@ -0,0 +1,205 @@
+import os
+import sqlite3
+from os import path
+from collections.abc import Iterable, Iterator
+from typing import NamedTuple
+from attribute_patcher import scan_tags
+from soup_modifier import get_word_language
+from morph import Morph, lookup_key_of
+from manifest import file_digest, content_digest
+
+INDEX_NAME = '.corpus_editor_index.sqlite'
+# Increase when the content of the index changes, so that it is rebuilt.
+INDEX_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE files (
+  id INTEGER PRIMARY KEY,
+  key TEXT UNIQUE NOT NULL,
+  source TEXT NOT NULL,
+  size INTEGER NOT NULL,
+  mtime INTEGER NOT NULL,
+  digest TEXT NOT NULL,
+  indexed INTEGER NOT NULL
+);
+CREATE TABLE occurrences (
+  analysis TEXT NOT NULL,
+  file INTEGER NOT NULL REFERENCES files(id),
+  lnr TEXT NOT NULL,
+  word INTEGER NOT NULL,
+  attribute TEXT NOT NULL
+);
+CREATE INDEX occurrences_analysis ON occurrences(analysis);
+CREATE INDEX occurrences_file ON occurrences(file);
+'''
+
+class Occurrence(NamedTuple):
+  """ An occurrence of a morph. analysis in the corpus.
+
+  :param analysis: The lookup key of the analysis.
+  :param lnr: The number of the line.
+  :param word: The position of the word in the file, starting with 1.
+  :param attribute: The attribute containing the analysis (mrpN).
+  """
+  analysis: str
+  lnr: str
+  word: int
+  attribute: str
+
+def scan_analyses(data: bytes) -> Iterator[Occurrence]:
+  """ Yield the occurrences of the morph. analyses of the Hurrian words
+  in the source of a document. Raise ValueError if the document
+  cannot be edited, in the same cases as SoupModifier.modify_tags.
+  """
+  lang = 'hit'
+  lnr = '[unknown]'
+  word = 0
+  for name, attrs in scan_tags(data, []):
+    if name == 'lb':
+      if 'lnr' not in attrs:
+        raise ValueError('The next line after {0} is not numbered'.format(lnr))
+      lnr = attrs['lnr']
+      lang = attrs['lg'] if 'lg' in attrs else 'Hur'
+    else:
+      word += 1
+      if get_word_language(lang, attrs) == 'Hur':
+        for attr, value in attrs.items():
+          if attr.startswith('mrp') and attr != 'mrp0sel':
+            key = lookup_key_of(value)
+            if key is None:
+              morph = Morph.parse(value)
+              if morph is None:
+                continue
+              key = morph.lookup_key
+            yield Occurrence(key, lnr, word, attr)
+
+class IndexUpdate(NamedTuple):
+  """ The numbers of files (re)indexed, unchanged and removed by an update. """
+  indexed: int
+  unchanged: int
+  removed: int
+
+class CorpusIndex:
+  """ A persistent index of the morph. analyses of the corpus, stored
+  in an SQLite database in the output directory. For every file, the index
+  records the state of the file it has been built from, so that only
+  the files changed since then are indexed again. The files which cannot
+  be indexed are recorded as well and are always considered to contain
+  any analysis.
+  """
+
+  def __init__(self, output_directory: str):
+    self.filename = path.join(output_directory, INDEX_NAME)
+    self.connection = sqlite3.connect(self.filename)
+    version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+    if version != INDEX_VERSION:
+      with self.connection:
+        self.connection.execute('DROP TABLE IF EXISTS occurrences')
+        self.connection.execute('DROP TABLE IF EXISTS files')
+      self.connection.executescript(SCHEMA)
+      self.connection.execute('PRAGMA user_version = {0}'.format(INDEX_VERSION))
+
+  def close(self) -> None:
+    self.connection.close()
+
+  def is_unchanged(self, key: str, source: str, filename: str) -> bool:
+    row = self.connection.execute(
+      'SELECT source, size, mtime, digest FROM files WHERE key = ?', (key,)
+    ).fetchone()
+    if row is None or row[0] != source:
+      return False
+    stat = os.stat(filename)
+    if stat.st_size != row[1]:
+      return False
+    return bool(stat.st_mtime_ns == row[2] or file_digest(filename) == row[3])
+
+  def index_file(self, key: str, source: str, filename: str) -> None:
+    """ Replace the occurrences recorded for the file by its current ones. """
+    with open(filename, 'rb') as fin:
+      data = fin.read()
+    try:
+      occurrences = list(scan_analyses(data))
+      indexed = True
+    except ValueError:
+      occurrences = []
+      indexed = False
+    stat = os.stat(filename)
+    digest = content_digest(data)
+    self.remove_file(key)
+    cursor = self.connection.execute(
+      'INSERT INTO files (key, source, size, mtime, digest, indexed) VALUES (?, ?, ?, ?, ?, ?)',
+      (key, source, stat.st_size, stat.st_mtime_ns, digest, int(indexed))
+    )
+    self.connection.executemany(
+      'INSERT INTO occurrences (analysis, file, lnr, word, attribute) VALUES (?, ?, ?, ?, ?)',
+      ((analysis, cursor.lastrowid, lnr, word, attribute) for analysis, lnr, word, attribute in occurrences)
+    )
+
+  def remove_file(self, key: str) -> None:
+    self.connection.execute('DELETE FROM occurrences WHERE file IN (SELECT id FROM files WHERE key = ?)', (key,))
+    self.connection.execute('DELETE FROM files WHERE key = ?', (key,))
+
+  def update(self, files: Iterable[tuple[str, str, str]], remove_others: bool = True) -> IndexUpdate:
+    """ Index the given files (key, source and filename) which have changed
+    since they were last indexed and, unless remove_others is False,
+    remove the files which are not given from the index.
+    """
+    indexed = unchanged = removed = 0
+    keys = set[str]()
+    with self.connection:
+      for key, source, filename in files:
+        keys.add(key)
+        if self.is_unchanged(key, source, filename):
+          unchanged += 1
+        else:
+          self.index_file(key, source, filename)
+          indexed += 1
+      if remove_others:
+        for key, in self.connection.execute('SELECT key FROM files').fetchall():
+          if key not in keys:
+            self.remove_file(key)
+            removed += 1
+    return IndexUpdate(indexed, unchanged, removed)
+
+  def files_containing(self, analyses: Iterable[str]) -> set[str]:
+    """ Return the keys of the files which contain any of the analyses,
+    given by their lookup keys, or which could not be indexed.
+    """
+    with self.connection:
+      self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS wanted (analysis TEXT PRIMARY KEY)')
+      self.connection.execute('DELETE FROM wanted')
+      self.connection.executemany('INSERT OR IGNORE INTO wanted VALUES (?)', ((analysis,) for analysis in analyses))
+      rows = self.connection.execute(
+        'SELECT DISTINCT files.key FROM wanted'
+        ' JOIN occurrences ON occurrences.analysis = wanted.analysis'
+        ' JOIN files ON files.id = occurrences.file'
+        ' UNION SELECT key FROM files WHERE indexed = 0'
+      ).fetchall()
+    return {key for key, in rows}
+
+  def analyses(self) -> list[str]:
+    """ Return the lookup keys of the distinct analyses in the index. """
+    return [analysis for analysis, in self.connection.execute('SELECT DISTINCT analysis FROM occurrences')]
+
+  def occurrences(self, analysis: str) -> list[tuple[str, str, int, str]]:
+    """ Return the file, line number, word position and attribute
+    of every occurrence of an analysis, given by its lookup key.
+    """
+    rows: list[tuple[str, str, int, str]] = self.connection.execute(
+      'SELECT files.key, lnr, word, attribute FROM occurrences JOIN files ON files.id = occurrences.file'
+      ' WHERE analysis = ? ORDER BY files.key, word', (analysis,)
+    ).fetchall()
+    return rows
+
+if __name__ == '__main__':
+  print('Test started')
+  source = '''<text><lb lnr="1" lg="Hur"/><w mrp1="nāli @ Rehbock @ { a → .ABS} @ noun @ " mrp2="x"/>
+<w lg="Hit" mrp1="nāli @ Rehbock @ .ABS @ noun @ "/><lb lnr="2" lg="Hit"/><w mrp1="nāli @ Rehbock @ .ABS @ noun @ "/>
+<w lg="Hur" mrp0sel=" 1" mrp1="nāli @ Rehbock @ .ABS @ noun += -ma @ .ABS @ "/></text>'''
+  occurrences = list(scan_analyses(source.encode('utf-8')))
+  print(occurrences)
+  assert occurrences == [
+    Occurrence('nāli @ Rehbock @ .ABS @ noun @ ', '1', 1, 'mrp1'),
+    Occurrence('nāli @ Rehbock @ .ABS @ noun @ ', '2', 4, 'mrp1'),
+  ]
+  print('Test passed')
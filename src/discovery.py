@@ -0,0 +1,115 @@
+import os
+from os import path
+from fnmatch import fnmatch
+from collections import deque
+from collections.abc import Iterable, Iterator
+from file_editor import FileTask
+from manifest import Manifest
+
+# The folders which are not edited by default.
+DEFAULT_EXCLUDE = ['Backup']
+
+def is_excluded(rel_path: str, patterns: list[str]) -> bool:
+  """ Whether a folder, given by its path relative to the input directory,
+  matches one of the exclude patterns. A pattern without a slash is matched
+  against the name of the folder, a pattern with a slash against its relative path.
+  """
+  rel_path = rel_path.replace(os.sep, '/')
+  name = rel_path.rsplit('/', 1)[-1]
+  for pattern in patterns:
+    if '/' in pattern:
+      if fnmatch(rel_path, pattern.strip('/')):
+        return True
+    elif fnmatch(name, pattern):
+      return True
+  return False
+
+def walk_corpus(input_directory: str, exclude: list[str]) -> Iterator[tuple[str, str, list[str]]]:
+  """ Walk the input directory lazily without descending into excluded folders.
+
+  :return: The path of every folder, its path relative to the input directory
+  and the names of the XML files in it.
+  """
+  for dirpath, dirnames, filenames in os.walk(input_directory):
+    rel_path = path.relpath(dirpath, input_directory)
+    dirnames[:] = [dirname for dirname in dirnames
+                   if not is_excluded(path.join(rel_path, dirname) if rel_path != '.' else dirname, exclude)]
+    yield dirpath, rel_path, [filename for filename in filenames if path.splitext(filename)[1] == '.xml']
+
+def discover_tasks(input_directory: str, output_directory: str, exclude: list[str]) -> Iterator[FileTask]:
+  """ Yield the XML files of the input directory in the order
+  in which they are processed, as the directory is walked.
+  """
+  for dirpath, rel_path, filenames in walk_corpus(input_directory, exclude):
+    _, folder = path.split(dirpath)
+    output_subdirectory = path.join(output_directory, rel_path)
+    for filename in filenames:
+      text_name, _ = path.splitext(filename)
+      rel_name = path.join(rel_path, text_name)
+      yield FileTask(dirpath, filename, folder, output_subdirectory, rel_name)
+
+def tasks_for_files(filenames: Iterable[str], input_directory: str, output_directory: str) -> Iterator[FileTask]:
+  """ Yield the tasks for the given XML files of the input directory,
+  in the same form as they are discovered by walking it.
+  Raise ValueError if a file is not in the input directory.
+  """
+  for filename in filenames:
+    rel_file = path.relpath(filename, input_directory)
+    if rel_file == os.pardir or rel_file.startswith(os.pardir + os.sep):
+      raise ValueError('The file {0} is not in the input directory {1}'.format(filename, input_directory))
+    rel_path = path.dirname(rel_file) or '.'
+    dirpath = path.join(input_directory, rel_path) if rel_path != '.' else input_directory
+    _, folder = path.split(dirpath)
+    text_name, _ = path.splitext(path.basename(rel_file))
+    yield FileTask(dirpath, path.basename(rel_file), folder, path.join(output_directory, rel_path),
+                   path.join(rel_path, text_name))
+
+def count_files(input_directory: str, exclude: list[str]) -> int:
+  """ Count the XML files to be discovered, which only requires
+  listing the folders, not reading the files.
+  """
+  return sum(len(filenames) for _, _, filenames in walk_corpus(input_directory, exclude))
+
+class TaskStream:
+  """ The tasks to be processed, selected lazily from the discovered ones:
+  unless all tasks are to be processed, those unchanged since the last run are left out.
+  For every selected task, its position among the discovered tasks is recorded,
+  so that the progress can be shown over all discovered files.
+  """
+
+  def __init__(self, tasks: Iterable[FileTask], manifest: Manifest, full: bool):
+    self.tasks = tasks
+    self.manifest = manifest
+    self.full = full
+    self.discovered = 0
+    self.unchanged = 0
+    self.selected = deque[tuple[FileTask, int]]()
+
+  def __iter__(self) -> Iterator[FileTask]:
+    for task in self.tasks:
+      self.discovered += 1
+      if self.full or not self.manifest.is_unchanged(task.key, *task.input_file()):
+        self.selected.append((task, self.discovered))
+        yield task
+      else:
+        self.unchanged += 1
+
+  def next_selected(self) -> tuple[FileTask, int]:
+    """ Return the next selected task whose result has not been reported yet
+    and its position among the discovered tasks.
+    """
+    return self.selected.popleft()
+
+if __name__ == '__main__':
+  print('Test started')
+  patterns = ['Backup', 'drafts/old*']
+  assert is_excluded('Backup', patterns)
+  assert is_excluded(path.join('A', 'Backup'), patterns)
+  assert is_excluded(path.join('drafts', 'old2'), patterns)
+  assert not is_excluded(path.join('A', 'old2'), patterns)
+  assert not is_excluded(path.join('A', 'Backups'), patterns)
+  task, = tasks_for_files([path.join('in', 'A', 'x.xml')], 'in', 'out')
+  assert task == FileTask(path.join('in', 'A'), 'x.xml', 'A', path.join('out', 'A'), path.join('A', 'x'))
+  task, = tasks_for_files([path.join('in', 'y.xml')], 'in', 'out')
+  assert task == FileTask('in', 'y.xml', 'in', path.join('out', '.'), path.join('.', 'y'))
+  print('Test passed')
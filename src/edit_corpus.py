@@ -1,104 +1,138 @@
 import json
-import os
 from os import path
-import shutil
-from tqdm.auto import tqdm
-from bs4 import BeautifulSoup
-from soup_modifier import SoupModifier
-from os.path import exists
-from os import remove
-from formatter import CustomFormatter
-from bs4.dammit import EntitySubstitution
-custom_formatter = CustomFormatter(entity_substitution=EntitySubstitution.substitute_xml)
-
-from logging import getLogger, INFO, FileHandler
-logger = getLogger(__name__)
-logger.setLevel(INFO)
-handler = FileHandler('Modified files.txt', 'w', encoding='utf-8')
-logger.addHandler(handler)
-
-SKIPPED_FILES = 'skipped_files.txt'
-LOG_NAME = 'error_log.txt'
-
-file_skipping_logger = getLogger('file_skipping_logger')
-logger.addHandler(FileHandler(SKIPPED_FILES, 'w', encoding='utf-8'))
-
-error_logger = getLogger('error_logger')
-logger.addHandler(FileHandler(LOG_NAME, 'w', encoding='utf-8'))
-
-with open('config.json', 'r', encoding='utf-8') as fin:
-    config = json.load(fin)
-for key, value in config.items():
-    config[key] = path.expanduser(value)
-changes_file = config['changesFile']
-input_directory = config['inputDirectory']
-output_directory = config['outputDirectory']
-if not path.exists(changes_file):
-    print('Changes file not found: ' + changes_file)
-    exit()
-if not path.exists(input_directory):
-    print('Input directory not found: ' + input_directory)
-    exit()
-os.makedirs(output_directory, exist_ok=True)
-with open(changes_file, 'r', encoding='utf-8') as fin:
-    changesJson = json.load(fin)
-changes: dict[str, list[str]] | dict[str, str] = changesJson['changes']
-modifier = SoupModifier(changes)
-walk = list(os.walk(config['inputDirectory']))
-progress_bar = tqdm(walk)
-for dirpath, dirnames, filenames in progress_bar:
-    _, folder = path.split(dirpath)
-    if folder != 'Backup':
-        progress_bar.set_postfix_str(folder)
-        rel_path = path.relpath(dirpath, input_directory)
-        output_subdirectory = path.join(output_directory, rel_path)
-        for filename in filenames:
-            text_name, ext = path.splitext(filename)
-            rel_name = path.join(rel_path, text_name)
-            if ext == '.xml':
-              try:
-                outfile = path.join(output_subdirectory, filename)
-                if path.exists(outfile):
-                    infile = outfile
-                else:
-                    infile = path.join(dirpath, filename)
-                with open(infile, 'r', encoding='utf-8') as fin:
-                    file_text = fin.read()
-                soup = BeautifulSoup(file_text, 'xml')
-                modified = modifier(soup, rel_name)
-                if modified:
-                    os.makedirs(output_subdirectory, exist_ok=True)
-                    with open(outfile, 'w', encoding='utf-8') as fout:
-                        outfile_text = soup.decode(formatter=custom_formatter)
-                        fout.write(outfile_text)
-                    logger.info('{0:8} {1}'.format(folder, text_name))
-              except (KeyError, ValueError):
-                fullname = path.join(dirpath, filename)
-                file_skipping_logger.error(fullname)
-                error_logger.exception(fullname)
-              except (PermissionError):
-                fullname = path.join(dirpath, filename)
-                file_skipping_logger.error(fullname)
-                error_logger.exception(fullname)
-                print('The file {0} is locked and could not be edited.'.format(fullname))
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+from argparse import ArgumentParser
+from typing import Any
+from corpus_editor import RunOptions, RunSummary, LogDestinations, run, index_corpus, undo_run
+from change_journal import render_journal
+from analysis_dictionary import merge_dictionaries
+from watcher import Watcher
+from cProfile import Profile
+
+def read_config(filename: str = 'config.json') -> dict[str, Any]:
+    """ Read the configuration, expanding the user's home directory in the paths. """
+    with open(filename, 'r', encoding='utf-8') as fin:
+        config: dict[str, Any] = json.load(fin)
+    for key, value in config.items():
+        if isinstance(value, str):
+            config[key] = path.expanduser(value)
+    return config
+
+def print_summary(summary: RunSummary) -> None:
+    counters = summary.counters
+    if summary.unchanged > 0:
+        print('Skipped {0} files unchanged since the last run. Use --full to process them.'.format(summary.unchanged))
+    if summary.prefilter:
+        print('The prefilter skipped {0} of {1} files without parsing them.'.format(
+            counters['prefiltered'], summary.discovered - summary.unchanged))
+    print('Morphological analyses parsed: {0}, reused from the cache: {1}.'.format(
+        counters['parse cache misses'], counters['parse cache hits']))
+    print('Bytes written: {0}, skipped as already in the output files: {1}.'.format(
+        counters['bytes written'], counters['bytes skipped']))
+    if counters['skipped'] > 0:
+        print('{0} files could not be edited and have been skipped. '
+              'Use --retry-skipped to process only them.'.format(counters['skipped']))
+
+def main() -> None:
+    parser = ArgumentParser(description='Apply the changes file to the XML files of the corpus.')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of worker processes editing files in parallel')
+    parser.add_argument('--full', action='store_true',
+                        help='process all files, including those unchanged since the last run')
+    parser.add_argument('--profile', nargs='?', const='profile.json', metavar='FILE',
+                        help='write the durations of the stages of processing every file and '
+                        'the counts of the work done into a JSON report (profile.json by default)')
+    parser.add_argument('--profile-top', type=int, default=20, metavar='N',
+                        help='number of the slowest files listed in the report')
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help='write the statistics of cProfile into a file readable with pstats '
+                        '(only the main process is profiled)')
+    parser.add_argument('--io-threads', type=int, default=0, metavar='N',
+                        help='read the next files and write the modified files in the background, '
+                        'with N threads each (only with a single process)')
+    parser.add_argument('--queue-depth', type=int, default=8, metavar='N',
+                        help='maximal number of files read in advance and of files waiting to be written')
+    parser.add_argument('--index', action='store_true',
+                        help='build or update the index of the morphological analyses of the corpus and exit')
+    parser.add_argument('--use-index', action='store_true',
+                        help='edit only the files which contain the analyses to be replaced according to the index')
+    parser.add_argument('--watch', nargs='?', type=float, const=1.0, metavar='SECONDS',
+                        help='keep running and process the files and the changes files whenever they are modified, '
+                        'polling them every SECONDS (1 by default)')
+    parser.add_argument('--retry-skipped', action='store_true',
+                        help='process only the files skipped because of errors when they were last processed, '
+                        'appending to the log files')
+    parser.add_argument('--lock-retries', type=int, default=0, metavar='N',
+                        help='try N more times to edit a locked file, waiting longer every time '
+                        '(only without --jobs and --io-threads)')
+    parser.add_argument('--lock-delay', type=float, default=1.0, metavar='SECONDS',
+                        help='time to wait before the first retry of a locked file, doubled for every further one')
+    parser.add_argument('--journal', nargs='?', const='Log.jsonl', metavar='FILE',
+                        help='also write the modifications as JSON Lines into FILE (Log.jsonl by default)')
+    parser.add_argument('--render-journal', nargs=2, metavar=('JOURNAL', 'LOG'),
+                        help='write the modifications of the JSON Lines file JOURNAL into LOG '
+                        'in the layout of Log.txt and exit')
+    parser.add_argument('--undo', nargs='?', type=int, const=0, metavar='RUN',
+                        help='restore the output files modified by the run number RUN (the last run by default) '
+                        'from the undo journal and exit')
+    parser.add_argument('--undo-file', action='append', metavar='FILE',
+                        help='with --undo, restore only this file of the input directory (can be repeated)')
+    parser.add_argument('--dictionary', nargs='?', const='Dictionary.json', metavar='FILE',
+                        help='process all files and write the analyses of the Hurrian words after the changes '
+                        'with their word forms and counts into FILE (Dictionary.json by default)')
+    parser.add_argument('--merge-dictionaries', nargs='+', metavar='FILE',
+                        help='merge the dictionaries written by separate runs into the file given by --dictionary '
+                        '(Dictionary.json by default) and exit')
+    args = parser.parse_args()
+    if args.render_journal is not None:
+        render_journal(*args.render_journal)
+        return
+    if args.merge_dictionaries is not None:
+        output_filename = args.dictionary if args.dictionary is not None else 'Dictionary.json'
+        merged = merge_dictionaries(args.merge_dictionaries, output_filename)
+        print('The dictionary of {0} analyses has been written to {1}.'.format(len(merged), output_filename))
+        return
+    config = read_config()
+    if args.undo is not None:
+        try:
+            undo_run(config, args.undo if args.undo > 0 else None, args.undo_file, print)
+        except ValueError as error:
+            print(error)
+        return
+    if args.index:
+        try:
+            index_corpus(config, print)
+        except ValueError as error:
+            print(error)
+        return
+    options = RunOptions(args.jobs, args.full, args.io_threads, args.queue_depth, args.use_index,
+                         True, args.profile, args.profile_top, args.retry_skipped, args.lock_retries, args.lock_delay,
+                         args.dictionary)
+    logs = LogDestinations(journal=args.journal)
+    if args.watch is not None:
+        try:
+            watcher = Watcher(config, options, logs, print, args.watch)
+        except ValueError as error:
+            print(error)
+            exit()
+        print('Watching the corpus for modifications. Press Ctrl+C to stop.')
+        try:
+            watcher.watch()
+        except KeyboardInterrupt:
+            pass
+        return
+    profiler = Profile() if args.cprofile is not None else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        summary = run(config, options, logs, report=print)
+    except ValueError as error:
+        print(error)
+        exit()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+    print_summary(summary)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,473 @@
+import os
+import time
+from os import path
+import logging
+from logging import getLogger, INFO, Handler, LogRecord
+from logging.handlers import QueueHandler
+from typing import Any, NamedTuple
+from io import BytesIO
+from soup_modifier import SoupModifier
+from change_sets import ChangeSet
+from change_journal import FileJournal, JournalWriter
+from prefilter import Prefilter
+from attribute_patcher import edit_with_patches, stream_patches
+from manifest import ManifestEntry, HashingReader, make_entry, content_digest, changes_digest
+from output_writer import temporary_filename, encode_text, write_file, replace_file
+from undo_journal import UndoRecord, CREATED, CompressingReader, record_patches, record_original
+from analysis_dictionary import AnalysisDictionary
+from morph import DEFAULT_PARSE_CACHE_SIZE, set_parse_cache_size, parse_cache_info
+from profiler import StageTimer
+
+logger = getLogger('modified_files')
+logger.setLevel(INFO)
+file_skipping_logger = getLogger('file_skipping_logger')
+error_logger = getLogger('error_logger')
+
+class FileTask(NamedTuple):
+  """ A single XML file of the corpus to be edited. """
+  dirpath: str
+  filename: str
+  folder: str
+  output_subdirectory: str
+  rel_name: str
+
+  @property
+  def key(self) -> str:
+    """ The path of the file relative to the input directory, with forward slashes. """
+    rel_file = path.join(path.dirname(self.rel_name), self.filename)
+    return path.normpath(rel_file).replace(os.sep, '/')
+
+  @property
+  def outfile(self) -> str:
+    return path.join(self.output_subdirectory, self.filename)
+
+  def input_file(self) -> tuple[str, str]:
+    """ Return the file to be read, which is the one in the output directory
+    if it exists, since it is assumed to be the up-to-date version, together
+    with the directory it comes from ('output' or 'input').
+    """
+    if path.exists(self.outfile):
+      return 'output', self.outfile
+    else:
+      return 'input', path.join(self.dirpath, self.filename)
+
+class FileResult(NamedTuple):
+  """ The outcome of editing a single file.
+
+  :param modified: Whether the file has been modified and written.
+  :param prefiltered: Whether the file has been skipped without parsing
+  because it cannot contain any of the analyses to be replaced.
+  :param entry: The manifest entry for the file, None if it could not be edited.
+  :param counters: Statistics of the work done on the file, to be summed over the run.
+  :param timings: The durations of the stages of processing the file in seconds.
+  :param journal: The modifications and warnings of the file not written yet, to be written by the main process.
+  :param log_records: The log records emitted while editing the file
+  in a worker process, to be handled by the main process.
+  :param error: The type of the error for which the file has been skipped, None if it has not.
+  :param message: A message for the user about the file, to be reported by the main process.
+  :param undo: The record restoring the previous content of the output file if it has been modified
+  and the undo journal is kept.
+  :param dictionary: The analyses of the file after the changes if they are collected.
+  """
+  modified: bool
+  prefiltered: bool
+  entry: ManifestEntry | None
+  counters: dict[str, int]
+  timings: dict[str, float]
+  journal: FileJournal
+  log_records: list[LogRecord]
+  error: str | None = None
+  message: str | None = None
+  undo: UndoRecord | None = None
+  dictionary: AnalysisDictionary | None = None
+
+# Increase when the editing logic changes,
+# so that incremental runs process all files again.
+ENGINE_VERSION = '1'
+ENGINES = ('soup', 'lxml')
+OUTPUT_MODES = ('serialise', 'patch')
+
+class EditorSettings(NamedTuple):
+  """ The settings of the editor which can be specified in config.json.
+
+  :param use_prefilter: Whether to skip the files which cannot contain
+  any of the analyses to be replaced without parsing them.
+  :param engine: 'soup' to edit the files as BeautifulSoup trees,
+  'lxml' to edit them while they are parsed incrementally with lxml.
+  :param output_mode: 'serialise' to write the whole parsed document,
+  'patch' to replace only the changed attribute values in the original file.
+  The engine is not used in the latter case.
+  :param parse_cache_size: The number of parsed morph. analyses
+  kept for reuse, None for no limit.
+  :param stream_buffer: The size in bytes of the buffer in which the files larger than it
+  are read, edited and written chunk by chunk instead of at once, None to read every file at once.
+  :param undo_journal: Whether to record how to restore the modified output files (see UndoJournal).
+  :param collect_dictionary: Whether to collect the analyses of every file (see AnalysisDictionary),
+  which is not read from the configuration but set for the runs writing a dictionary.
+  """
+  use_prefilter: bool = False
+  engine: str = 'soup'
+  output_mode: str = 'serialise'
+  parse_cache_size: int | None = DEFAULT_PARSE_CACHE_SIZE
+  stream_buffer: int | None = None
+  undo_journal: bool = False
+  collect_dictionary: bool = False
+
+  @classmethod
+  def from_config(cls, config: dict[str, Any]) -> 'EditorSettings':
+    defaults = cls()
+    settings = cls(
+      config.get('prefilter', defaults.use_prefilter),
+      config.get('engine', defaults.engine),
+      config.get('outputMode', defaults.output_mode),
+      config.get('parseCacheSize', defaults.parse_cache_size),
+      config.get('streamBuffer', defaults.stream_buffer),
+      config.get('undoJournal', defaults.undo_journal)
+    )
+    if settings.engine not in ENGINES:
+      raise ValueError('Unknown engine: {0}. The available engines are: {1}'.format(
+        settings.engine, ', '.join(ENGINES)))
+    if settings.output_mode not in OUTPUT_MODES:
+      raise ValueError('Unknown output mode: {0}. The available output modes are: {1}'.format(
+        settings.output_mode, ', '.join(OUTPUT_MODES)))
+    if settings.stream_buffer is not None and (not isinstance(settings.stream_buffer, int) or settings.stream_buffer < 1):
+      raise ValueError('The stream buffer must be a positive number of bytes: {0}'.format(settings.stream_buffer))
+    return settings
+
+class LoadedFile(NamedTuple):
+  """ The content of a file to be edited together with the state
+  of the file when it was read.
+
+  :param source: 'output' if the file comes from the output directory, 'input' otherwise.
+  :param digest: The hash of the content if it is not in data, since the file has been streamed.
+  """
+  source: str
+  filename: str
+  data: bytes
+  stat: os.stat_result
+  digest: str | None = None
+
+def load_file(task: FileTask) -> LoadedFile:
+  """ Read the file to be edited. This does not log anything,
+  so it can be done in advance in another thread.
+  """
+  source, infile = task.input_file()
+  with open(infile, 'rb') as fin:
+    stat = os.fstat(fin.fileno())
+    data = fin.read()
+  return LoadedFile(source, infile, data, stat)
+
+def decode_text(data: bytes) -> str:
+  """ Decode the content of a file as reading it in text mode does. """
+  return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+def count_bytes(counters: dict[str, int], written: bool, size: int) -> None:
+  """ Count the bytes of an output file as written or as skipped because they were there already. """
+  counters['bytes written' if written else 'bytes skipped'] = size
+
+def write_output(task: FileTask, outfile_text: str | bytes, changes: str, counters: dict[str, int]) -> ManifestEntry:
+  """ Store a modified file in the output directory atomically, unless the output file
+  has this content already, and return its manifest entry.
+  This does not log anything, so it can be done in another thread.
+  """
+  os.makedirs(task.output_subdirectory, exist_ok=True)
+  data = outfile_text if isinstance(outfile_text, bytes) else encode_text(outfile_text)
+  count_bytes(counters, write_file(task.outfile, data), len(data))
+  return make_entry('output', task.outfile, changes)
+
+class FileEditor:
+  """ Apply the changes to single files of the corpus.
+  Editing a file consists of loading it (load_file), transforming it,
+  writing it if it has been modified (write_output) and finishing it,
+  which logs the outcome. The modifications are only recorded in the journal
+  of the result, which is written by the caller, unless a streamed file is given a writer,
+  and all the logging is done by the last step,
+  so that the log files only depend on the order in which the files are finished.
+  """
+
+  def __init__(self, change_sets: list[ChangeSet], settings: EditorSettings):
+    self.modifier = SoupModifier(change_sets)
+    # The prefilter cannot tell which files contain analyses matched by the rules.
+    # The analyses replaced by a later change set either occur in the file
+    # or are introduced by an earlier one, so the prefilter is still conservative.
+    # The dictionary needs the analyses of all files.
+    if settings.use_prefilter and not self.modifier.has_rules and not settings.collect_dictionary:
+      self.prefilter: Prefilter | None = Prefilter(origin for change_set in self.modifier.change_sets
+                                                   for origin in change_set.changes)
+    else:
+      self.prefilter = None
+    self.engine = settings.engine
+    self.output_mode = settings.output_mode
+    self.stream_buffer = settings.stream_buffer
+    self.undo_journal = settings.undo_journal
+    self.collect_dictionary = settings.collect_dictionary
+    self.changes_digest = changes_digest(
+      [(change_set.changes, change_set.rules.definitions) for change_set in self.modifier.change_sets],
+      [ENGINE_VERSION, self.engine, self.output_mode]
+    )
+
+  def edit(self, data: bytes, rel_name: str, timer: StageTimer, journal: FileJournal,
+           reverse: list[tuple[int, int, bytes]] | None = None,
+           dictionary: AnalysisDictionary | None = None) -> tuple[bool, str | bytes]:
+    """ Apply the changes to the content of a file. With the lxml engine and in the patch mode,
+    the stages from parsing to serialisation are interleaved and timed as 'modify'.
+    The libraries of the engine are only imported when it is first used.
+    The modifications are recorded in the journal, also those made before an error.
+    In the patch mode, the replacements restoring the content are added to reverse, if given.
+    The analyses after the changes are counted in the dictionary, if given.
+
+    :return: Whether the file has been modified and its modified text,
+    or its modified bytes in the patch mode.
+    """
+    self.modifier.journal = journal
+    self.modifier.dictionary = dictionary
+    if self.output_mode == 'patch':
+      patch_result = edit_with_patches(self.modifier, data, rel_name, reverse)
+      timer.stage('modify')
+      return patch_result
+    if self.engine == 'lxml':
+      from lxml_engine import edit_with_lxml
+      lxml_result = edit_with_lxml(self.modifier, BytesIO(data), rel_name)
+      timer.stage('modify')
+      return lxml_result
+    from bs4 import BeautifulSoup
+    from formatter import custom_formatter
+    file_text = decode_text(data)
+    soup = BeautifulSoup(file_text, 'xml')
+    timer.stage('parse')
+    modified = self.modifier(soup, rel_name)
+    timer.stage('modify')
+    if modified:
+      outfile_text = soup.decode(formatter=custom_formatter)
+      timer.stage('serialise')
+      return modified, outfile_text
+    else:
+      return modified, ''
+
+  def streams(self, task: FileTask) -> bool:
+    """ Whether the file is larger than the stream buffer, so that it is streamed. """
+    if self.stream_buffer is None:
+      return False
+    _, infile = task.input_file()
+    try:
+      return os.path.getsize(infile) > self.stream_buffer
+    except OSError:
+      return False
+
+  def stream(self, task: FileTask, counters: dict[str, int], journal: FileJournal,
+             timer: StageTimer, dictionary: AnalysisDictionary | None = None) -> FileResult:
+    """ Apply the changes to a file read and written in chunks of the size of the stream buffer.
+    The result is written into a temporary file next to the output file, which replaces
+    the output file if the file has been modified into a different content. The prefilter is not used,
+    and the stages from reading to writing are timed as 'modify'.
+    """
+    assert self.stream_buffer is not None
+    source, infile = task.input_file()
+    os.makedirs(task.output_subdirectory, exist_ok=True)
+    temporary_file = temporary_filename(task.outfile)
+    cache_info = parse_cache_info()
+    self.modifier.journal = journal
+    self.modifier.dictionary = dictionary
+    records_undo = self.undo_journal and source == 'output'
+    try:
+      with open(infile, 'rb') as fin:
+        stat = os.fstat(fin.fileno())
+        reader = HashingReader(fin)
+        if self.output_mode == 'patch':
+          reverse = list[tuple[int, int, bytes]]() if records_undo else None
+          with open(temporary_file, 'wb') as fout:
+            modified = stream_patches(self.modifier, reader, fout, task.rel_name, self.stream_buffer, reverse)
+          undo = None if reverse is None else record_patches(reverse)
+        else:
+          from lxml_engine import stream_with_lxml
+          compressing = CompressingReader(reader) if records_undo else None
+          with open(temporary_file, 'w', encoding='utf-8') as fout:
+            modified = stream_with_lxml(self.modifier, reader if compressing is None else compressing,
+                                        fout, task.rel_name, self.stream_buffer)
+          undo = None if compressing is None else compressing.record()
+        digest = reader.hexdigest()
+    except BaseException:
+      if path.exists(temporary_file):
+        os.remove(temporary_file)
+      raise
+    timer.stage('modify')
+    new_cache_info = parse_cache_info()
+    counters.update(self.modifier.counters)
+    counters['parse cache hits'] = new_cache_info.hits - cache_info.hits
+    counters['parse cache misses'] = new_cache_info.misses - cache_info.misses
+    written = None
+    if modified:
+      size = path.getsize(temporary_file)
+      count_bytes(counters, replace_file(temporary_file, task.outfile), size)
+      written = make_entry('output', task.outfile, self.changes_digest)
+      timer.stage('write')
+    else:
+      os.remove(temporary_file)
+    if self.undo_journal and source == 'input':
+      undo = CREATED
+    return self.finish(task, LoadedFile(source, infile, b'', stat, digest), False, written, counters, journal, timer,
+                       undo, dictionary)
+
+  def new_dictionary(self) -> AnalysisDictionary | None:
+    """ The dictionary of the analyses of a file, None if they are not collected. """
+    return AnalysisDictionary() if self.collect_dictionary else None
+
+  def is_prefiltered(self, data: bytes) -> bool:
+    """ Whether the file cannot contain any of the analyses to be replaced. """
+    if self.prefilter is None:
+      return False
+    return not self.prefilter.may_match(decode_text(data))
+
+  def transform(self, task: FileTask, loaded: LoadedFile, counters: dict[str, int],
+                journal: FileJournal, timer: StageTimer,
+                dictionary: AnalysisDictionary | None = None) -> tuple[bool, str | bytes | None, UndoRecord | None]:
+    """ Apply the changes to a loaded file, counting its analyses in the dictionary, if given.
+
+    :return: Whether the file has been skipped by the prefilter,
+    the modified content, None if the file has not been modified,
+    and the record restoring the output file if it is modified and the undo journal is kept.
+    """
+    if self.is_prefiltered(loaded.data):
+      timer.stage('prefilter')
+      return True, None, None
+    timer.stage('prefilter')
+    cache_info = parse_cache_info()
+    records_patches = self.undo_journal and loaded.source == 'output' and self.output_mode == 'patch'
+    reverse = list[tuple[int, int, bytes]]() if records_patches else None
+    modified, outfile_text = self.edit(loaded.data, task.rel_name, timer, journal, reverse, dictionary)
+    new_cache_info = parse_cache_info()
+    counters.update(self.modifier.counters)
+    counters['parse cache hits'] = new_cache_info.hits - cache_info.hits
+    counters['parse cache misses'] = new_cache_info.misses - cache_info.misses
+    if not modified:
+      return False, None, None
+    undo = None
+    if self.undo_journal:
+      if loaded.source == 'input':
+        undo = CREATED
+      elif reverse is not None:
+        undo = record_patches(reverse)
+      else:
+        undo = record_original(loaded.data)
+      timer.stage('undo')
+    return False, outfile_text, undo
+
+  def finish(self, task: FileTask, loaded: LoadedFile, prefiltered: bool, written: ManifestEntry | None,
+             counters: dict[str, int], journal: FileJournal, timer: StageTimer,
+             undo: UndoRecord | None = None, dictionary: AnalysisDictionary | None = None) -> FileResult:
+    """ Log the file if it has been modified and return the result.
+
+    :param written: The manifest entry of the written file, None if it has not been modified.
+    :param undo: The record restoring the previous content of the written file.
+    :param dictionary: The analyses of the file, if they are collected.
+    """
+    if written is not None:
+      text_name, _ = path.splitext(task.filename)
+      logger.info('{0:8} {1}'.format(task.folder, text_name))
+      return FileResult(True, False, written, counters, timer.timings, journal, [], undo=undo, dictionary=dictionary)
+    digest = loaded.digest if loaded.digest is not None else content_digest(loaded.data)
+    entry = ManifestEntry(loaded.source, loaded.stat.st_size, loaded.stat.st_mtime_ns, digest, self.changes_digest)
+    timer.stage('manifest')
+    return FileResult(False, prefiltered, entry, counters, timer.timings, journal, [], dictionary=dictionary)
+
+  def fail(self, task: FileTask, error: Exception, counters: dict[str, int], journal: FileJournal,
+           timer: StageTimer) -> FileResult:
+    """ Log a file which could not be edited as skipped. A locked file
+    is also reported to the user through the message of the result.
+    """
+    fullname = path.join(task.dirpath, task.filename)
+    file_skipping_logger.error(fullname)
+    error_logger.error(fullname, exc_info=error)
+    message = None
+    if isinstance(error, PermissionError):
+      message = 'The file {0} is locked and could not be edited.'.format(fullname)
+    return FileResult(False, False, None, counters, timer.timings, journal, [], type(error).__name__, message)
+
+  def __call__(self, task: FileTask, lock_retries: int = 0, lock_delay: float = 1.0,
+               writer: JournalWriter | None = None) -> FileResult:
+    """ Apply the changes to a single file and store it in the output directory
+    if it has been modified. Files which cannot be edited are logged as skipped.
+
+    :param lock_retries: How many times to try again to edit a file which is locked.
+    A streamed file is not tried again once part of its journal has been written.
+    :param lock_delay: The time in seconds to wait before the first retry,
+    which is doubled for every further one.
+    :param writer: The journal writer which writes the journal of a streamed file
+    while it is edited, if the result is handled before the next file is edited.
+    """
+    attempt = 0
+    while True:
+      counters = dict[str, int]()
+      streams = self.streams(task)
+      journal = FileJournal(writer if streams else None)
+      timer = StageTimer()
+      dictionary = self.new_dictionary()
+      try:
+        if streams:
+          return self.stream(task, counters, journal, timer, dictionary)
+        loaded = load_file(task)
+        timer.stage('read')
+        prefiltered, outfile_text, undo = self.transform(task, loaded, counters, journal, timer, dictionary)
+        written = None
+        if outfile_text is not None:
+          written = write_output(task, outfile_text, self.changes_digest, counters)
+          timer.stage('write')
+        return self.finish(task, loaded, prefiltered, written, counters, journal, timer, undo, dictionary)
+      except (KeyError, ValueError, PermissionError) as error:
+        if isinstance(error, PermissionError) and attempt < lock_retries and not journal.written:
+          journal.close()
+          time.sleep(lock_delay * 2 ** attempt)
+          attempt += 1
+          continue
+        return self.fail(task, error, counters, journal, timer)
+
+class RecordCollector(QueueHandler):
+  """ A logging handler which stores the records
+  emitted in a worker process in a list.
+  The records are prepared for pickling in the same way
+  as by the standard queue handler.
+  """
+
+  def __init__(self) -> None:
+    Handler.__init__(self)
+    self.records = list[LogRecord]()
+
+  def enqueue(self, record: LogRecord) -> None:
+    self.records.append(record)
+
+worker_editor: FileEditor | None = None
+worker_collector = RecordCollector()
+
+def init_worker(change_sets: list[ChangeSet], settings: EditorSettings) -> None:
+  """ Prepare a worker process: build its own editor and
+  redirect all log records into the collector, so that no worker
+  writes to the log files directly.
+  """
+  global worker_editor
+  set_parse_cache_size(settings.parse_cache_size)
+  worker_editor = FileEditor(change_sets, settings)
+  for name in list(logging.root.manager.loggerDict):
+    existing_logger = logging.root.manager.loggerDict[name]
+    if isinstance(existing_logger, logging.Logger):
+      for handler in list(existing_logger.handlers):
+        existing_logger.removeHandler(handler)
+  for handler in list(logging.root.handlers):
+    logging.root.removeHandler(handler)
+  logging.root.addHandler(worker_collector)
+
+def edit_file_in_worker(task: FileTask) -> FileResult:
+  """ Edit a file in a worker process and return
+  the log records emitted meanwhile together with the result.
+  """
+  assert worker_editor is not None
+  result = worker_editor(task)
+  log_records = worker_collector.records
+  worker_collector.records = list[LogRecord]()
+  return result._replace(log_records=log_records)
+
+def replay_log_records(log_records: list[LogRecord]) -> None:
+  """ Handle the log records collected in a worker process
+  by the loggers of the main process, in their original order.
+  """
+  for record in log_records:
+    getLogger(record.name).handle(record)
@@ -1,4 +1,5 @@
 from bs4.formatter import XMLFormatter
+from bs4.dammit import EntitySubstitution
 from bs4 import Tag
 from bs4.element import AttributeValueList
 from collections.abc import Iterable
@@ -13,3 +14,5 @@ class CustomFormatter(XMLFormatter):
     """
     for key, value in tag.attrs.items():
       yield key, value
+
+custom_formatter = CustomFormatter(entity_substitution=EntitySubstitution.substitute_xml)
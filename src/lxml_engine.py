@@ -0,0 +1,210 @@
+from collections.abc import Callable, Iterator
+from typing import Any, BinaryIO, TextIO
+from lxml import etree
+from bs4.dammit import EntitySubstitution
+from soup_modifier import SoupModifier, Attributes
+from attribute_patcher import BinarySource
+
+XML_NAMESPACE = 'http://www.w3.org/XML/1998/namespace'
+# The declaration written by BeautifulSoup in place of the original one.
+XML_DECLARATION = '<?xml version="1.0" encoding="utf-8"?>\n'
+
+substitute_xml: Callable[[str], str] = EntitySubstitution.substitute_xml
+ascii_spaces = '\x20\x0a\x09\x0c\x0d'
+
+def text_value(text: str) -> str:
+  """ Escape a text node. Like BeautifulSoup, collapse
+  a text node consisting only of whitespace into a single
+  newline or space.
+  """
+  if text.strip(ascii_spaces) == '':
+    if '\n' in text:
+      return '\n'
+    else:
+      return ' '
+  return substitute_xml(text)
+
+def quoted_attribute_value(value: str) -> str:
+  """ Quote an attribute value in the same way as BeautifulSoup does. """
+  value = substitute_xml(value)
+  quote_with = '"'
+  if '"' in value:
+    if "'" in value:
+      value = value.replace('"', '&quot;')
+    else:
+      quote_with = "'"
+  return quote_with + value + quote_with
+
+def qualified_name(name: str, nsmap: dict[str | None, str]) -> str:
+  """ Convert a name in the lxml notation {namespace}local
+  into the prefixed notation used in the XML source.
+  """
+  if not name.startswith('{'):
+    return name
+  namespace, local_name = name[1:].split('}', 1)
+  if namespace == XML_NAMESPACE:
+    return 'xml:' + local_name
+  for prefix, uri in nsmap.items():
+    if uri == namespace and prefix is not None:
+      return prefix + ':' + local_name
+  return local_name
+
+class StreamingSerializer:
+  """ Serialise the events of lxml.etree.iterparse into the same text
+  as BeautifulSoup.decode with the custom formatter, while clearing
+  every element as soon as it has been written.
+
+  The start tag of an element is written only when its first child or its end
+  is reached, since only then its text is complete and it is known whether it is empty.
+  Likewise, the tail of a node is written when the next event is reached.
+  If an output file is given, the text is written into it whenever
+  the buffered text exceeds the buffer size, otherwise it is kept in pieces.
+  """
+
+  def __init__(self, output: TextIO | None = None, buffer_size: int = 0) -> None:
+    self.pieces = list[str]()
+    self.output = output
+    self.buffer_size = buffer_size
+    self.buffered = 0
+    self.open_element: Any = None
+    self.open_declarations = list[tuple[str, str]]()
+    self.declarations = list[tuple[str, str]]()
+    self.closed_node: Any = None
+    self.write(XML_DECLARATION)
+
+  def write(self, text: str) -> None:
+    self.pieces.append(text)
+    if self.output is not None:
+      self.buffered += len(text)
+      if self.buffered >= self.buffer_size:
+        self.write_buffer()
+
+  def write_buffer(self) -> None:
+    """ Write the buffered text into the output file. """
+    assert self.output is not None
+    self.output.write(''.join(self.pieces))
+    self.pieces.clear()
+    self.buffered = 0
+
+  def start_tag(self, element: Any, declarations: list[tuple[str, str]]) -> str:
+    nsmap = element.nsmap
+    parts = ['<' + qualified_name(element.tag, nsmap)]
+    for key, value in element.attrib.items():
+      parts.append(qualified_name(key, nsmap) + '=' + quoted_attribute_value(value))
+    for prefix, uri in declarations:
+      attribute = 'xmlns:' + prefix if prefix else 'xmlns'
+      parts.append(attribute + '=' + quoted_attribute_value(uri))
+    return ' '.join(parts)
+
+  def flush(self) -> None:
+    """ Write the pending start tag and the pending tail. """
+    if self.open_element is not None:
+      element = self.open_element
+      self.write(self.start_tag(element, self.open_declarations) + '>')
+      if element.text:
+        self.write(text_value(element.text))
+      self.open_element = None
+    if self.closed_node is not None:
+      node = self.closed_node
+      if node.tail:
+        self.write(text_value(node.tail))
+      parent = node.getparent()
+      if parent is not None:
+        parent.remove(node)
+      self.closed_node = None
+
+  def handle(self, event: str, node: Any) -> None:
+    if event == 'start-ns':
+      self.declarations.append(node)
+    elif event == 'start':
+      self.flush()
+      self.open_element = node
+      self.open_declarations = self.declarations
+      self.declarations = []
+    elif event == 'end':
+      if self.open_element is node:
+        start_tag = self.start_tag(node, self.open_declarations)
+        if node.text:
+          self.write(start_tag + '>' + text_value(node.text))
+          self.write('</' + qualified_name(node.tag, node.nsmap) + '>')
+        else:
+          self.write(start_tag + '/>')
+        self.open_element = None
+      else:
+        self.flush()
+        self.write('</' + qualified_name(node.tag, node.nsmap) + '>')
+      node.clear(keep_tail=True)
+      self.closed_node = node
+    elif event == 'comment':
+      self.flush()
+      self.write('<!--' + (node.text or '') + '-->')
+      self.closed_node = node
+    elif event == 'pi':
+      self.flush()
+      self.write('<?' + node.target + ' ' + (node.text or '') + '?>')
+      self.closed_node = node
+
+  def doctype(self, doctype: str) -> None:
+    if doctype:
+      self.write(doctype + '\n')
+
+def stream_tags(infile: BinarySource, serializer: StreamingSerializer) -> Iterator[tuple[str, Attributes]]:
+  """ Parse a file incrementally and yield the names and attributes
+  of the line (lb) and word (w) tags. All nodes are passed to the serializer,
+  the start tags after the attributes have been modified by the consumer.
+  The document type declaration is written before the first node, so that it precedes
+  the comments and processing instructions between it and the root element.
+  """
+  events = ('start', 'end', 'comment', 'pi', 'start-ns')
+  context = etree.iterparse(infile, events=events, recover=True, remove_comments=False)
+  first_node = True
+  for event, node in context:
+    if first_node and event != 'start-ns':
+      first_node = False
+      serializer.doctype(node.getroottree().docinfo.doctype)
+    serializer.handle(event, node)
+    if event == 'start' and node.tag in ('lb', 'w'):
+      yield node.tag, node.attrib
+  serializer.flush()
+
+def edit_with_lxml(modifier: SoupModifier, infile: BinaryIO, rel_name: str) -> tuple[bool, str]:
+  """ Apply the changes to a binary file object parsed incrementally with lxml.
+
+  :return: Whether the file has been modified and the modified text
+  which is identical to the one produced from the BeautifulSoup tree.
+  """
+  serializer = StreamingSerializer()
+  modified = modifier.modify_tags(stream_tags(infile, serializer), rel_name)
+  return modified, ''.join(serializer.pieces)
+
+def stream_with_lxml(modifier: SoupModifier, infile: BinarySource, outfile: TextIO, rel_name: str,
+                     buffer_size: int) -> bool:
+  """ Apply the changes to a binary file object parsed incrementally with lxml
+  and write the modified text into the output file whenever buffer_size characters
+  have accumulated, so that neither the source nor the result is held in memory.
+
+  :return: Whether the file has been modified. The output file is complete either way.
+  """
+  serializer = StreamingSerializer(outfile, buffer_size)
+  modified = modifier.modify_tags(stream_tags(infile, serializer), rel_name)
+  serializer.write_buffer()
+  return modified
+
+if __name__ == '__main__':
+  from io import BytesIO
+  from bs4 import BeautifulSoup
+  from formatter import custom_formatter
+  print('Test started')
+  modifier = SoupModifier([])
+  documents = [
+    b'<?xml version="1.0" encoding="UTF-8"?>\n<AOxml>\n<lb lnr="1" lg="Hur"/><w mrp1="a @ b @ c @ d @ ">x</w>\n</AOxml>',
+    # Comments and processing instructions between the document type declaration and the root element.
+    b'<?xml version="1.0"?>\n<!DOCTYPE AOxml SYSTEM "AOxml.dtd">\n<!-- prolog -->\n<?pi data?>\n'
+    b'<AOxml><!-- body --><w>x</w></AOxml>\n<!-- epilog -->',
+  ]
+  for document in documents:
+    soup_text = BeautifulSoup(document.decode('utf-8'), 'xml').decode(formatter=custom_formatter)
+    _, lxml_text = edit_with_lxml(modifier, BytesIO(document), 'test')
+    assert lxml_text == soup_text, (lxml_text, soup_text)
+  print('Test passed')
+
@@ -0,0 +1,134 @@
+import json
+import os
+from os import path
+from hashlib import sha256
+from typing import Any, BinaryIO, NamedTuple
+from morph import Morph
+
+MANIFEST_NAME = '.corpus_editor_manifest.json'
+# The size of the blocks in which files are hashed.
+BLOCK_SIZE = 1 << 20
+
+class ManifestEntry(NamedTuple):
+  """ The state of a file after it has been processed.
+
+  :param source: 'output' if the file to be read in the next run is the one
+  in the output directory, which takes precedence, 'input' otherwise.
+  :param size: The size of that file in bytes.
+  :param mtime: Its modification time in nanoseconds.
+  :param digest: The SHA-256 hash of its content.
+  :param changes: The digest of the changes and settings it has been processed with.
+  """
+  source: str
+  size: int
+  mtime: int
+  digest: str
+  changes: str
+
+def content_digest(data: bytes) -> str:
+  return sha256(data).hexdigest()
+
+def file_digest(filename: str) -> str:
+  """ Hash a file in blocks, so that it is never read into memory at once. """
+  digest = sha256()
+  with open(filename, 'rb') as fin:
+    while len(block := fin.read(BLOCK_SIZE)) > 0:
+      digest.update(block)
+  return digest.hexdigest()
+
+class HashingReader:
+  """ A binary file whose content is hashed while it is read. """
+
+  def __init__(self, file: BinaryIO):
+    self.file = file
+    self.digest = sha256()
+
+  def read(self, size: int = -1) -> bytes:
+    data = self.file.read(size)
+    self.digest.update(data)
+    return data
+
+  def hexdigest(self) -> str:
+    """ Read the rest of the file and return the hash of its whole content. """
+    while len(self.read(BLOCK_SIZE)) > 0:
+      pass
+    return self.digest.hexdigest()
+
+def make_entry(source: str, filename: str, changes: str) -> ManifestEntry:
+  stat = os.stat(filename)
+  return ManifestEntry(source, stat.st_size, stat.st_mtime_ns, file_digest(filename), changes)
+
+def changes_digest(change_sets: list[tuple[dict[Morph, list[Morph]], list[Any]]], settings: list[str]) -> str:
+  """ Compute a digest of the normalised changes and the rules of the change sets,
+  in their order, and of the settings which influence the result of processing a file.
+  """
+  digested: list[Any] = [settings]
+  for changes, rules in change_sets:
+    normalised = sorted([str(origin), [str(target) for target in targets]]
+                        for origin, targets in changes.items())
+    digested.append(normalised)
+    if len(rules) > 0:
+      digested.append(rules)
+  content = json.dumps(digested, ensure_ascii=False, sort_keys=True)
+  return sha256(content.encode('utf-8')).hexdigest()
+
+class Manifest:
+  """ A record of the files processed in previous runs, stored in the output directory,
+  which allows to skip the files that have not changed since they were last processed
+  with the same changes. It also records the files which could not be edited
+  when they were last processed, so that they can be processed again on their own.
+  """
+
+  def __init__(self, output_directory: str, changes: str):
+    self.filename = path.join(output_directory, MANIFEST_NAME)
+    self.changes = changes
+    self.entries = dict[str, ManifestEntry]()
+    # The number of files discovered in the input directory by the last complete run.
+    self.file_count: int | None = None
+    # The types of the errors for which files have been skipped, by the keys of the files.
+    self.skipped = dict[str, str]()
+    if path.exists(self.filename):
+      with open(self.filename, 'r', encoding='utf-8') as fin:
+        content = json.load(fin)
+      for key, fields in content['files'].items():
+        self.entries[key] = ManifestEntry(**fields)
+      self.file_count = content.get('fileCount')
+      self.skipped = content.get('skipped', {})
+
+  def is_unchanged(self, key: str, source: str, filename: str) -> bool:
+    """ Whether the file to be read has already been processed with the current changes.
+    The content hash is only computed if the size and modification time do not decide.
+    """
+    entry = self.entries.get(key)
+    if entry is None or entry.changes != self.changes or entry.source != source:
+      return False
+    stat = os.stat(filename)
+    if stat.st_size != entry.size:
+      return False
+    if stat.st_mtime_ns == entry.mtime:
+      return True
+    if file_digest(filename) == entry.digest:
+      self.entries[key] = entry._replace(mtime=stat.st_mtime_ns)
+      return True
+    return False
+
+  def update(self, key: str, entry: ManifestEntry | None, error: str | None = None) -> None:
+    """ Record a processed file, whose entry is None if it has been skipped because of the error. """
+    self.skipped.pop(key, None)
+    if entry is None:
+      self.entries.pop(key, None)
+      if error is not None:
+        self.skipped[key] = error
+    else:
+      self.entries[key] = entry
+
+  def save(self) -> None:
+    content: dict[str, object] = {'files': {key: entry._asdict() for key, entry in sorted(self.entries.items())}}
+    if self.file_count is not None:
+      content['fileCount'] = self.file_count
+    if len(self.skipped) > 0:
+      content['skipped'] = dict(sorted(self.skipped.items()))
+    temporary_filename = self.filename + '.tmp'
+    with open(temporary_filename, 'w', encoding='utf-8') as fout:
+      json.dump(content, fout, ensure_ascii=False, indent=1)
+    os.replace(temporary_filename, self.filename)
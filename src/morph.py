@@ -1,8 +1,25 @@
 from __future__ import annotations
+from functools import lru_cache
+from sys import intern
+from typing import Any, NamedTuple, NoReturn
 from logging import getLogger
 logger = getLogger(__name__)
 
 sep = '@'
+DEFAULT_PARSE_CACHE_SIZE = 1 << 16
+
+# The morphological tag options of an analysis as pairs of letter and tag, in their original order.
+MorphTags = tuple[tuple[str, str], ...]
+# The distinct morph. tag options seen so far. They repeat across analyses,
+# so each of them is stored only once.
+shared_morph_tags = dict[MorphTags, MorphTags]()
+
+def share_morph_tags(morph_tags: dict[str, str]) -> MorphTags:
+  """ Return the tuple form of the given morph. tag options,
+  shared with all the analyses having the same options.
+  """
+  options = tuple(morph_tags.items())
+  return shared_morph_tags.setdefault(options, options)
 
 def split_at_single(value: str, split_string: str,
                     split_at_last: bool=False) -> tuple[str, str | None]:
@@ -22,11 +39,24 @@ def read_enclitics_chain(enclitics_chain: str) -> Morph | None:
   enclitics, analyses_string = split_enclitics_chain[:2]
   if in_braces(analyses_string):
     enclitics_tags = parseMorphTags(analyses_string)
-    return MultiMorph(enclitics, '', enclitics_tags, '', '', None)
+    return MultiMorph(enclitics, '', share_morph_tags(enclitics_tags), '', '', None)
   else:
     return SingleMorph(enclitics, '', analyses_string, '', '', None)
 
 class Morph:
+    """ A morphological analysis. Analyses are immutable, so that they can be shared,
+    and their string form and hash are computed once at construction.
+    The subclasses set their own fields before calling this constructor.
+    """
+
+    __slots__ = ('segmentation', 'translation', 'pos', 'det', 'enclitics_analysis', '_string', '_hash')
+    segmentation: str
+    translation: str
+    pos: str
+    det: str
+    enclitics_analysis: Morph | None
+    _string: str
+    _hash: int
 
     def __init__(self,
                  segmentation: str,
@@ -34,11 +64,21 @@ class Morph:
                  pos: str,
                  det: str,
                  enclitics_analysis: Morph | None):
-        self.segmentation = segmentation
-        self.translation = translation
-        self.pos = pos
-        self.det = det
-        self.enclitics_analysis = enclitics_analysis
+        initialize = object.__setattr__
+        initialize(self, 'segmentation', segmentation)
+        initialize(self, 'translation', translation)
+        initialize(self, 'pos', pos)
+        initialize(self, 'det', det)
+        initialize(self, 'enclitics_analysis', enclitics_analysis)
+        fields = self.__tuple__()
+        initialize(self, '_string', ' @ '.join(fields))
+        initialize(self, '_hash', self.compute_hash(fields))
+
+    def __setattr__(self, name: str, value: Any) -> NoReturn:
+        raise AttributeError('Morphological analyses are immutable')
+
+    def __delattr__(self, name: str) -> NoReturn:
+        raise AttributeError('Morphological analyses are immutable')
     
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, Morph):
@@ -56,10 +96,20 @@ class Morph:
         return self.segmentation, self.translation, self.morph_info, self.pos, self.det
     
     def __str__(self) -> str:
-        return ' @ '.join(self.__tuple__())
+        return self._string
     
     def __hash__(self) -> int:
-        return self.__tuple__().__hash__()
+        return self._hash
+
+    def compute_hash(self, fields: tuple[str, str, str, str, str]) -> int:
+        return fields.__hash__()
+
+    @property
+    def lookup_key(self) -> str:
+        """ The string form of the analysis in which a single morph. tag option
+        is written as a plain morph. tag, so that equal analyses have the same key.
+        """
+        return self._string
     
     def to_multi(self, index: str) -> MultiMorph:
         raise NotImplementedError
@@ -102,19 +152,10 @@ class Morph:
 
     @classmethod
     def parse(cls, content: str) -> Morph | None:
-      segmentation, rest_without_segmentation = split_at_single(content, sep)
-      if rest_without_segmentation is None:
-        return None
-      translation, rest_without_translation = split_at_single(
-        rest_without_segmentation, sep
-      )
-      if rest_without_translation is None:
-        return None
-      morph_info, rest_without_morph_info = split_at_single(
-        rest_without_translation, sep
-      )
-      if rest_without_morph_info is None:
+      fields = content.split(sep, 3)
+      if len(fields) < 4:
         return None
+      segmentation, translation, morph_info, rest_without_morph_info = map(str.strip, fields)
       other_string, determinative_string = split_at_single(
         rest_without_morph_info, sep, True
       )
@@ -127,13 +168,20 @@ class Morph:
         enclitics_analysis = None
       else:
         enclitics_analysis = read_enclitics_chain(enclitics_chain)
+      segmentation = intern(segmentation)
+      translation = intern(translation)
+      pos = intern(pos)
+      det = intern(det)
       if in_braces(morph_info):
         morph_tags = parseMorphTags(morph_info)
-        return MultiMorph(segmentation, translation, morph_tags, pos, det, enclitics_analysis)
+        return MultiMorph(segmentation, translation, share_morph_tags(morph_tags), pos, det, enclitics_analysis)
       else:
-        return SingleMorph(segmentation, translation, morph_info, pos, det, enclitics_analysis)
+        return SingleMorph(segmentation, translation, intern(morph_info), pos, det, enclitics_analysis)
         
 class SingleMorph(Morph):
+
+    __slots__ = ('morph_tag',)
+    morph_tag: str
     
     def __init__(self,
                  segmentation: str,
@@ -142,16 +190,22 @@ class SingleMorph(Morph):
                  pos: str,
                  det: str,
                  enclitics_analysis: Morph | None):
+        object.__setattr__(self, 'morph_tag', morph_tag)
         super().__init__(segmentation, translation, pos, det, enclitics_analysis)
-        self.morph_tag = morph_tag
+
+    def __reduce__(self) -> tuple[type[SingleMorph], tuple[str, str, str, str, str, Morph | None]]:
+        return SingleMorph, (self.segmentation, self.translation, self.morph_tag,
+                             self.pos, self.det, self.enclitics_analysis)
     
     def __eq__(self, other: object) -> bool:
+        if self is other:
+            return True
         if not isinstance(other, Morph):
           return NotImplemented
         if super().__eq__(other):
             if isinstance(other, MultiMorph):
                 if other.is_singletone:
-                    return self.morph_tag == next(iter(other.morph_tags.values()))
+                    return self.morph_tag == other.morph_tags[0][1]
                 else:
                     return False
             elif isinstance(other, SingleMorph):
@@ -166,11 +220,11 @@ class SingleMorph(Morph):
         return self.morph_tag
     
     def __hash__(self) -> int:
-        return self.__tuple__().__hash__()
+        return self._hash
         
     def to_multi(self, index: str) -> MultiMorph:
         return MultiMorph(self.segmentation, self.translation,
-            {index: self.morph_tag}, self.pos, self.det, self.enclitics_analysis)
+            ((index, self.morph_tag),), self.pos, self.det, self.enclitics_analysis)
 
     @property
     def single_morph_tag(self) -> str:
@@ -182,34 +236,50 @@ class SingleMorph(Morph):
       return self.morph_tag
 
 class MultiMorph(Morph):
+
+    __slots__ = ('morph_tags',)
+    morph_tags: MorphTags
     
     def __init__(self,
                  segmentation: str,
                  translation: str,
-                 morph_tags: dict[str, str],
+                 morph_tags: MorphTags,
                  pos: str,
                  det: str,
                  enclitics_analysis: Morph | None):
+        object.__setattr__(self, 'morph_tags', morph_tags)
         super().__init__(segmentation, translation, pos, det, enclitics_analysis)
-        self.morph_tags = morph_tags
+
+    def __reduce__(self) -> tuple[type[MultiMorph], tuple[str, str, MorphTags, str, str, Morph | None]]:
+        return MultiMorph, (self.segmentation, self.translation, self.morph_tags,
+                            self.pos, self.det, self.enclitics_analysis)
     
     def __eq__(self, other: object) -> bool:
+        if self is other:
+            return True
         if not isinstance(other, Morph):
           return NotImplemented
         if super().__eq__(other):
             if isinstance(other, SingleMorph):
-                return self.is_singletone and next(iter(self.morph_tags.values())) == other.morph_tag
+                return self.is_singletone and self.morph_tags[0][1] == other.morph_tag
             elif isinstance(other, MultiMorph):
-                return self.morph_tags == other.morph_tags
+                # The order of the options does not matter for equality.
+                return (self.morph_tags == other.morph_tags or
+                        dict(self.morph_tags) == dict(other.morph_tags))
             else:
                 return NotImplemented
         else:
             return False
+
+    @property
+    def letters(self) -> list[str]:
+        """ The letter-indices of the morph. tag options in their original order. """
+        return [letter for letter, _ in self.morph_tags]
     
     @property
     def morph_info(self) -> str:
         elements = list[str]()
-        for key, value in self.morph_tags.items():
+        for key, value in self.morph_tags:
             element = '{ ' + key + ' → ' + value + '}'
             elements.append(element)
         return ' '.join(elements)
@@ -220,13 +290,24 @@ class MultiMorph(Morph):
     
     def to_single(self) -> SingleMorph:
         return SingleMorph(self.segmentation, self.translation,
-            next(iter(self.morph_tags.values())), self.pos, self.det, self.enclitics_analysis)
+            self.morph_tags[0][1], self.pos, self.det, self.enclitics_analysis)
     
     def __hash__(self) -> int:
+        return self._hash
+
+    def compute_hash(self, fields: tuple[str, str, str, str, str]) -> int:
+        """ A singleton analysis has the same hash as the equal single analysis. """
         if (self.is_singletone):
-            return self.to_single().__hash__()
+            return (self.segmentation, self.translation, self.morph_tags[0][1], self.pos, self.det).__hash__()
+        else:
+            return fields.__hash__()
+
+    @property
+    def lookup_key(self) -> str:
+        if self.is_singletone:
+            return ' @ '.join((self.segmentation, self.translation, self.morph_tags[0][1], self.pos, self.det))
         else:
-            return self.__tuple__().__hash__()
+            return self._string
     
     def to_multi(self, index: str) -> MultiMorph:
         return self
@@ -235,14 +316,15 @@ class MultiMorph(Morph):
     def single_morph_tag(self) -> str | None:
       if self.is_singletone:
         logger.warning('No morphological tag index is specified for a morphological analysis supporting multiple morphological tag options (%s). The single available option will be used.', self)
-        return next(iter(self.morph_tags.values()))
+        return self.morph_tags[0][1]
       else:
         logger.error('No morphological tag index is specified for a morphological analysis supporting multiple morphological tag options (%s). Because of ambiguity, no morphological tag option will be used.', self)
         return None
 
     def __getitem__(self, index: str) -> str | None:
-      if index in self.morph_tags:
-        return self.morph_tags[index]
+      for letter, morph_tag in self.morph_tags:
+        if letter == index:
+          return morph_tag
       else:
         logger.error('The specified morphological tag index (%s) was not found in the morphological tag option dictionary of the morphological analysis (%s). No morphological tag option will be used.', index, self)
         return None
@@ -259,9 +341,66 @@ def parseMorphTags(string: str) -> dict[str, str]:
             key, value = list(map(str.strip, element.split('→')))
         except:
             raise ValueError(string)
-        morph_tags[key] = value
+        morph_tags[intern(key)] = intern(value)
     return morph_tags
 
+def lookup_key_of(content: str) -> str | None:
+    """ Compute the lookup key of the analysis given as a string without parsing it,
+    which is much cheaper than Morph.parse(content).lookup_key.
+    Return None if the analysis has an enclitics chain or cannot be parsed,
+    so that it has to be parsed to decide.
+    """
+    fields = content.split(sep, 3)
+    if len(fields) < 4:
+        return None
+    segmentation, translation, morph_info, rest = map(str.strip, fields)
+    if '+=' in rest:
+        return None
+    det_index = rest.rfind(sep)
+    if det_index >= 0:
+        pos, det = rest[:det_index].strip(), rest[det_index + len(sep):].strip()
+    else:
+        pos, det = rest, ''
+    if in_braces(morph_info):
+        morph_tags = dict[str, str]()
+        for element in morph_info[1:-1].split('{'):
+            parts = element.strip().removesuffix('}').split('→')
+            if len(parts) != 2:
+                return None
+            morph_tags[parts[0].strip()] = parts[1].strip()
+        if len(morph_tags) == 1:
+            morph_info, = morph_tags.values()
+        else:
+            morph_info = ' '.join('{ ' + key + ' → ' + value + '}' for key, value in morph_tags.items())
+    return ' @ '.join((segmentation, translation, morph_info, pos, det))
+
+class CacheInfo(NamedTuple):
+  """ The numbers of calls of parse_morph answered from the cache and of analyses parsed. """
+  hits: int
+  misses: int
+
+cached_parse = lru_cache(maxsize=DEFAULT_PARSE_CACHE_SIZE)(Morph.parse)
+
+def parse_morph(content: str) -> Morph | None:
+  """ Parse a morphological analysis like Morph.parse, but return
+  the same object for repeated strings. The most recently used analyses
+  are kept in a bounded cache. The returned analyses are shared,
+  so they must never be modified.
+  """
+  return cached_parse(content)
+
+def set_parse_cache_size(size: int | None) -> None:
+  """ Replace the cache of parse_morph by an empty one of the given size.
+  None means an unbounded cache and 0 disables caching.
+  """
+  global cached_parse
+  cached_parse = lru_cache(maxsize=size)(Morph.parse)
+
+def parse_cache_info() -> CacheInfo:
+  """ Return the hit and miss counters of the cache of parse_morph. """
+  info = cached_parse.cache_info()
+  return CacheInfo(info.hits, info.misses)
+
 if __name__ == '__main__':
   print('Test started')
   m1 = Morph.parse('nāli @ Rehbock @ .ABS @ noun @ ')
@@ -272,3 +411,40 @@ if __name__ == '__main__':
   print(m1.__hash__())
   print(m2.__hash__())
   print(m2 == m1)
+  m3 = parse_morph('nāli @ Rehbock @ .ABS @ noun @ ')
+  assert m3 is parse_morph('nāli @ Rehbock @ .ABS @ noun @ ')
+  assert m3 == m1
+  print(parse_cache_info())
+  assert m1 is not None
+  # The lookup key is the same for all the equal analyses, including
+  # single morph. tags and single morph. tag options.
+  equal_analyses = [
+    'nāli @ Rehbock @ .ABS @ noun @ ',
+    'nāli@Rehbock@.ABS@noun@',
+    ' nāli @ Rehbock @ { a → .ABS} @ noun @ ',
+    'nāli @ Rehbock @ {a→.ABS} @ noun',
+    'nāli @ Rehbock @ { b  →  .ABS } @ noun @ ',
+    'nāli @ Rehbock @ { a → .ERG} { a → .ABS} @ noun @ ',
+  ]
+  for analysis in equal_analyses:
+    morph = Morph.parse(analysis)
+    assert morph is not None
+    assert morph == m1 and hash(morph) == hash(m1)
+    assert lookup_key_of(analysis) == morph.lookup_key == m1.lookup_key, analysis
+  different_analyses = [
+    'nāli @ Rehbock @ { a → .ABS} { b → .ERG} @ noun @ ',
+    'nāli @ Rehbock @ { b → .ERG} { a → .ABS} @ noun @ ',
+    'nāli @ Rehbock @ .ABS @ noun @ det',
+    'nāli @ Rehbock @ .ABS @ noun +=  @ ',
+  ]
+  for analysis in different_analyses:
+    morph = Morph.parse(analysis)
+    key = lookup_key_of(analysis)
+    if morph is not None and key is not None:
+      assert key == morph.lookup_key, analysis
+      assert (key == m1.lookup_key) == (morph == m1), analysis
+  # Analyses which have to be parsed to decide.
+  for analysis in ['nāli @ Rehbock @ .ABS', 'nāli @ Rehbock @ {a} @ noun @ ',
+                   'nāli @ Rehbock @ .ABS @ noun += -ma @ { a → .ABS} @ ']:
+    assert lookup_key_of(analysis) is None, analysis
+  print('Test passed')
@@ -1,37 +1,35 @@
 from morph import Morph, MultiMorph
-from more_itertools import first_true
+from selections import Selections
 
 def merge_identical_options_if_multi(index: str, morph: Morph,
-                                     selections: list[str]) -> Morph:
+                                     selections: Selections) -> Morph:
   if isinstance(morph, MultiMorph):
     return merge_identical_options(index, morph, selections)
   else:
     return morph
 
 def merge_identical_options(index: str, morph: MultiMorph,
-                            selections: list[str]) -> MultiMorph:
+                            selections: Selections) -> MultiMorph:
   """
   Unify identical analysis options and select the resulting option
   if either of the unified options is selected.
   """
   new_options = dict[str, str]()
-  for letter, option in morph.morph_tags.items():
-    if option in new_options.values():
+  # The letter of the first option with each morph. tag.
+  letters = dict[str, str]()
+  for letter, option in morph.morph_tags:
+    if option in letters:
       old_complete_index = index + letter
       if old_complete_index in selections:
         selections.remove(old_complete_index)
-        identical_option_letter = first_true(
-          morph.morph_tags,
-          pred=lambda letter: morph.morph_tags[letter] == option
-        )
-        if identical_option_letter is not None:
-          new_complete_index = index + identical_option_letter
-          if new_complete_index not in selections:
-            selections.append(new_complete_index)
+        new_complete_index = index + letters[option]
+        if new_complete_index not in selections:
+          selections.append(new_complete_index)
     else:
+      letters[option] = letter
       new_options[letter] = option
   return MultiMorph(morph.segmentation, morph.translation,
-                    new_options, morph.pos, morph.det, None)
+                    tuple(new_options.items()), morph.pos, morph.det, None)
 
 if __name__ == '__main__':
   print('Starting test.')
@@ -68,7 +66,7 @@ if __name__ == '__main__':
     print(str_selections)
     morph = Morph.parse(origin)
     assert isinstance(morph, MultiMorph)
-    selections = str_selections.split(' ')
+    selections = Selections(str_selections.split(' '))
     new_morph = merge_identical_options(index, morph, selections)
     print(new_morph)
     assert str(new_morph) == target
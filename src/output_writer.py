@@ -0,0 +1,133 @@
+import os
+from os import path
+from collections.abc import Callable
+from manifest import content_digest, file_digest
+
+# The number of directories whose entries are made durable at once.
+SYNC_BATCH_SIZE = 256
+
+def temporary_filename(filename: str) -> str:
+  """ The file next to a file, into which its new content is written before it replaces it. """
+  return filename + '.tmp'
+
+def encode_text(text: str) -> bytes:
+  """ Encode a text as writing it in text mode does. """
+  if os.linesep != '\n':
+    text = text.replace('\n', os.linesep)
+  return text.encode('utf-8')
+
+def has_content(filename: str, size: int, digest: Callable[[], str]) -> bool:
+  """ Whether a file exists with the given size and the given digest,
+  which is only computed if the file has that size.
+  """
+  try:
+    return path.getsize(filename) == size and file_digest(filename) == digest()
+  except OSError:
+    return False
+
+def sync_file(filename: str) -> None:
+  fd = os.open(filename, os.O_RDWR)
+  try:
+    os.fsync(fd)
+  finally:
+    os.close(fd)
+
+def replace_file(temporary: str, filename: str) -> bool:
+  """ Let a temporary file replace a file atomically, so that the file
+  has either its old or its new content even if the program is interrupted.
+  The temporary file is removed instead if the file already has its content.
+
+  :return: Whether the file has been replaced.
+  """
+  try:
+    if has_content(filename, path.getsize(temporary), lambda: file_digest(temporary)):
+      os.remove(temporary)
+      return False
+    sync_file(temporary)
+    os.replace(temporary, filename)
+    return True
+  except BaseException:
+    if path.exists(temporary):
+      os.remove(temporary)
+    raise
+
+def write_file(filename: str, data: bytes) -> bool:
+  """ Write the data into a file atomically, unless the file already has this content.
+
+  :return: Whether the file has been written.
+  """
+  if has_content(filename, len(data), lambda: content_digest(data)):
+    return False
+  temporary = temporary_filename(filename)
+  try:
+    with open(temporary, 'wb') as fout:
+      fout.write(data)
+      fout.flush()
+      os.fsync(fout.fileno())
+    os.replace(temporary, filename)
+  except BaseException:
+    if path.exists(temporary):
+      os.remove(temporary)
+    raise
+  return True
+
+def sync_directory(directory: str) -> None:
+  """ Make the entries of a directory durable, e.g. the files renamed in it.
+  This is not possible on all systems, e.g. on Windows, where it is not needed.
+  """
+  try:
+    fd = os.open(directory, os.O_RDONLY)
+  except OSError:
+    return
+  try:
+    os.fsync(fd)
+  except OSError:
+    pass
+  finally:
+    os.close(fd)
+
+class DirectorySync:
+  """ The directories in which files have been replaced. Their entries are made
+  durable in batches, with one fsync per directory instead of one per file.
+  """
+
+  def __init__(self, batch_size: int = SYNC_BATCH_SIZE):
+    self.batch_size = batch_size
+    self.directories = set[str]()
+
+  def add(self, directory: str) -> None:
+    self.directories.add(directory)
+    if len(self.directories) >= self.batch_size:
+      self.sync()
+
+  def sync(self) -> None:
+    for directory in sorted(self.directories):
+      sync_directory(directory)
+    self.directories.clear()
+
+if __name__ == '__main__':
+  import tempfile
+  print('Test started')
+  with tempfile.TemporaryDirectory() as directory:
+    filename = path.join(directory, 'a.xml')
+    assert write_file(filename, b'<text/>')
+    mtime = os.stat(filename).st_mtime_ns
+    assert not write_file(filename, b'<text/>')
+    assert os.stat(filename).st_mtime_ns == mtime
+    assert write_file(filename, b'<text />')
+    with open(temporary_filename(filename), 'wb') as fout:
+      fout.write(b'<text />')
+    assert not replace_file(temporary_filename(filename), filename)
+    assert os.listdir(directory) == ['a.xml']
+    with open(temporary_filename(filename), 'wb') as fout:
+      fout.write(b'<text/>')
+    assert replace_file(temporary_filename(filename), filename)
+    with open(filename, 'rb') as fin:
+      assert fin.read() == b'<text/>'
+    assert os.listdir(directory) == ['a.xml']
+    directories = DirectorySync(2)
+    directories.add(directory)
+    directories.add(directory)
+    assert directories.directories == {directory}
+    directories.sync()
+  print('Test passed')
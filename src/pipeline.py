@@ -0,0 +1,90 @@
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import NamedTuple
+from change_journal import FileJournal, journal_writer
+from undo_journal import UndoRecord
+from analysis_dictionary import AnalysisDictionary
+from file_editor import FileTask, FileResult, FileEditor, LoadedFile, load_file, write_output
+from manifest import ManifestEntry
+from profiler import StageTimer
+
+class PendingFile(NamedTuple):
+  """ A file which has been transformed and is possibly still being written. """
+  task: FileTask
+  loaded: LoadedFile | None
+  prefiltered: bool
+  writing: Future[ManifestEntry] | None
+  error: Exception | None
+  counters: dict[str, int]
+  journal: FileJournal
+  timer: StageTimer
+  undo: UndoRecord | None = None
+  dictionary: AnalysisDictionary | None = None
+
+def finish_pending(editor: FileEditor, pending: PendingFile) -> FileResult:
+  """ Wait until the file has been written and log its outcome. """
+  task, loaded, prefiltered, writing, error, counters, journal, timer, undo, dictionary = pending
+  if error is not None or loaded is None:
+    assert error is not None
+    return editor.fail(task, error, counters, journal, timer)
+  written = None
+  if writing is not None:
+    timer.resume()
+    try:
+      written = writing.result()
+    except (KeyError, ValueError, PermissionError) as write_error:
+      return editor.fail(task, write_error, counters, journal, timer)
+    timer.stage('write')
+  return editor.finish(task, loaded, prefiltered, written, counters, journal, timer, undo, dictionary)
+
+def edit_pipelined(editor: FileEditor, tasks: Iterable[FileTask], threads: int, depth: int) -> Iterator[FileResult]:
+  """ Edit the files like the editor does, but read the next files in advance
+  and write the modified files in the background, each with a pool of threads,
+  so that the parsing does not wait for the disk. At most depth files are read in advance
+  and at most depth files are waiting to be written, which bounds the memory used.
+  The files streamed by the editor are not read in advance, but edited by it in turn.
+
+  The results are yielded in the order of the tasks and the outcome of every file,
+  including its errors, is logged when its result is yielded, so the log files
+  are the same as when the files are edited one after another.
+  """
+  task_iterator = iter(tasks)
+  reads = deque[tuple[FileTask, Future[LoadedFile] | None]]()
+  pending = deque[PendingFile]()
+  with ThreadPoolExecutor(threads) as readers, ThreadPoolExecutor(threads) as writers:
+
+    def read_next() -> None:
+      task = next(task_iterator, None)
+      if task is not None:
+        reads.append((task, None if editor.streams(task) else readers.submit(load_file, task)))
+
+    for _ in range(depth):
+      read_next()
+    while len(reads) > 0:
+      task, reading = reads.popleft()
+      read_next()
+      if reading is None:
+        while len(pending) > 0:
+          yield finish_pending(editor, pending.popleft())
+        yield editor(task, writer=journal_writer)
+        continue
+      counters = dict[str, int]()
+      journal = FileJournal()
+      timer = StageTimer()
+      dictionary = editor.new_dictionary()
+      try:
+        loaded = reading.result()
+        timer.stage('read')
+        prefiltered, outfile_text, undo = editor.transform(task, loaded, counters, journal, timer, dictionary)
+        writing = None
+        if outfile_text is not None:
+          writing = writers.submit(write_output, task, outfile_text, editor.changes_digest, counters)
+        pending.append(PendingFile(task, loaded, prefiltered, writing, None, counters, journal, timer, undo,
+                                   dictionary))
+      except (KeyError, ValueError, PermissionError) as error:
+        pending.append(PendingFile(task, None, False, None, error, counters, journal, timer))
+      if len(pending) > depth:
+        yield finish_pending(editor, pending.popleft())
+    while len(pending) > 0:
+      yield finish_pending(editor, pending.popleft())
@@ -0,0 +1,80 @@
+import re
+from collections.abc import Iterable
+from morph import Morph
+
+Trie = dict[str, 'Trie']
+
+# Characters which may be escaped or normalised in the XML source,
+# so that a fragment containing them is not guaranteed to occur literally.
+unsafe_characters = re.compile(r'[&<>"\'\s]+')
+# Entity references which are not predefined may stand for any character.
+unknown_entity = re.compile(r'&(?!(?:amp|lt|gt|quot|apos);)')
+
+def get_needle(morph: Morph) -> str:
+  """ For a given morph. analysis, return the longest fragment
+  of its segmentation or translation that must occur literally
+  in the text of any file containing the analysis.
+  An empty string means that no such fragment is known.
+  """
+  fragments = unsafe_characters.split(morph.segmentation)
+  fragments.extend(unsafe_characters.split(morph.translation))
+  return max(fragments, key=len)
+
+def trie_pattern(node: Trie) -> str:
+  """ Build a regular expression matching any word stored in the trie.
+  Since it only matters whether some word occurs, the words
+  which have a shorter word as their prefix are dropped.
+  """
+  if '' in node:
+    return ''
+  alternatives = [re.escape(char) + trie_pattern(child) for char, child in node.items()]
+  if len(alternatives) == 1:
+    return alternatives[0]
+  else:
+    return '(?:' + '|'.join(alternatives) + ')'
+
+class Prefilter:
+  """ A multi-pattern matcher which tells whether a file can contain
+  any of the analyses to be replaced without parsing it.
+  It is conservative: a file for which it returns False
+  cannot contain any of the analyses.
+  """
+
+  def __init__(self, morphs: Iterable[Morph]):
+    trie = Trie()
+    self.pattern: re.Pattern[str] | None = None
+    for morph in morphs:
+      needle = get_needle(morph)
+      if needle == '':
+        return
+      node = trie
+      for char in needle:
+        node = node.setdefault(char, Trie())
+      node[''] = Trie()
+    self.pattern = re.compile(trie_pattern(trie))
+
+  def may_match(self, text: str) -> bool:
+    if self.pattern is None or unknown_entity.search(text) is not None:
+      return True
+    else:
+      return self.pattern.search(text) is not None
+
+if __name__ == '__main__':
+  print('Test started')
+  morphs = [Morph.parse(analysis) for analysis in [
+    'nāli @ Rehbock @ .ABS @ noun @ ',
+    'nāl-i @ Rehbock @ .ERG @ noun @ ',
+    'tav-ud-o @ u. B. @ { a → NEG-MOD.PAT} @ verb @ ',
+  ]]
+  prefilter = Prefilter(morph for morph in morphs if morph is not None)
+  assert prefilter.pattern is not None
+  print(prefilter.pattern.pattern)
+  assert prefilter.may_match('<w mrp1="nāl-i @ Rehbock @ .ERG @ noun @ "/>')
+  assert prefilter.may_match('<w mrp1="tav-ud-o @ u.\nB. @ .ABS @ verb @ "/>')
+  assert not prefilter.may_match('<w mrp1="ewri @ Herr @ .ABS @ noun @ "/>')
+  assert prefilter.may_match('<w mrp1="ewri @ Herr @ .ABS @ noun @ &#257;"/>')
+  assert not prefilter.may_match('<w mrp1="ewri @ Herr &amp; Co @ .ABS @ noun @ "/>')
+  morph = Morph.parse(' @ & @ .ABS @ noun @ ')
+  assert morph is not None
+  assert Prefilter([morph]).may_match('')
+  print('Test passed')
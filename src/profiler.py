@@ -0,0 +1,101 @@
+import json
+from time import perf_counter
+from collections import Counter
+from typing import Any
+
+# The stages of processing a file, in their order.
+STAGES = ('prefilter', 'read', 'parse', 'modify', 'serialise', 'undo', 'write', 'manifest')
+PERCENTILES = (50, 90, 99)
+
+class StageTimer:
+  """ Measure the durations of the consecutive stages of processing a file.
+  Each stage starts where the previous one has ended.
+  """
+
+  def __init__(self) -> None:
+    self.timings = dict[str, float]()
+    self.start = perf_counter()
+
+  def stage(self, name: str) -> None:
+    """ Record the end of the stage with the given name. """
+    now = perf_counter()
+    self.timings[name] = self.timings.get(name, 0.0) + now - self.start
+    self.start = now
+
+  def resume(self) -> None:
+    """ Start the next stage now, leaving out the time since the end of the last one,
+    during which other files have been processed.
+    """
+    self.start = perf_counter()
+
+def percentile(values: list[float], percent: int) -> float:
+  """ For a sorted non-empty list, return the value below which
+  the given percentage of values lies (nearest rank).
+  """
+  rank = max(1, -(-len(values) * percent // 100))
+  return values[rank - 1]
+
+def summarise(values: list[float]) -> dict[str, float]:
+  values = sorted(values)
+  summary = {'total': sum(values), 'mean': sum(values) / len(values)}
+  for percent in PERCENTILES:
+    summary['p{0}'.format(percent)] = percentile(values, percent)
+  summary['max'] = values[-1]
+  return summary
+
+class RunProfile:
+  """ The stage timings and counters of every file of a run,
+  aggregated into a report.
+  """
+
+  def __init__(self) -> None:
+    self.start = perf_counter()
+    self.files = list[tuple[str, dict[str, float], dict[str, int]]]()
+
+  def add(self, key: str, timings: dict[str, float], counters: dict[str, int]) -> None:
+    self.files.append((key, timings, counters))
+
+  def report(self, slowest: int) -> dict[str, Any]:
+    """ Summarise the run: the totals and percentiles of the duration
+    of every stage, the total counters and the given number of the slowest files.
+    """
+    stages = dict[str, dict[str, float]]()
+    for stage in STAGES:
+      values = [timings.get(stage, 0.0) for _, timings, _ in self.files]
+      if any(value > 0 for value in values):
+        stages[stage] = summarise(values)
+    totals = [sum(timings.values()) for _, timings, _ in self.files]
+    counters = Counter[str]()
+    for _, _, file_counters in self.files:
+      counters.update(file_counters)
+    ranking = sorted(zip(totals, self.files), key=lambda item: item[0], reverse=True)
+    return {
+      'files': len(self.files),
+      'wall_seconds': perf_counter() - self.start,
+      'file_seconds': summarise(totals) if len(totals) > 0 else {},
+      'stages': stages,
+      'counters': dict(sorted(counters.items())),
+      'slowest_files': [
+        {'file': key, 'seconds': total, 'stages': timings, 'counters': file_counters}
+        for total, (key, timings, file_counters) in ranking[:slowest]
+      ],
+    }
+
+  def save(self, filename: str, slowest: int) -> None:
+    with open(filename, 'w', encoding='utf-8') as fout:
+      json.dump(self.report(slowest), fout, ensure_ascii=False, indent=1)
+
+if __name__ == '__main__':
+  print('Test started')
+  assert percentile([1.0], 50) == 1.0
+  assert percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.0
+  assert percentile([1.0, 2.0, 3.0, 4.0], 90) == 4.0
+  profile = RunProfile()
+  profile.add('a.xml', {'read': 0.5, 'parse': 1.0}, {'words': 3})
+  profile.add('b.xml', {'read': 0.25, 'write': 0.5}, {'words': 2, 'change hits': 1})
+  report = profile.report(1)
+  print(json.dumps(report, indent=1))
+  assert report['counters'] == {'change hits': 1, 'words': 5}
+  assert report['stages']['read']['total'] == 0.75
+  assert [entry['file'] for entry in report['slowest_files']] == ['a.xml']
+  print('Test passed')
@@ -0,0 +1,237 @@
+import re
+from fnmatch import translate
+from typing import Any, NamedTuple
+from morph import Morph, SingleMorph, MultiMorph, share_morph_tags
+
+# The fields of an analysis which rules can match and rewrite, by their names in the changes file.
+FIELDS = {'segmentation': 'segmentation', 'translation': 'translation',
+          'morphTag': 'morph_tag', 'pos': 'pos', 'det': 'det'}
+# The fields by which the rules are indexed, from the most selective one.
+INDEX_FIELDS = ('segmentation', 'translation', 'pos', 'morph_tag', 'det')
+wildcards = re.compile(r'[*?[]')
+
+class FieldPattern(NamedTuple):
+  """ A pattern matching the whole value of a field of an analysis.
+
+  :param regex: The compiled pattern.
+  :param literal: The only value matched, None if the pattern contains wildcards
+  or is a regular expression.
+  :param is_regex: Whether the pattern has been given as a regular expression,
+  so that the new value of the field may refer to its groups.
+  """
+  regex: re.Pattern[str]
+  literal: str | None
+  is_regex: bool
+
+  @staticmethod
+  def compile(pattern: Any) -> 'FieldPattern':
+    """ Compile a pattern given either as a string, possibly with
+    the wildcards *, ? and [...], or as an object {"regex": ...}.
+    """
+    if isinstance(pattern, str):
+      if wildcards.search(pattern) is None:
+        return FieldPattern(re.compile(re.escape(pattern)), pattern, False)
+      else:
+        return FieldPattern(re.compile(translate(pattern)), None, False)
+    if isinstance(pattern, dict) and list(pattern) == ['regex'] and isinstance(pattern['regex'], str):
+      try:
+        return FieldPattern(re.compile(pattern['regex']), None, True)
+      except re.error as error:
+        raise ValueError('Invalid regular expression {0}: {1}'.format(pattern['regex'], error))
+    raise ValueError('Invalid pattern: {0}'.format(pattern))
+
+class Rule(NamedTuple):
+  """ A change of all the analyses whose fields match the patterns:
+  the fields with a new value are rewritten, the others are kept.
+  A morph. tag pattern is matched against every option of an analysis
+  with options, and only the matching options are rewritten.
+
+  :param number: The position of the rule in the changes file. Earlier rules take precedence.
+  :param patterns: The patterns of the matched fields.
+  :param values: The new values of the rewritten fields. The value of a field
+  matched by a regular expression can refer to its groups as in re.sub.
+  """
+  number: int
+  patterns: dict[str, FieldPattern]
+  values: dict[str, str]
+
+  def rewrite(self, field: str, value: str) -> str | None:
+    """ Return the new value of a field or None if it does not match. """
+    pattern = self.patterns.get(field)
+    match = None
+    if pattern is not None:
+      match = pattern.regex.fullmatch(value)
+      if match is None:
+        return None
+    new_value = self.values.get(field)
+    if new_value is None:
+      return value
+    elif match is not None and self.patterns[field].is_regex:
+      return match.expand(new_value)
+    else:
+      return new_value
+
+  def apply(self, morph: Morph) -> Morph | None:
+    """ Return the rewritten analysis or None if the rule does not match it. """
+    segmentation = self.rewrite('segmentation', morph.segmentation)
+    translation = self.rewrite('translation', morph.translation)
+    pos = self.rewrite('pos', morph.pos)
+    det = self.rewrite('det', morph.det)
+    if segmentation is None or translation is None or pos is None or det is None:
+      return None
+    if isinstance(morph, MultiMorph):
+      morph_tags = dict[str, str]()
+      matched = False
+      for letter, morph_tag in morph.morph_tags:
+        new_morph_tag = self.rewrite('morph_tag', morph_tag)
+        if new_morph_tag is None:
+          morph_tags[letter] = morph_tag
+        else:
+          morph_tags[letter] = new_morph_tag
+          matched = True
+      if not matched:
+        return None
+      return MultiMorph(segmentation, translation, share_morph_tags(morph_tags),
+                        pos, det, morph.enclitics_analysis)
+    elif isinstance(morph, SingleMorph):
+      new_morph_tag = self.rewrite('morph_tag', morph.morph_tag)
+      if new_morph_tag is None:
+        return None
+      return SingleMorph(segmentation, translation, new_morph_tag, pos, det, morph.enclitics_analysis)
+    else:
+      return None
+
+def compile_rule(number: int, definition: Any) -> Rule:
+  """ Compile a rule given in the changes file as an object
+  {"match": {field: pattern, ...}, "replace": {field: value, ...}}.
+  """
+  if (not isinstance(definition, dict) or sorted(definition) != ['match', 'replace']
+      or not isinstance(definition['match'], dict) or not isinstance(definition['replace'], dict)):
+    raise ValueError('Rule {0} must be an object with the fields "match" and "replace": {1}'.format(number + 1, definition))
+  patterns = dict[str, FieldPattern]()
+  values = dict[str, str]()
+  for name, pattern in definition['match'].items():
+    if name not in FIELDS:
+      raise ValueError('Unknown field {0} in rule {1}. The fields are: {2}'.format(name, number + 1, ', '.join(FIELDS)))
+    patterns[FIELDS[name]] = FieldPattern.compile(pattern)
+  for name, value in definition['replace'].items():
+    if name not in FIELDS:
+      raise ValueError('Unknown field {0} in rule {1}. The fields are: {2}'.format(name, number + 1, ', '.join(FIELDS)))
+    if not isinstance(value, str) or '@' in value or (name == 'morphTag' and ('{' in value or '}' in value)):
+      raise ValueError('Invalid value of the field {0} in rule {1}: {2}'.format(name, number + 1, value))
+    values[FIELDS[name]] = value.strip()
+  if len(values) == 0:
+    raise ValueError('Rule {0} does not replace any field'.format(number + 1))
+  return Rule(number, patterns, values)
+
+class RuleSet:
+  """ The rules of a changes file compiled for matching. Every rule with a literal
+  pattern is indexed by the value it matches, so that only the rules indexed by
+  the values of an analysis and the rules without literal patterns are tried.
+  The outcome is remembered for every distinct analysis, so each of them
+  is matched against the rules only once.
+  """
+
+  def __init__(self, definitions: list[Any]):
+    self.definitions = definitions
+    self.index = {field: dict[str, list[Rule]]() for field in INDEX_FIELDS}
+    self.fallback = list[Rule]()
+    for number, definition in enumerate(definitions):
+      rule = compile_rule(number, definition)
+      for field in INDEX_FIELDS:
+        pattern = rule.patterns.get(field)
+        if pattern is not None and pattern.literal is not None:
+          self.index[field].setdefault(pattern.literal, []).append(rule)
+          break
+      else:
+        self.fallback.append(rule)
+    # The rewritten analyses by the string form of the original ones
+    # and the lookup keys of the analyses no rule changes.
+    self.results = dict[str, Morph]()
+    self.unchanged = set[str]()
+
+  def __len__(self) -> int:
+    return len(self.definitions)
+
+  def candidates(self, morph: Morph) -> list[Rule]:
+    """ The rules which may match the analysis, in their order. """
+    rules = list(self.fallback)
+    for field in INDEX_FIELDS:
+      if len(self.index[field]) > 0:
+        if field != 'morph_tag':
+          values = [getattr(morph, field)]
+        elif isinstance(morph, MultiMorph):
+          values = [morph_tag for _, morph_tag in morph.morph_tags]
+        elif isinstance(morph, SingleMorph):
+          values = [morph.morph_tag]
+        else:
+          values = []
+        for value in values:
+          rules.extend(self.index[field].get(value, []))
+    rules.sort(key=lambda rule: rule.number)
+    return rules
+
+  def may_change(self, key: str) -> bool:
+    """ Whether a rule may change the analysis with the given lookup key,
+    which is only known to be false once the analysis has been seen.
+    """
+    return len(self.definitions) > 0 and key not in self.unchanged
+
+  def apply(self, morph: Morph) -> Morph | None:
+    """ Return the analysis rewritten by the first matching rule
+    or None if no rule changes the analysis.
+    """
+    key = morph.lookup_key
+    if key in self.unchanged:
+      return None
+    result = self.results.get(str(morph))
+    if result is not None:
+      return result
+    for rule in self.candidates(morph):
+      result = rule.apply(morph)
+      if result is not None:
+        break
+    if result is None or result == morph:
+      self.unchanged.add(key)
+      return None
+    self.results[str(morph)] = result
+    return result
+
+  def changes_key(self, key: str) -> bool:
+    """ Whether a rule changes the analysis with the given lookup key. """
+    morph = Morph.parse(key)
+    return morph is not None and self.apply(morph) is not None
+
+if __name__ == '__main__':
+  print('Test started')
+  rules = RuleSet([
+    {'match': {'segmentation': 'nāli', 'morphTag': '.ABS'}, 'replace': {'translation': 'Hirsch'}},
+    {'match': {'morphTag': {'regex': r'(.*)\.ABS'}, 'pos': 'noun'}, 'replace': {'morphTag': r'\1.ERG'}},
+    {'match': {'segmentation': 'tav-*'}, 'replace': {'pos': 'adj'}},
+  ])
+  assert len(rules.fallback) == 1
+  data = [
+    ('nāli @ Rehbock @ .ABS @ noun @ ', 'nāli @ Hirsch @ .ABS @ noun @ '),
+    ('ewri @ Herr @ NEG-MOD.ABS @ noun @ ', 'ewri @ Herr @ NEG-MOD.ERG @ noun @ '),
+    ('ewri @ Herr @ { a → .ABS} { b → .GEN} @ noun @ ', 'ewri @ Herr @ { a → .ERG} { b → .GEN} @ noun @ '),
+    ('tav-ud-o @ u.B. @ .ABS @ verb @ ', 'tav-ud-o @ u.B. @ .ABS @ adj @ '),
+    ('ewri @ Herr @ .ABS @ verb @ ', None),
+    ('tav-ud-o @ u.B. @ .ABS @ adj @ ', None),
+  ]
+  for origin, target in data:
+    morph = Morph.parse(origin)
+    assert morph is not None
+    result = rules.apply(morph)
+    print(origin, '=>', result)
+    assert (None if result is None else str(result)) == target
+  assert not rules.may_change('ewri @ Herr @ .ABS @ verb @ ')
+  assert rules.changes_key('nāli @ Rehbock @ .ABS @ noun @ ')
+  for definition in [{'match': {}}, {'match': {'case': '.ABS'}, 'replace': {'pos': 'noun'}},
+                     {'match': {}, 'replace': {'pos': 'a @ b'}}, {'match': {'pos': {'regex': '('}}, 'replace': {'pos': 'x'}}]:
+    try:
+      RuleSet([definition])
+    except ValueError as error:
+      print(error)
+    else:
+      raise AssertionError(definition)
+  print('Test passed')
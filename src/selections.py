@@ -0,0 +1,100 @@
+from collections.abc import Iterator
+from typing import Any
+
+class Selections:
+  """ The selected morph. analyses and morph. tags of a word
+  (the value of the attribute mrp0sel split into indices like 1 or 2a).
+  The selections keep their order and, like the list they are parsed from,
+  may contain an index more than once. Looking up, removing and adding
+  an index take constant time: a removed index leaves an empty place
+  in the order, which is skipped.
+  """
+
+  def __init__(self, selections: list[str]):
+    self.order = list[str | None]()
+    # The places of every index in the order, from the first one.
+    self.places = dict[str, list[int]]()
+    for selection in selections:
+      self.append(selection)
+    # The selections represented by the attribute mrp0sel.
+    self.saved = selections.copy()
+    self.touched = False
+
+  @staticmethod
+  def parse(attrs: Any) -> 'Selections':
+    """ For the attributes of a word (w) tag,
+    get the selected morphological analyses.
+    """
+    if 'mrp0sel' in attrs:
+      mrp0sel = attrs['mrp0sel']
+      assert isinstance(mrp0sel, str)
+      return Selections(mrp0sel.split())
+    else:
+      return Selections([])
+
+  def __contains__(self, selection: str) -> bool:
+    return selection in self.places
+
+  def __iter__(self) -> Iterator[str]:
+    for selection in self.order:
+      if selection is not None:
+        yield selection
+
+  def __repr__(self) -> str:
+    return 'Selections({0})'.format(list(self))
+
+  def append(self, selection: str) -> None:
+    self.places.setdefault(selection, []).append(len(self.order))
+    self.order.append(selection)
+    self.touched = True
+
+  def remove(self, selection: str) -> None:
+    """ Remove the first occurrence of the index, like list.remove. """
+    places = self.places.get(selection)
+    if places is None:
+      raise ValueError('{0} is not selected'.format(selection))
+    self.order[places.pop(0)] = None
+    if len(places) == 0:
+      del self.places[selection]
+    self.touched = True
+
+  def is_modified(self) -> bool:
+    """ Whether the selections differ from those represented by the attribute mrp0sel. """
+    if self.touched:
+      if list(self) != self.saved:
+        return True
+      self.touched = False
+    return False
+
+  @property
+  def mrp0sel(self) -> str:
+    """ The value of the attribute mrp0sel representing the selections. """
+    mrp0sel = ' '.join(self)
+    if len(mrp0sel) > 0:
+      mrp0sel = ' ' + mrp0sel
+    return mrp0sel
+
+  def mark_saved(self) -> None:
+    """ Record that the attribute mrp0sel represents the current selections. """
+    self.saved = list(self)
+    self.touched = False
+
+if __name__ == '__main__':
+  print('Test started')
+  selections = Selections.parse({'mrp0sel': ' 1a 2 1a 3b'})
+  assert '1a' in selections and '4' not in selections
+  selections.remove('1a')
+  assert '1a' in selections
+  assert list(selections) == ['2', '1a', '3b']
+  selections.remove('1a')
+  assert '1a' not in selections
+  selections.append('1a')
+  assert selections.is_modified()
+  assert selections.mrp0sel == ' 2 3b 1a'
+  selections.mark_saved()
+  assert not selections.is_modified()
+  selections.remove('1a')
+  selections.append('1a')
+  assert not selections.is_modified()
+  assert Selections.parse({}).mrp0sel == ''
+  print('Test passed')
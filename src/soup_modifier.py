@@ -1,30 +1,43 @@
-from bs4 import BeautifulSoup, Tag
-from morph import Morph, MultiMorph
-from typing import Callable
-from logging import getLogger, INFO, FileHandler
+from morph import Morph, MultiMorph, parse_morph, lookup_key_of
+from typing import Any, Protocol, TYPE_CHECKING
+from collections.abc import Iterable
+from logging import getLogger
 from option_merger import merge_identical_options_if_multi
-logger = getLogger(__name__)
-logger.setLevel(INFO)
-handler = FileHandler('Log.txt', 'w', encoding='utf-8')
-logger.addHandler(handler)
+from selections import Selections
+from rules import RuleSet
+from change_sets import ChangeSet
+from change_journal import FileJournal, JournalWarning, Replacement, journal_writer
+from analysis_dictionary import AnalysisDictionary
+if TYPE_CHECKING:
+  from bs4 import BeautifulSoup
 morph_logger = getLogger('morphological_analysis')
-morph_logger.addHandler(FileHandler('{0}.log'.format(morph_logger.name), 'w', encoding='utf-8'))
 
 mrpNaN = 'mrpNaN'
 
-def get_word_language(line_language: str, tag: Tag) -> str:
-  if 'lg' in tag.attrs and isinstance(tag['lg'], str):
-    return tag['lg']
+class Attributes(Protocol):
+  """ The attributes of an XML tag, as provided
+  both by BeautifulSoup and by lxml. The attributes
+  are kept in their original order.
+  """
+  def __contains__(self, key: str) -> bool: ...
+  def __getitem__(self, key: str) -> Any: ...
+  def __setitem__(self, key: str, value: str) -> None: ...
+  def __delitem__(self, key: str) -> None: ...
+  def items(self) -> Iterable[tuple[Any, Any]]: ...
+
+def get_word_language(line_language: str, attrs: Attributes) -> str:
+  if 'lg' in attrs and isinstance(attrs['lg'], str):
+    return attrs['lg']
   else:
     return line_language
 
-def get_free_index(tag: Tag) -> int:
-  """ For a given XML tag of a word (w),
+def get_free_index(attrs: Attributes) -> int:
+  """ For the attributes of a word (w) tag,
   determine the morphological analysis with the highest number
   and return that number incremented by one.
   """
   free_index = 1
-  for attr, value in tag.attrs.items():
+  for attr, value in attrs.items():
       if attr.startswith('mrp') and attr != 'mrp0sel':
           index_str = attr.removeprefix('mrp')
           if index_str.isdigit():
@@ -44,18 +57,7 @@ def get_current_index(attr: str) -> int | None:
   else:
     return None
 
-def get_selections(tag: Tag) -> list[str]:
-  """ For a given XML tag of a word (w),
-  get a list of selected morphological analyses
-  """
-  if 'mrp0sel' in tag.attrs:
-    mrp0sel = tag.attrs['mrp0sel']
-    assert isinstance(mrp0sel, str)
-    return mrp0sel.split()
-  else:
-    return []
-
-def unselect_split_away_options(current_index: int, morph: Morph, replacement: Morph, selections: list[str]) -> set[str]:
+def unselect_split_away_options(current_index: int, morph: Morph, replacement: Morph, selections: Selections) -> set[str]:
   """ Assuming the morph. analysis morph has been
   replaced with the analysis replacement, unselect
   those morph. tags of morph which are not present
@@ -64,7 +66,7 @@ def unselect_split_away_options(current_index: int, morph: Morph, replacement: M
   :param current_index: The index of the original morph. analysis.
   :param morph: The original morph. analysis.
   :param replacement: The replacing morph. analysis.
-  :param selections: A list of selected analysis indices
+  :param selections: The selected analysis indices,
   which will be modified in-place.
   :return: The set of morph. tag letter-indices
   which were selected in morph and are not present
@@ -72,7 +74,7 @@ def unselect_split_away_options(current_index: int, morph: Morph, replacement: M
   """
   selected_letters = set[str]()
   if isinstance(morph, MultiMorph) and isinstance(replacement, MultiMorph):
-    removed_letters = set(morph.morph_tags) - set(replacement.morph_tags)
+    removed_letters = set(morph.letters) - set(replacement.letters)
     for removed_letter in removed_letters:
       complete_index = str(current_index) + removed_letter
       if complete_index in selections:
@@ -80,7 +82,7 @@ def unselect_split_away_options(current_index: int, morph: Morph, replacement: M
         selections.remove(complete_index)
   return selected_letters
 
-def select_added_analysis_options(free_index: int, morph: Morph, replacement: Morph, selections: list[str], selected_letters: set[str]) -> None:
+def select_added_analysis_options(free_index: int, morph: Morph, replacement: Morph, selections: Selections, selected_letters: set[str]) -> None:
   """ Assuming the morph. analysis morph has been
   replaced with the analysis replacement (possibly among others),
   select those morph. tags of replacement were selected in morph.
@@ -88,36 +90,41 @@ def select_added_analysis_options(free_index: int, morph: Morph, replacement: Mo
   :param free_index: The index of the added morph. analysis.
   :param morph: The original morph. analysis.
   :param replacement: The replacing morph. analysis.
-  :param selections: A list of selected analysis indices
+  :param selections: The selected analysis indices,
   which will be modified in-place.
   :param selected_letters: The letter-indices of the morph. tags
   which were selected in morph and removed therefrom.
   """
   if isinstance(morph, MultiMorph) and isinstance(replacement, MultiMorph):
-    current_letters = set(replacement.morph_tags)
+    current_letters = set(replacement.letters)
     for letter in sorted(current_letters & selected_letters):
       complete_index = str(free_index) + letter
       selections.append(complete_index)
 
-def update_mrp0sel_attr(tag: Tag, selections: list[str]) -> None:
-  """ For a given XML tag of a word (w),
-  set its mrp0sel attribute to a value
-  representing the given list of selections.
+def get_mrp0sel_attr(attrs: Attributes) -> str | None:
+  value = attrs['mrp0sel'] if 'mrp0sel' in attrs else None
+  return value if isinstance(value, str) else None
+
+def update_mrp0sel_attr(attrs: Attributes, selections: Selections) -> None:
+  """ For the attributes of a word (w) tag,
+  set the mrp0sel attribute to a value
+  representing the given selections if they have changed.
   """
-  if selections != get_selections(tag):
-    new_mrp0sel = ' '.join(selections)
-    if len(new_mrp0sel) > 0:
-      new_mrp0sel = ' ' + new_mrp0sel
-    tag.attrs['mrp0sel'] = new_mrp0sel
-
-def perform_replacement(tag: Tag, attr: str, morph: Morph, replacements: list[Morph], free_index: int, modified: bool, rel_name: str, lnr: str, value: str) -> tuple[int, bool]:
-  """ For a given XML tag of a word (w),
+  if selections.is_modified():
+    attrs['mrp0sel'] = selections.mrp0sel
+    selections.mark_saved()
+
+def perform_replacement(attrs: Attributes, attr: str, morph: Morph, replacements: list[Morph], selections: Selections, free_index: int, modified: bool, rel_name: str, lnr: str, value: str, journal: FileJournal, change_set: int = 0) -> tuple[int, bool]:
+  """ For the attributes of a word (w) tag,
   replace the morphological analysis morph
   occurring under the attribute attr
   with a list of morphological analyses replacements.
 
+  :param selections: The selections of the word, parsed from its attributes.
   :param free_index: An index which can be used for the addition of a new morph. analysis.
   :param modified: Whether the current document has been modified.
+  :param journal: The journal of the document, to which the replacement is added.
+  :param change_set: The index of the change set making the replacement.
   :return: Updated value for the free index and modified.
   """
   current_index = get_current_index(attr)
@@ -125,20 +132,16 @@ def perform_replacement(tag: Tag, attr: str, morph: Morph, replacements: list[Mo
     return free_index, modified
   replacement = replacements[0]
   if isinstance(morph, MultiMorph):
-      index = next(iter(morph.morph_tags))
+      index = morph.morph_tags[0][0]
       replacement = replacement.to_multi(index)
-  selections = get_selections(tag)
   repl_with_merged_options = merge_identical_options_if_multi(
     str(current_index), replacement, selections
   )
   repl_str = repl_with_merged_options.__str__()
-  tag[attr] = repl_str
-  if not modified:
-      logger.info(rel_name)
+  old_selection = get_mrp0sel_attr(attrs)
+  attrs[attr] = repl_str
   modified = True
-  logger.info('\t{0}'.format(lnr))
-  logger.info('\t\t{0} =>'.format(value))
-  logger.info('\t\t{0}'.format(repl_str))
+  new = [(attr, repl_str)]
   selected_letters = unselect_split_away_options(
     current_index, morph, replacement, selections
   )
@@ -146,20 +149,76 @@ def perform_replacement(tag: Tag, attr: str, morph: Morph, replacements: list[Mo
     repl_with_merged_options = merge_identical_options_if_multi(str(free_index), replacement, selections)
     attr = 'mrp' + str(free_index)
     repl_str = repl_with_merged_options.__str__()
-    tag[attr] = repl_str
-    logger.info('\t\t{0}'.format(repl_str))
+    attrs[attr] = repl_str
+    new.append((attr, repl_str))
     select_added_analysis_options(
       free_index, morph, replacement, selections, selected_letters
     )
     free_index += 1
-  update_mrp0sel_attr(tag, selections)
+  update_mrp0sel_attr(attrs, selections)
+  journal.append(Replacement(rel_name, lnr, new[0][0], value, new, old_selection, get_mrp0sel_attr(attrs), change_set))
   return free_index, modified
 
-class SoupModifier:
-    
-    def __init__(self, replacements: dict[str, list[str]] | dict[str, str]):
+def close_changes(changes: dict[Morph, list[Morph]]) -> tuple[dict[Morph, list[Morph]], list[list[Morph]], list[list[Morph]]]:
+  """ Replace the targets of the changes which are replaced themselves
+  by their final targets, so that applying the changes once has the same effect
+  as applying them again and again until nothing changes. A target equal
+  to its origin is kept as it is written, e.g. a plain morph. tag rewritten
+  as a single option, and ends the chain. Only the target lists containing
+  a target which is replaced itself are rewritten, the others are kept
+  exactly as given, including targets which are equal but written differently.
+
+  :return: The closed changes, the chains of changes which have been collapsed,
+  each from an origin to one of its final targets, and the cycles of changes.
+  """
+  paths_from = dict[Morph, list[list[Morph]]]()
+  cycles = list[list[Morph]]()
+
+  def resolve(origin: Morph, visiting: list[Morph]) -> list[list[Morph]]:
+    """ Return the paths from the origin to each of its final targets. """
+    if origin in paths_from:
+      return paths_from[origin]
+    visiting.append(origin)
+    paths = list[list[Morph]]()
+    for target in changes[origin]:
+      if target == origin:
+        paths.append([target])
+      elif target not in changes:
+        paths.append([origin, target])
+      elif target in visiting:
+        cycles.append(visiting[visiting.index(target):] + [target])
+        paths.append([origin, target])
+      else:
+        paths.extend([origin] + path for path in resolve(target, visiting))
+    visiting.pop()
+    paths_from[origin] = paths
+    return paths
+
+  closed = dict[Morph, list[Morph]]()
+  chains = list[list[Morph]]()
+  for origin, given in changes.items():
+    paths = resolve(origin, [])
+    chains.extend(path for path in paths if len(path) > 2)
+    if all(target == origin or target not in changes for target in given):
+      closed[origin] = given
+      continue
+    # A final target reached several times is added only once.
+    targets = list[Morph]()
+    for path in paths:
+      if all(str(path[-1]) != str(target) for target in targets):
+        targets.append(path[-1])
+    closed[origin] = targets
+  return closed, chains, cycles
+
+class CompiledChangeSet:
+    """ A change set prepared for application: the parsed replacements
+    with chained changes collapsed, the lookup keys of the analyses to be replaced
+    and the compiled rules.
+    """
+
+    def __init__(self, change_set: ChangeSet):
         changes = dict[Morph, list[Morph]]()
-        for key, val in replacements.items():
+        for key, val in change_set.changes.items():
             if isinstance(val, str):
               values = [val]
             else:
@@ -172,32 +231,120 @@ class SoupModifier:
                 targets.append(target)
             if origin is not None and len(targets) > 0:
               changes[origin] = targets
-        self.changes = changes
+        self.name = change_set.name
+        self.changes, self.chains, self.cycles = close_changes(changes)
+        # The lookup keys of the analyses to be replaced, which allow to skip
+        # the other analyses without parsing them.
+        self.change_keys = {origin.lookup_key for origin in changes}
+        # The pattern rules, which apply to the analyses not replaced by the changes.
+        self.rules = RuleSet(change_set.rules)
+
+def find_conflicts(change_sets: list[CompiledChangeSet]) -> list[str]:
+    """ Find the changes of different change sets which contradict each other:
+    an analysis replaced differently by two sets and an analysis changed back
+    by a later set into the analysis it has replaced.
+    """
+    conflicts = list[str]()
+    replaced = dict[Morph, tuple[str, list[Morph]]]()
+    introduced = dict[Morph, tuple[str, Morph]]()
+    for change_set in change_sets:
+        for origin, targets in change_set.changes.items():
+            if origin in replaced:
+                earlier_name, earlier_targets = replaced[origin]
+                if earlier_targets != targets:
+                    conflicts.append('{0} is replaced differently in {1} and in {2}.'.format(
+                        origin, earlier_name, change_set.name))
+            if origin in introduced:
+                earlier_name, earlier_origin = introduced[origin]
+                if earlier_origin in targets:
+                    conflicts.append('{0} replaces {1} in {2} and is changed back in {3}.'.format(
+                        origin, earlier_origin, earlier_name, change_set.name))
+        for origin, targets in change_set.changes.items():
+            replaced.setdefault(origin, (change_set.name, targets))
+            for target in targets:
+                introduced.setdefault(target, (change_set.name, origin))
+    return conflicts
+
+class SoupModifier:
+
+    def __init__(self, change_sets: list[ChangeSet]):
+        self.change_sets = [CompiledChangeSet(change_set) for change_set in change_sets]
+        # The lookup keys of the analyses to be replaced by any change set.
+        self.change_keys = set[str]().union(*(change_set.change_keys for change_set in self.change_sets))
+        # The counts of the work done on the last modified document.
+        self.counters = dict[str, int]()
+        # The journal the modifications and warnings are recorded in,
+        # which the caller replaces to collect those of a single document.
+        # By default they go to the journal writer, which keeps them only while it is open.
+        self.journal = FileJournal(journal_writer)
+        # The dictionary the analyses of the Hurrian words are counted in after the changes,
+        # None if they are not collected. The caller replaces it like the journal.
+        self.dictionary: AnalysisDictionary | None = None
+
+    @property
+    def has_rules(self) -> bool:
+        return any(len(change_set.rules) > 0 for change_set in self.change_sets)
+
+    def rules_change(self, key: str) -> bool:
+        """ Whether a rule of any change set changes the analysis with the given lookup key. """
+        return any(change_set.rules.changes_key(key) for change_set in self.change_sets)
 
-    def __call__(self, soup: BeautifulSoup, rel_name: str) -> bool:
+    def __call__(self, soup: 'BeautifulSoup', rel_name: str) -> bool:
+        return self.modify_tags(((tag.name, tag.attrs) for tag in soup(['lb', 'w'])), rel_name)
+
+    def collect_analyses(self, attrs: Attributes) -> None:
+        """ Count the analyses of a word for its word form in the dictionary. """
+        assert self.dictionary is not None
+        form = attrs['trans'] if 'trans' in attrs else None
+        if not isinstance(form, str):
+            return
+        for attr, value in attrs.items():
+            if attr.startswith('mrp') and get_current_index(attr) is not None and isinstance(value, str):
+                self.dictionary.add(value, form)
+
+    def modify_tags(self, tags: Iterable[tuple[str, Attributes]], rel_name: str) -> bool:
+        """ Apply the changes to the line (lb) and word (w) tags of a document,
+        given by their names and attributes in document order.
+        The attributes are modified in-place.
+
+        :return: Whether the document has been modified.
+        """
         lang = 'hit'
-        modified = False
+        # Whether the document has been modified by each change set.
+        modified_sets = [False] * len(self.change_sets)
         lnr = '[unknown]'
-        for tag in soup(['lb', 'w']):
-            if tag.name == 'lb':
-                if 'lnr' in tag.attrs and isinstance(tag['lnr'], str):
-                  lnr = tag['lnr']
+        words = hurrian_words = parsed = hits = rule_hits = replaced = 0
+        for name, attrs in tags:
+            if name == 'lb':
+                if 'lnr' in attrs and isinstance(attrs['lnr'], str):
+                  lnr = attrs['lnr']
                 else:
                   raise ValueError('The next line after {0} in {1} is not numbered'.format(lnr, rel_name))
-                if 'lg' in tag.attrs and isinstance(tag['lg'], str):
-                    lang = tag['lg']
+                if 'lg' in attrs and isinstance(attrs['lg'], str):
+                    lang = attrs['lg']
                 else:
-                    logger.warning('Line {0} in {1} is not marked for language.'.format(lnr, rel_name))
+                    self.journal.append(JournalWarning(rel_name, 'Line {0} in {1} is not marked for language.'.format(lnr, rel_name)))
                     lang = 'Hur'
-            elif tag.name == 'w' and get_word_language(lang, tag) == 'Hur':
-                if mrpNaN in tag.attrs:
-                    del tag.attrs[mrpNaN]
-                free_index = get_free_index(tag)
-                for attr, value in list(tag.attrs.items()):
+            elif name == 'w':
+                words += 1
+                if get_word_language(lang, attrs) != 'Hur':
+                    continue
+                hurrian_words += 1
+                if mrpNaN in attrs:
+                    del attrs[mrpNaN]
+                free_index = get_free_index(attrs)
+                selections: Selections | None = None
+                for number, change_set in enumerate(self.change_sets):
+                  for attr, value in list(attrs.items()):
                     if attr.startswith('mrp') and attr != 'mrp0sel':
+                        if isinstance(value, str):
+                          key = lookup_key_of(value)
+                          if key is not None and key not in change_set.change_keys and not change_set.rules.may_change(key):
+                            continue
+                        parsed += 1
                         try:
                           if isinstance(value, str):
-                            morph = Morph.parse(value)
+                            morph = parse_morph(value)
                           else:
                             raise ValueError('The mrp attribute should have a single value.')
                         except ValueError:
@@ -205,11 +352,72 @@ class SoupModifier:
                             'Incorrect morphological analysis:\n{0}\non line {1} in {2}'.format(value, lnr, rel_name)
                           )
                         if morph is None:
-                          morph_logger.error('The following morphological analysis could not be parsed:\n%s on line %s in %s', value, lnr, rel_name)
-                        elif morph in self.changes:
-                            replacements = self.changes[morph]
-                            free_index, modified = perform_replacement(
-                              tag, attr, morph, replacements, free_index, modified,
-                              rel_name, lnr, value
+                          if number == 0:
+                            morph_logger.error('The following morphological analysis could not be parsed:\n%s on line %s in %s', value, lnr, rel_name)
+                        else:
+                            if morph in change_set.changes:
+                              replacements = change_set.changes[morph]
+                              hits += 1
+                            else:
+                              rewritten = change_set.rules.apply(morph)
+                              if rewritten is None:
+                                continue
+                              replacements = [rewritten]
+                              rule_hits += 1
+                            if get_current_index(attr) is not None:
+                              replaced += len(replacements)
+                            if selections is None:
+                              selections = Selections.parse(attrs)
+                            free_index, modified_sets[number] = perform_replacement(
+                              attrs, attr, morph, replacements, selections, free_index, modified_sets[number],
+                              rel_name, lnr, value, self.journal, number
                             )
-        return modified
+                if self.dictionary is not None:
+                    self.collect_analyses(attrs)
+        self.counters = {'words': words, 'Hurrian words': hurrian_words, 'analyses parsed': parsed,
+                         'change hits': hits, 'rule hits': rule_hits, 'replacements': replaced}
+        return any(modified_sets)
+
+if __name__ == '__main__':
+  print('Test started')
+  # A changes file without chains, with a target equal to its origin but written differently
+  # and with targets equal to each other, is applied exactly as given.
+  without_chains: dict[str, list[str]] = {
+    'nāli @ Rehbock @ .ABS @ noun @ ': ['nāli @ Rehbock @ { a → .ABS} @ noun @ '],
+    'ḫaš- @ hören @ INTR-IMP @ verb @ ': ['ḫaš- @ hören @ { a → .GEN} @ verb @ ', 'ḫaš- @ hören @ .GEN @ verb @ '],
+    'ewri @ Herr @ .ABS @ noun @ ': ['ewri @ Herr @ .ERG @ noun @ ', 'ewri @ Herr @ .ABS @ noun @ '],
+  }
+  modifier = SoupModifier([ChangeSet('without_chains.json', without_chains, [])])
+  compiled = modifier.change_sets[0]
+  assert compiled.chains == [] and compiled.cycles == []
+  # The changes as they were applied before chained changes were collapsed.
+  given = dict[Morph, list[Morph]]()
+  for key, value in without_chains.items():
+    origin = Morph.parse(key)
+    targets = [Morph.parse(target) for target in value]
+    assert origin is not None and all(target is not None for target in targets)
+    given[origin] = [target for target in targets if target is not None]
+  assert {origin: [str(target) for target in targets] for origin, targets in compiled.changes.items()} == \
+    {origin: [str(target) for target in targets] for origin, targets in given.items()}
+  unclosed = SoupModifier([ChangeSet('without_chains.json', without_chains, [])])
+  unclosed.change_sets[0].changes = given
+
+  def document() -> list[tuple[str, dict[str, str]]]:
+    return [('lb', {'lnr': '1', 'lg': 'Hur'})] + [('w', {'mrp0sel': ' 1', 'mrp1': key}) for key in without_chains]
+
+  closed_tags, given_tags = document(), document()
+  assert modifier.modify_tags(closed_tags, 'test') and unclosed.modify_tags(given_tags, 'test')
+  assert closed_tags == given_tags, closed_tags
+  assert closed_tags[1][1]['mrp1'] == 'nāli @ Rehbock @ { a → .ABS} @ noun @ ', closed_tags[1]
+  assert closed_tags[2][1]['mrp2'] == 'ḫaš- @ hören @ .GEN @ verb @ ', closed_tags[2]
+  # A target equal to its origin is kept as written and ends a chain.
+  chained = CompiledChangeSet(ChangeSet('chained.json', without_chains | {
+    'ewri @ Herr @ .ERG @ noun @ ': ['ewri @ Herr @ .INSTR @ noun @ ']
+  }, []))
+  assert {str(origin): [str(target) for target in targets] for origin, targets in chained.changes.items()} == {
+    'nāli @ Rehbock @ .ABS @ noun @ ': ['nāli @ Rehbock @ { a → .ABS} @ noun @ '],
+    'ḫaš- @ hören @ INTR-IMP @ verb @ ': ['ḫaš- @ hören @ { a → .GEN} @ verb @ ', 'ḫaš- @ hören @ .GEN @ verb @ '],
+    'ewri @ Herr @ .ABS @ noun @ ': ['ewri @ Herr @ .INSTR @ noun @ ', 'ewri @ Herr @ .ABS @ noun @ '],
+    'ewri @ Herr @ .ERG @ noun @ ': ['ewri @ Herr @ .INSTR @ noun @ '],
+  }, chained.changes
+  print('Test passed')
@@ -0,0 +1,209 @@
+import os
+import json
+import zlib
+import sqlite3
+from os import path
+from datetime import datetime
+from collections.abc import Callable
+from typing import NamedTuple
+from attribute_patcher import BinarySource, splice
+from manifest import BLOCK_SIZE, Manifest, file_digest
+from output_writer import write_file
+
+UNDO_NAME = '.corpus_editor_undo.sqlite'
+# Increase when the content of the journal changes.
+UNDO_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE runs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  started TEXT NOT NULL
+);
+CREATE TABLE files (
+  run INTEGER NOT NULL REFERENCES runs(id),
+  key TEXT NOT NULL,
+  digest TEXT NOT NULL,
+  created INTEGER NOT NULL,
+  patches TEXT,
+  original BLOB NOT NULL,
+  PRIMARY KEY (run, key)
+);
+CREATE INDEX files_key ON files(key);
+'''
+
+class UndoRecord(NamedTuple):
+  """ What is needed to restore the previous content of a modified output file.
+
+  :param created: Whether the output file did not exist before, so that it is removed.
+  :param patches: The start and end of every replacement in the modified file
+  which restores the previous content, with the length of the previous bytes,
+  None if the previous content replaces the whole file.
+  :param original: The previous bytes of the replacements or of the whole file, compressed.
+  """
+  created: bool
+  patches: list[tuple[int, int, int]] | None
+  original: bytes
+
+CREATED = UndoRecord(True, None, b'')
+
+def record_patches(reverse: list[tuple[int, int, bytes]]) -> UndoRecord:
+  """ The record of the replacements (start, end and previous bytes) which restore a file. """
+  return UndoRecord(False, [(start, end, len(original)) for start, end, original in reverse],
+                    zlib.compress(b''.join(original for _, _, original in reverse)))
+
+def record_original(data: bytes) -> UndoRecord:
+  return UndoRecord(False, None, zlib.compress(data))
+
+def restore(data: bytes, record: UndoRecord) -> bytes:
+  """ Return the previous content of a file from its modified content. """
+  original = zlib.decompress(record.original)
+  if record.patches is None:
+    return original
+  reverse = list[tuple[int, int, bytes]]()
+  position = 0
+  for start, end, length in record.patches:
+    reverse.append((start, end, original[position:position + length]))
+    position += length
+  return splice(data, reverse)
+
+class CompressingReader:
+  """ A binary file whose content is compressed while it is read. """
+
+  def __init__(self, file: BinarySource):
+    self.file = file
+    self.compressor = zlib.compressobj()
+    self.chunks = list[bytes]()
+
+  def read(self, size: int = -1) -> bytes:
+    data = self.file.read(size)
+    self.chunks.append(self.compressor.compress(data))
+    return data
+
+  def record(self) -> UndoRecord:
+    """ Read the rest of the file and return the record of its whole content. """
+    while len(self.read(BLOCK_SIZE)) > 0:
+      pass
+    self.chunks.append(self.compressor.flush())
+    return UndoRecord(False, None, b''.join(self.chunks))
+
+class UndoJournal:
+  """ The records needed to restore the output files as they were before they were modified,
+  stored in an SQLite database in the output directory by run and by file,
+  so that a whole run or single files can be rolled back.
+  The files added while the journal is open are recorded as a new run,
+  which is only stored once a file has been added to it.
+  """
+
+  def __init__(self, output_directory: str):
+    self.output_directory = output_directory
+    self.filename = path.join(output_directory, UNDO_NAME)
+    self.connection = sqlite3.connect(self.filename)
+    version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+    if version == 0:
+      self.connection.executescript(SCHEMA)
+      self.connection.execute('PRAGMA user_version = {0}'.format(UNDO_VERSION))
+    elif version != UNDO_VERSION:
+      raise ValueError('The undo journal {0} has been written by another version.'.format(self.filename))
+    # The number of the run the added files belong to, None until the first one.
+    self.run: int | None = None
+
+  def close(self) -> None:
+    self.connection.commit()
+    self.connection.close()
+
+  def add(self, key: str, digest: str, record: UndoRecord) -> None:
+    """ Record a file modified by the current run, whose digest is that of the modified file. """
+    if self.run is None:
+      cursor = self.connection.execute('INSERT INTO runs (started) VALUES (?)',
+                                       (datetime.now().isoformat(sep=' ', timespec='seconds'),))
+      self.run = cursor.lastrowid
+    patches = None if record.patches is None else json.dumps(record.patches)
+    self.connection.execute(
+      'INSERT INTO files (run, key, digest, created, patches, original) VALUES (?, ?, ?, ?, ?, ?)',
+      (self.run, key, digest, int(record.created), patches, record.original)
+    )
+
+  def runs(self) -> list[tuple[int, str, int]]:
+    """ Return the number, the start time and the number of files of every run which can be undone. """
+    rows: list[tuple[int, str, int]] = self.connection.execute(
+      'SELECT runs.id, started, COUNT(*) FROM runs JOIN files ON files.run = runs.id GROUP BY runs.id ORDER BY runs.id'
+    ).fetchall()
+    return rows
+
+  def undo(self, manifest: Manifest, run: int | None = None, keys: list[str] | None = None,
+           report: Callable[[str], None] = print) -> int:
+    """ Restore the files modified by a run, by default the last one, or only the given files,
+    by default as they were before the last run which modified them.
+    A file which has changed since the run is left as it is, e.g. if it has been
+    modified by a later run, which has to be undone first. The restored files
+    are removed from the manifest, so that they are processed again by the next run.
+
+    :return: The number of restored files.
+    """
+    if keys is None:
+      if run is None:
+        run = self.connection.execute('SELECT MAX(run) FROM files').fetchone()[0]
+      rows = self.connection.execute(
+        'SELECT run, key, digest, created, patches, original FROM files WHERE run = ? ORDER BY key', (run,)
+      ).fetchall()
+    else:
+      rows = list()
+      for key in keys:
+        row = self.connection.execute(
+          'SELECT run, key, digest, created, patches, original FROM files WHERE key = ? AND run = COALESCE(?, run)'
+          ' ORDER BY run DESC LIMIT 1', (key, run)
+        ).fetchone()
+        if row is None:
+          report('There is nothing to undo for the file {0}.'.format(key))
+        else:
+          rows.append(row)
+    restored = 0
+    for row_run, key, digest, created, patches, original in rows:
+      filename = path.join(self.output_directory, *key.split('/'))
+      try:
+        changed = file_digest(filename) != digest
+      except OSError:
+        changed = True
+      if changed:
+        report('The file {0} has changed since run {1} and is left as it is.'.format(key, row_run))
+        continue
+      if created:
+        os.remove(filename)
+      else:
+        with open(filename, 'rb') as fin:
+          data = fin.read()
+        record = UndoRecord(False, None if patches is None else [tuple(patch) for patch in json.loads(patches)], original)
+        write_file(filename, restore(data, record))
+      manifest.update(key, None)
+      with self.connection:
+        self.connection.execute('DELETE FROM files WHERE run = ? AND key = ?', (row_run, key))
+      restored += 1
+    with self.connection:
+      self.connection.execute('DELETE FROM runs WHERE id NOT IN (SELECT run FROM files)')
+    return restored
+
+if __name__ == '__main__':
+  import tempfile
+  from io import BytesIO
+  print('Test started')
+  source = b'<w mrpNaN="x" mrp1="a"/><w mrp1="b"/>'
+  modified = b'<w mrp1="c" mrp2="d"/><w mrp1="b"/>'
+  record = record_patches([(3, 3, b'mrpNaN="x" '), (9, 10, b'a'), (11, 20, b'')])
+  assert restore(modified, record) == source
+  reader = CompressingReader(BytesIO(source))
+  assert reader.read(5) == source[:5]
+  assert restore(modified, reader.record()) == source
+  with tempfile.TemporaryDirectory() as directory:
+    filename = path.join(directory, 'a.xml')
+    with open(filename, 'wb') as fout:
+      fout.write(modified)
+    manifest = Manifest(directory, '')
+    journal = UndoJournal(directory)
+    journal.add('a.xml', file_digest(filename), record)
+    assert [(number, files) for number, _, files in journal.runs()] == [(1, 1)]
+    assert journal.undo(manifest, report=lambda message: None) == 1
+    with open(filename, 'rb') as fin:
+      assert fin.read() == source
+    assert journal.runs() == []
+    journal.close()
+  print('Test passed')
@@ -0,0 +1,221 @@
+import os
+import time
+from typing import Any, NamedTuple
+from change_sets import changes_filenames, load_change_sets
+from file_editor import FileTask, FileEditor, EditorSettings
+from manifest import Manifest
+from corpus_index import CorpusIndex
+from discovery import TaskStream, discover_tasks
+from undo_journal import UndoJournal
+from corpus_editor import (RunOptions, LogDestinations, LogFiles, Report, ignore, config_value, corpus_paths,
+                           make_editor, select_tasks, edit_tasks)
+
+# The size and the modification time in nanoseconds of a file.
+FileState = tuple[int, int]
+
+def file_state(filename: str) -> FileState | None:
+  """ Return the state of a file, None if it does not exist (any more). """
+  try:
+    stat = os.stat(filename)
+  except OSError:
+    return None
+  return stat.st_size, stat.st_mtime_ns
+
+class Batch(NamedTuple):
+  """ The modifications found by consecutive polls, which are processed together.
+
+  :param tasks: The changed files by their keys.
+  :param changes: Whether the changes files have changed.
+  """
+  tasks: dict[str, FileTask]
+  changes: bool
+
+class Watcher:
+  """ Keep the output directory up to date while the files of the corpus
+  and the changes files are being edited. The changes are compiled once
+  and kept in memory. The files are polled at a fixed interval: their sizes and
+  modification times are compared with those of the previous poll (the snapshot),
+  so no notifications of the operating system are needed. A file which has changed
+  is only processed if the manifest does not record it as processed already,
+  which leaves out the files written by the watcher itself.
+  The files changed by a burst of polls are processed together once a poll
+  finds nothing new. When the changes files change, the corpus is processed
+  again as by a new run.
+  """
+
+  def __init__(self, config: dict[str, Any], options: RunOptions = RunOptions(),
+               logs: LogDestinations = LogDestinations(), report: Report = ignore,
+               interval: float = 1.0, max_delay: float = 10.0):
+    """ :param interval: The time between two polls in seconds.
+    :param max_delay: The longest time in seconds a changed file waits for the end of a burst.
+    """
+    self.settings = EditorSettings.from_config(config)
+    self.changes_file = config_value(config, 'changesFile')
+    self.input_directory, self.output_directory, self.exclude = corpus_paths(config)
+    self.options = options
+    self.logs = logs
+    self.report = report
+    self.interval = interval
+    self.max_delay = max_delay
+    self.change_sets = load_change_sets(self.changes_file)
+    self.editor: FileEditor = make_editor(self.change_sets, self.settings, report)
+    self.manifest = Manifest(self.output_directory, self.editor.changes_digest)
+    self.snapshot = dict[str, FileState]()
+    self.changes_snapshot = self.snapshot_changes()
+    self.log_files = LogFiles(logs, self.names())
+
+  def names(self) -> list[str]:
+    return [change_set.name for change_set in self.change_sets]
+
+  def snapshot_changes(self) -> list[tuple[str, FileState | None]]:
+    """ Return the states of the changes files, which are empty while
+    the changes file is missing, e.g. while it is being saved.
+    """
+    try:
+      return [(filename, file_state(filename)) for _, filename in changes_filenames(self.changes_file)]
+    except ValueError:
+      return []
+
+  def take_snapshot(self) -> dict[str, tuple[FileTask, FileState]]:
+    """ Return the states of the files to be read, by their keys. """
+    snapshot = dict[str, tuple[FileTask, FileState]]()
+    for task in discover_tasks(self.input_directory, self.output_directory, self.exclude):
+      _, filename = task.input_file()
+      state = file_state(filename)
+      if state is not None:
+        snapshot[task.key] = task, state
+    return snapshot
+
+  def poll_files(self) -> dict[str, FileTask]:
+    """ Take a new snapshot of the files and return those changed since
+    the previous one and not yet processed in their current state.
+    """
+    snapshot = self.take_snapshot()
+    changed = dict[str, FileTask]()
+    for key, (task, state) in snapshot.items():
+      if self.snapshot.get(key) != state:
+        try:
+          if not self.manifest.is_unchanged(key, *task.input_file()):
+            changed[key] = task
+        except OSError:
+          continue
+    self.snapshot = {key: state for key, (_, state) in snapshot.items()}
+    return changed
+
+  def wait_for_batch(self) -> Batch:
+    """ Poll until something changes, then until a poll finds no further changes
+    or the first change has waited for max_delay.
+    """
+    tasks = dict[str, FileTask]()
+    changes = False
+    first_change: float | None = None
+    while True:
+      time.sleep(self.interval)
+      changed = self.poll_files()
+      changes_snapshot = self.snapshot_changes()
+      changes_changed = changes_snapshot != self.changes_snapshot
+      self.changes_snapshot = changes_snapshot
+      if len(changed) > 0 or changes_changed:
+        tasks.update(changed)
+        changes = changes or changes_changed
+        if first_change is None:
+          first_change = time.monotonic()
+        if time.monotonic() - first_change < self.max_delay:
+          continue
+      if first_change is not None:
+        return Batch(tasks, changes)
+
+  def reload_changes(self) -> bool:
+    """ Compile the changes files again. If they cannot be applied,
+    the previous changes are kept.
+
+    :return: Whether the changes differ from the previous ones.
+    """
+    try:
+      change_sets = load_change_sets(self.changes_file)
+      editor = make_editor(change_sets, self.settings, self.report)
+    except (ValueError, OSError) as error:
+      self.report('The previous changes are kept: {0}'.format(error))
+      return False
+    if editor.changes_digest == self.editor.changes_digest:
+      return False
+    names = [change_set.name for change_set in change_sets]
+    if names != self.names():
+      self.log_files.__exit__(None, None, None)
+      self.log_files = LogFiles(self.logs, names, append=True)
+      self.log_files.__enter__()
+    self.change_sets = change_sets
+    self.editor = editor
+    self.manifest.changes = editor.changes_digest
+    return True
+
+  def open_undo(self) -> UndoJournal | None:
+    """ Open the undo journal if it is kept. Every batch is recorded as a separate run. """
+    return UndoJournal(self.output_directory) if self.settings.undo_journal else None
+
+  def update_corpus(self) -> None:
+    """ Process all files which have not been processed with the current changes. """
+    start = time.perf_counter()
+    self.snapshot = {key: state for key, (_, state) in self.take_snapshot().items()}
+    index = CorpusIndex(self.output_directory) if self.options.use_index else None
+    tasks, total, indexed_tasks = select_tasks(self.editor, self.input_directory, self.output_directory,
+                                               self.exclude, self.manifest, index, False, self.report)
+    undo = self.open_undo()
+    try:
+      counters = edit_tasks(self.editor, self.change_sets, self.settings, tasks, self.manifest, total, self.options,
+                            undo=undo, report=self.report)
+      if index is None:
+        self.manifest.file_count = tasks.discovered
+    finally:
+      self.manifest.save()
+      if undo is not None:
+        undo.close()
+      if index is not None:
+        assert indexed_tasks is not None
+        index.update(((task.key, *task.input_file()) for task in indexed_tasks), remove_others=False)
+        index.close()
+    self.report('Processed {0} of {1} files ({2} modified) in {3:.2f} s.'.format(
+      tasks.discovered - tasks.unchanged, tasks.discovered, counters['modified'], time.perf_counter() - start))
+
+  def edit_changed(self, tasks: dict[str, FileTask]) -> None:
+    """ Process the changed files in the main process and report
+    the time from saving them to writing their output.
+    """
+    saved = [self.snapshot[key][1] for key in tasks if key in self.snapshot]
+    stream = TaskStream(list(tasks.values()), self.manifest, True)
+    options = self.options._replace(jobs=1, progress=False)
+    undo = self.open_undo()
+    try:
+      counters = edit_tasks(self.editor, self.change_sets, self.settings, stream, self.manifest, len(tasks), options,
+                            undo=undo, report=self.report)
+    finally:
+      self.manifest.save()
+      if undo is not None:
+        undo.close()
+    now = time.time_ns()
+    latencies = [(now - mtime) / 1e9 for mtime in saved]
+    self.report('Processed {0} changed files ({1} modified) {2:.2f} s after they were saved, '
+                'at most {3:.2f} s.'.format(len(tasks), counters['modified'],
+                                            sum(latencies) / max(1, len(latencies)), max(latencies, default=0.0)))
+
+  def watch(self, batches: int | None = None) -> None:
+    """ Bring the corpus up to date, then keep processing the changes until interrupted.
+
+    :param batches: The number of batches of changes after which to stop, None for no limit.
+    """
+    self.log_files.__enter__()
+    try:
+      self.update_corpus()
+      self.log_files.flush()
+      processed = 0
+      while batches is None or processed < batches:
+        batch = self.wait_for_batch()
+        if batch.changes and self.reload_changes():
+          self.report('The changes files have been modified, the corpus is processed again.')
+          self.update_corpus()
+        elif len(batch.tasks) > 0:
+          self.edit_changed(batch.tasks)
+        self.log_files.flush()
+        processed += 1
+    finally:
+      self.log_files.__exit__(None, None, None)